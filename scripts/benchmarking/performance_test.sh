@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 
 sort_jsonl_output(){
-	jq -s -c 'sort_by(.number)[]' $1 > jsonl/sorted.jsonl
+	python -m substreams_firehose.sort $1 --key number --output jsonl/sorted.jsonl --quiet
 	mv jsonl/sorted.jsonl $1
 }
 
@@ -11,17 +11,29 @@ import importlib
 import json
 import logging
 import os
+import sqlite3
+import sys
 from argparse import ArgumentError, ArgumentTypeError
 from datetime import datetime
+from functools import partial
 from pprint import pformat
 
 from hjson import HjsonDecodeError
 
 from substreams_firehose.args import check_period, parse_arguments
-from substreams_firehose.block_extractors.common import process_blocks
+from substreams_firehose.block_cache import BlockCache
+from substreams_firehose.block_extractors import replay
+from substreams_firehose.block_extractors.common import process_blocks_parallel, process_blocks_stream
+from substreams_firehose.block_processors.processors import get_batch_processor
+from substreams_firehose.capture import Recorder, load_capture
+from substreams_firehose.checkpoint import Checkpoint
 from substreams_firehose.config.parser import Config, StubConfig
 from substreams_firehose.config.parser import load_config, load_stub_config
+from substreams_firehose.json_backend import set_json_backend
 from substreams_firehose.requests import get_auth_token
+from substreams_firehose.sinks.common import get_sink, write_rows
+from substreams_firehose.sinks.compression import EXTENSIONS, get_compressor
+from substreams_firehose.sinks.shards import ShardedSink
 
 CONSOLE_HANDLER = logging.StreamHandler()
 
@@ -65,11 +77,20 @@ def main() -> int: #pylint: disable=too-many-statements, too-many-branches, too-
 
     # === Config loading ===
 
-    try:
-        stub_loaded = load_config(args.config, args.grpc_entry)
-    except (HjsonDecodeError, ArgumentTypeError, ImportError, KeyError) as error:
-        logging.critical('Error loading config file: %s', error)
-        raise
+    if args.replay:
+        # The recorded config replaces the main config file, the stub config can still be overridden (e.g. output filters)
+        try:
+            load_capture(args.replay)
+            stub_loaded = True
+        except (OSError, json.JSONDecodeError, ImportError, KeyError) as error:
+            logging.critical('Error loading capture directory "%s": %s', args.replay, error)
+            raise
+    else:
+        try:
+            stub_loaded = load_config(args.config, args.grpc_entry)
+        except (HjsonDecodeError, ArgumentTypeError, ImportError, KeyError) as error:
+            logging.critical('Error loading config file: %s', error)
+            raise
 
     if args.stub:
         try:
@@ -87,7 +108,8 @@ def main() -> int: #pylint: disable=too-many-statements, too-many-branches, too-
     # === JWT token validation ===
 
     try:
-        get_auth_token()
+        if not args.replay and not Config.INSECURE:
+            get_auth_token()
     except RuntimeError:
         logging.critical('Could not get authentication token from endpoint "%s", aborting...', Config.AUTH_ENDPOINT)
         raise
@@ -101,25 +123,94 @@ def main() -> int: #pylint: disable=too-many-statements, too-many-branches, too-
         logging.critical('Period start must be less than or equal to period end')
         raise ArgumentError
 
-    out_file = f'jsonl/{Config.CHAIN}_{args.start}_to_{args.end}.jsonl'
-    if args.out_file != 'jsonl/{chain}_{start}_to_{end}.jsonl':
-        out_file = args.out_file
+    try:
+        json_backend = set_json_backend(args.json_backend)
+    except ImportError as error:
+        logging.critical('Could not load "%s" JSON backend: %s', args.json_backend, error)
+        raise
+
+    logging.debug('Using "%s" JSON backend', json_backend.name)
 
     try:
-        block_extractor = getattr(
-            importlib.import_module(
-                f'substreams_firehose.block_extractors.async_{args.extractor + ("_channel" if args.extractor != "optimized" else "")}'
-            ),
-            'asyncio_main'
-        )
-    except (AttributeError, TypeError) as exception:
-        logging.critical('Could not load block extractor function: %s', exception)
+        sink_class = get_sink(args.output_format)
+    except ImportError as error:
+        logging.critical('Could not load "%s" output format: %s', args.output_format, error)
         raise
 
+    sink_options = {}
+    if args.no_json_output:
+        if args.output_format == 'jsonl':
+            sink_options['json_output'] = False
+        else:
+            logging.warning('The "--no-json-output" flag only applies to the "jsonl" output format, ignoring it')
+
+    if args.output_format == 'parquet':
+        # The sink reads the selected fields natively from the output messages instead of their JSON representation
+        args.custom_processor = {
+            'default_processor': 'message_processor',
+            'default_substream_processor': 'substream_message_processor',
+        }.get(args.custom_processor, args.custom_processor)
+
+        sink_options['keys_filter'] = StubConfig.RESPONSE_PARAMETERS
+        if args.custom_processor == 'substream_message_processor':
+            if len(StubConfig.RESPONSE_PARAMETERS) != 1:
+                logging.critical('Parquet output requires a single Substreams output module (one schema per file)')
+                raise ArgumentError
+            sink_options['keys_filter'] = next(iter(StubConfig.RESPONSE_PARAMETERS.values()))
+
+    if args.output_format == 'jsonl' and not args.no_json_output:
+        filters = [StubConfig.RESPONSE_PARAMETERS]
+        if args.custom_processor == 'default_substream_processor':
+            filters = list(StubConfig.RESPONSE_PARAMETERS.values())
+
+        # Without any output filter, the JSON text is encoded straight from the output messages (same output)
+        if (args.custom_processor in ('default_processor', 'default_substream_processor')
+            and all(not isinstance(keys_filter, dict) or not keys_filter for keys_filter in filters)):
+            args.custom_processor = {
+                'default_processor': 'json_text_processor',
+                'default_substream_processor': 'substream_json_text_processor',
+            }[args.custom_processor]
+            sink_options['json_output'] = False
+            logging.debug('No output filter, encoding the JSON output directly with "%s"', args.custom_processor)
+
+    extension = sink_class.extension
+    if args.compress:
+        sink_options['compression'] = args.compress
+        if args.output_format != 'parquet':
+            try:
+                get_compressor(args.compress)
+            except ImportError as error:
+                logging.critical('Could not load "%s" compression: %s', args.compress, error)
+                raise
+            extension += EXTENSIONS[args.compress]
+
+    out_file = f'{args.output_format}/{Config.CHAIN}_{args.start}_to_{args.end}{extension}'
+    if args.out_file != '{format}/{chain}_{start}_to_{end}{extension}':
+        out_file = args.out_file
+
+    if args.replay and (args.record or args.resume or args.cache):
+        logging.critical('Replaying a capture cannot be combined with "--record", "--resume" or "--cache"')
+        raise ArgumentError
+
+    if args.replay:
+        block_extractor = partial(replay.asyncio_generator, capture=args.replay)
+    else:
+        try:
+            block_extractor = getattr(
+                importlib.import_module(
+                    f'substreams_firehose.block_extractors.async_{args.extractor + ("_channel" if args.extractor != "optimized" else "")}'
+                ),
+                'asyncio_generator'
+            )
+        except (AttributeError, TypeError) as exception:
+            logging.critical('Could not load block extractor function: %s', exception)
+            raise
+
     module, function = ('substreams_firehose.block_processors.processors', args.custom_processor)
 
     try:
-        block_processor = getattr(importlib.import_module(module), function)
+        # Batch processors defined alongside the block processor amortize the per-block overhead
+        block_processor = get_batch_processor(getattr(importlib.import_module(module), function))
     except (AttributeError, TypeError) as exception:
         logging.critical('Could not load block processing function: %s', exception)
         raise
@@ -133,20 +224,48 @@ def main() -> int: #pylint: disable=too-many-statements, too-many-branches, too-
 
     args.request_parameters = request_parameters_args
 
-    # === Main methods calls ===
+    if args.processing_workers < 0 or args.processing_chunk_size < 1 or args.queue_size < 1 or args.output_batch_size < 1:
+        logging.critical('Processing workers must be positive, chunk size, queue size and output batch size strictly positive')
+        raise ArgumentError
 
-    data = process_blocks(
-        asyncio.run(
-            block_extractor(
-                period_start=args.start,
-                period_end=args.end,
-                **args.request_parameters
-            )
-        ),
-        block_processor=block_processor
-    )
+    if args.ordered and args.reorder_size < 1:
+        logging.critical('Reorder size must be strictly positive')
+        raise ArgumentError
+
+    shard_limits = (args.shard_blocks, args.shard_rows, args.shard_size)
+    if any(limit is not None and limit < 1 for limit in shard_limits):
+        logging.critical('Shard blocks, rows and size must be strictly positive')
+        raise ArgumentError
+
+    block_cache = None
+    if args.cache:
+        try:
+            block_cache = BlockCache(args.cache, args.cache_size * 1024 * 1024)
+        except sqlite3.Error as error:
+            logging.critical('Could not open block cache "%s": %s', args.cache, error)
+            raise
 
-    # === Output data to file ===
+    checkpoint_file = f'{out_file}.checkpoint'
+    if args.checkpoint != '{out_file}.checkpoint':
+        checkpoint_file = args.checkpoint
+
+    if args.resume:
+        try:
+            checkpoint = Checkpoint.load(checkpoint_file)
+        except (OSError, json.JSONDecodeError, KeyError) as error:
+            logging.critical('Could not load checkpoint file "%s": %s', checkpoint_file, error)
+            raise
+
+        if (checkpoint.period_start, checkpoint.period_end) != (args.start, args.end):
+            logging.critical('Checkpoint period [%i, %i] does not match the requested period [%i, %i]',
+                checkpoint.period_start,
+                checkpoint.period_end,
+                args.start,
+                args.end
+            )
+            raise ArgumentError
+    else:
+        checkpoint = Checkpoint(checkpoint_file, args.start, args.end)
 
     try:
         os.makedirs(os.path.dirname(out_file), exist_ok=True)
@@ -154,19 +273,100 @@ def main() -> int: #pylint: disable=too-many-statements, too-many-branches, too-
         # File is not found if is not inside a folder and doesn't exists yet
         pass
 
+    recorder = None
+    if args.record:
+        # Resuming appends the responses of the remaining blocks to the capture of the failed extraction
+        recorder = Recorder(args.record, args.compress or 'gzip', append=args.resume)
+        try:
+            recorder.open(args.start, args.end, args.request_parameters)
+        except (OSError, ImportError) as error:
+            logging.critical('Could not open capture directory "%s": %s', args.record, error)
+            raise
+
+    # === Main methods calls ===
+
+    raw_blocks = block_extractor(
+        period_start=args.start,
+        period_end=args.end,
+        queue_size=args.queue_size,
+        checkpoint=checkpoint,
+        block_cache=block_cache,
+        lazy_decoding=args.lazy_decoding,
+        ordered=args.ordered,
+        reorder_size=args.reorder_size,
+        recorder=recorder,
+        **args.request_parameters
+    )
+
+    if args.processing_workers:
+        data = process_blocks_parallel(
+            raw_blocks,
+            block_processor=block_processor,
+            workers=args.processing_workers,
+            chunk_size=args.processing_chunk_size,
+            use_threads=args.processing_pool == 'thread',
+            checkpoint=checkpoint
+        )
+    else:
+        data = process_blocks_stream(
+            raw_blocks,
+            block_processor=block_processor,
+            checkpoint=checkpoint,
+            batch_size=args.processing_chunk_size
+        )
+
+    # Blocks are streamed, processed and written to the output file incrementally
+    rows = 0
+    if any(shard_limits):
+        sink = ShardedSink(out_file, sink_class, append=args.resume, max_blocks=args.shard_blocks,
+                           max_rows=args.shard_rows, max_size=args.shard_size and args.shard_size * 1024 * 1024,
+                           **sink_options)
+    else:
+        sink = sink_class(out_file, append=args.resume, **sink_options)
+
+    # Ranges given up after reaching the maximum number of retries
+    unfinished = []
     try:
-        with open(out_file, 'w', encoding='utf8') as out:
-            for entry in data:
-                if args.no_json_output:
-                    out.write(entry)
-                else:
-                    json.dump(entry, out) # TODO: Add exception handling
-                out.write('\n')
+        # Resuming appends the remaining blocks to the output of the failed extraction
+        with sink:
+            try:
+                rows = asyncio.run(write_rows(data, sink, args.output_batch_size, checkpoint))
+                unfinished = checkpoint.pending_ranges()
+                if unfinished:
+                    checkpoint.save()
+            except BaseException:
+                # Save the progress of the extraction for resuming it later with `--resume`
+                checkpoint.save()
+                logging.critical('Extraction failed, resume it using the "--resume" option (checkpoint saved to "%s")',
+                    checkpoint_file
+                )
+                raise
     except OSError as error:
         logging.error('Could not write out file to "%s": %s', out_file, error)
+    else:
+        if not unfinished:
+            checkpoint.remove()
+    finally:
+        if block_cache:
+            logging.info('Read %i blocks from cache, streamed %i blocks', block_cache.hits, block_cache.misses)
+            block_cache.close()
+        if recorder:
+            recorder.close()
+
+    if unfinished:
+        logging.critical('Extraction incomplete, %i ranges are missing blocks: %s',
+            len(unfinished),
+            ', '.join(f'[{start}, {end}]' for start, end in unfinished)
+        )
+        logging.critical('Wrote %i rows of data to %s, resume it using the "--resume" option (checkpoint saved to "%s")',
+            rows,
+            out_file,
+            checkpoint_file
+        )
+        return 1
 
-    logging.info('Wrote %i rows of data to %s [SUCCESS]', len(data), out_file)
+    logging.info('Wrote %i rows of data to %s [SUCCESS]', rows, out_file)
     return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
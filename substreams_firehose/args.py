@@ -50,8 +50,22 @@ def parse_arguments() -> argparse.Namespace:
                             help='config file path in HJSON or JSON format')
     arg_parser.add_argument('-s', '--stub', type=str,
                             help='stub config file path in HJSON or JSON format')
-    arg_parser.add_argument('-o', '--out-file', type=str, default='jsonl/{chain}_{start}_to_{end}.jsonl',
+    arg_parser.add_argument('-o', '--out-file', type=str, default='{format}/{chain}_{start}_to_{end}{extension}',
                             help='output file path')
+    arg_parser.add_argument('-f', '--output-format', choices=['jsonl', 'csv', 'protobuf', 'parquet'], default='jsonl',
+                            help='format of the output file (protobuf writes length-delimited binary messages, parquet requires pyarrow)')
+    arg_parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                            help='compress the output file in independent frames indexed in "<out_file>.index" (zstd requires zstandard)')
+    arg_parser.add_argument('--json-backend', choices=['orjson', 'stdlib'], default='stdlib',
+                            help='JSON encoder/decoder of the output data (orjson is faster but writes compact JSON)')
+    arg_parser.add_argument('--output-batch-size', type=int, default=1000,
+                            help='number of rows written at once to the output file')
+    arg_parser.add_argument('--shard-blocks', type=int,
+                            help='roll the output to a new shard file every N blocks (shards listed in "<out_file root>.manifest.jsonl")')
+    arg_parser.add_argument('--shard-rows', type=int,
+                            help='roll the output to a new shard file every N rows (at block boundaries)')
+    arg_parser.add_argument('--shard-size', type=int,
+                            help='roll the output to a new shard file once it reaches the given size (in MB, at block boundaries)')
     arg_parser.add_argument('-l', '--log', nargs='?', type=str, const=None, default='logs/{datetime}.log',
                             help='log debug information to log file (can specify the full path)')
     arg_parser.add_argument('-q', '--quiet', action='store_true',
@@ -62,6 +76,32 @@ def parse_arguments() -> argparse.Namespace:
                             help='type of extractor used for streaming blocks from the gRPC endpoint')
     arg_parser.add_argument('-p', '--custom-processor', type=str, default='default_processor',
                             help='name of a custom block processing function located in the "block_processors.processors" module')
+    arg_parser.add_argument('-w', '--processing-workers', type=int, default=0,
+                            help='number of worker processes used for block processing (0 to process blocks in the main process)')
+    arg_parser.add_argument('--processing-chunk-size', type=int, default=100,
+                            help='number of blocks sent at once to a block processing worker (or to a batch block processor)')
+    arg_parser.add_argument('--processing-pool', choices=['process', 'thread'], default='process',
+                            help='type of workers used for block processing (threads skip block serialization but are limited by the GIL)')
+    arg_parser.add_argument('--lazy-decoding', action='store_true',
+                            help='keep extracted blocks serialized until they are processed (lower memory usage)')
+    arg_parser.add_argument('--queue-size', type=int, default=1000,
+                            help='maximum number of extracted blocks waiting for processing before pausing the extraction')
+    arg_parser.add_argument('--ordered', action='store_true',
+                            help='write the blocks in block number order (the earliest ranges are extracted first)')
+    arg_parser.add_argument('--reorder-size', type=int, default=10000,
+                            help='maximum number of blocks waiting for earlier blocks before pausing the extraction (with --ordered)')
+    arg_parser.add_argument('--checkpoint', type=str, default='{out_file}.checkpoint',
+                            help='checkpoint file path used for saving the extraction progress')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='resume a failed extraction from its checkpoint file, appending to the output file')
+    arg_parser.add_argument('--cache', nargs='?', type=str, const='cache/blocks.sqlite', default=None,
+                            help='cache extracted blocks in a local database, only streaming missing blocks (can specify the full path)')
+    arg_parser.add_argument('--cache-size', type=int, default=1024,
+                            help='maximum size (in MB) of the block cache before evicting the least recently used blocks')
+    arg_parser.add_argument('--record', type=str,
+                            help='record the raw gRPC responses to a capture directory for replaying them later (see --compress)')
+    arg_parser.add_argument('--replay', type=str,
+                            help='replay the raw gRPC responses of a capture directory instead of the endpoint (without main config)')
     arg_parser.add_argument('--no-json-output', action='store_true',
                             help='don\'t try to convert block processor output to JSON')
     arg_parser.add_argument('--overwrite-log', action='store_true',
@@ -0,0 +1,302 @@
+"""
+SPDX-License-Identifier: MIT
+
+Benchmarks of the extraction and processing stages, on recorded or synthetic blocks.
+
+```console
+$ python -m substreams_firehose.benchmark json-output
+$ python -m substreams_firehose.benchmark json-output recorded/eth.binpb --repeat 5
+$ python -m substreams_firehose.benchmark extraction --chains ethereum --latency 0.05 --bandwidth 20
+```
+
+Recorded blocks are read from streams of length-delimited packed blocks (`google.protobuf.Any`), as written by
+`--output-format protobuf --custom-processor message_processor`, or from capture directories of raw gRPC responses (see
+`capture`, `--record`). Without recordings, synthetic blocks are built for each supported chain type by filling every
+field of their message type (see `mock_server.synthetic_block`).
+
+Benchmarks:
+- `json-output`: JSON output of unfiltered blocks, going through a dictionary (`default_processor` and the `dumps`
+  function of the JSON backend) or encoding the JSON text straight from the messages (`json_text_processor`).
+- `json-backend`: JSON encoding (dictionary and direct routes) and decoding of the blocks with each installed JSON
+  backend (see `json_backend`).
+- `extraction`: extraction of a block range with each block extractor through each block streaming service, from a local
+  mock server serving the blocks (see `mock_server`) with the given latency, bandwidth and concurrency limits.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections.abc import AsyncIterator, Callable, Iterable
+
+import grpc
+from google.protobuf.any_pb2 import Any as AnyMessage #pylint: disable=no-name-in-module
+
+from substreams_firehose.block_extractors import async_multi_channel, async_optimized, async_single_channel
+from substreams_firehose.block_extractors.common import get_block_number
+from substreams_firehose.capture import read_capture_blocks
+from substreams_firehose.block_processors.projection import get_json_encoder, get_projection
+from substreams_firehose.config.parser import Config, RetryPolicy, load_stub_config
+from substreams_firehose.json_backend import BACKENDS, get_json_backend, set_json_backend
+from substreams_firehose.mock_server import CHAIN_BLOCKS, mock_server_process, read_recorded_blocks, synthetic_block
+from substreams_firehose.utils import generate_proto_messages_classes
+
+# Block extractor of each `--extractor` option
+EXTRACTORS = {
+    'single': async_single_channel.asyncio_generator,
+    'multi': async_multi_channel.asyncio_generator,
+    'optimized': async_optimized.asyncio_generator,
+}
+
+# Default stub config of each block streaming service
+SERVICE_STUBS = {
+    'firehose': 'substreams_firehose/config/firehose/default.hjson',
+    'substreams': 'substreams_firehose/config/substreams/default.hjson',
+    'dfuse': 'substreams_firehose/config/dfuse/default.hjson',
+}
+
+def measure(function: Callable[[list], Iterable], blocks: list, repeat: int) -> tuple[float, list]:
+    """
+    Measure the best time of processing all the blocks.
+
+    Args:
+        function: The processing function, called with the list of blocks.
+        blocks: The blocks.
+        repeat: The number of measures.
+
+    Returns:
+        The best time (in seconds) and the result of the last call.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = list(function(blocks))
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+def benchmark_json_output(samples: dict[str, list[AnyMessage]], args: argparse.Namespace) -> bool:
+    """
+    Compare the JSON output of unfiltered blocks through a dictionary and encoded straight from the messages.
+
+    Args:
+        samples: The packed blocks of each sample.
+        args: The command-line arguments (see `main`).
+
+    Returns:
+        Whether both routes produced the same JSON text for all the samples.
+    """
+    dumps = get_json_backend().dumps
+    routes = {
+        'dictionary': lambda blocks: [dumps(get_projection(block.DESCRIPTOR, {})(block)) for block in blocks],
+        'direct text': lambda blocks: [get_json_encoder(block.DESCRIPTOR)(block) for block in blocks],
+    }
+
+    identical = True
+    print(f'{"sample":<12} {"blocks":>7} {"route":<12} {"blocks/s":>10} {"MB/s":>8} {"speedup":>8}')
+    for name, blocks in samples.items():
+        reference = None
+        for route, function in routes.items():
+            seconds, lines = measure(function, blocks, args.repeat)
+            size = sum(map(len, lines)) / (1 << 20)
+            reference = reference or seconds
+            print(f'{name:<12} {len(blocks):>7} {route:<12} {len(blocks) / seconds:>10.0f} {size / seconds:>8.1f} '
+                  f'{reference / seconds:>7.2f}x')
+
+            if route == 'dictionary':
+                expected = lines
+            elif lines != expected:
+                logging.error('"%s" route produced a different output for the "%s" sample', route, name)
+                identical = False
+
+    return identical
+
+def benchmark_json_backend(samples: dict[str, list[AnyMessage]], args: argparse.Namespace) -> bool: #pylint: disable=too-many-locals
+    """
+    Compare the JSON backends encoding the dictionaries of the blocks, encoding the blocks directly and decoding the \
+    encoded blocks.
+
+    Args:
+        samples: The packed blocks of each sample.
+        args: The command-line arguments (see `main`).
+
+    Returns:
+        Whether all the backends encoded the same JSON values for all the samples.
+    """
+    backends = []
+    for factory in BACKENDS.values():
+        try:
+            backends.append(factory())
+        except ImportError as error:
+            logging.info('Skipping JSON backend: %s', error)
+
+    identical = True
+    print(f'{"sample":<12} {"backend":<8} {"encode MB/s":>12} {"direct MB/s":>12} {"decode MB/s":>12}')
+    for name, blocks in samples.items():
+        rows = [get_projection(block.DESCRIPTOR, {})(block) for block in blocks]
+        expected = None
+        for backend in backends:
+            encode_seconds, lines = measure(lambda rows, dumps=backend.dumps: map(dumps, rows), rows, args.repeat)
+            direct_seconds, direct_lines = measure(
+                lambda blocks, backend=backend: [
+                    get_json_encoder(block.DESCRIPTOR, backend)(block) for block in blocks
+                ],
+                blocks,
+                args.repeat
+            )
+            decode_seconds, values = measure(lambda lines, loads=backend.loads: map(loads, lines), lines, args.repeat)
+
+            size = sum(map(len, lines)) / (1 << 20)
+            print(f'{name:<12} {backend.name:<8} {size / encode_seconds:>12.1f} {size / direct_seconds:>12.1f} '
+                  f'{size / decode_seconds:>12.1f}')
+
+            if direct_lines != lines:
+                logging.error('Direct encoding differs from the "%s" backend for the "%s" sample', backend.name, name)
+                identical = False
+
+            expected = expected or values
+            if values != expected or values != rows:
+                logging.error('"%s" backend decoded different values for the "%s" sample', backend.name, name)
+                identical = False
+
+    return identical
+
+async def _extract_blocks(block_extractor: Callable[..., AsyncIterator], start: int, end: int) -> list[tuple[int, int]]:
+    """
+    Extract a block range, keeping the number and size of each extracted block.
+    """
+    return [
+        (get_block_number(block), block.ByteSize())
+        async for block in block_extractor(period_start=start, period_end=end)
+    ]
+
+def benchmark_extraction(samples: dict[str, list[AnyMessage]], args: argparse.Namespace) -> bool:
+    """
+    Compare the block extractors extracting a block range from a local mock server serving the blocks of each sample, \
+    through each block streaming service.
+
+    The mock server runs in a separate process, with the latency, bandwidth and concurrency limits of the arguments.
+
+    Args:
+        samples: The packed blocks of each sample.
+        args: The command-line arguments (see `main`).
+
+    Returns:
+        Whether all the extractors extracted each block of the range exactly once.
+    """
+    Config.CHAIN = 'LOCAL'
+    Config.INSECURE = True
+    Config.COMPRESSION = grpc.Compression.NoCompression
+    Config.MAX_BLOCK_SIZE = 1 << 30
+    Config.MAX_FAILED_BLOCK_RETRIES = 3
+    Config.RETRY_POLICY = RetryPolicy()
+
+    start, end = 0, args.extract_blocks - 1
+    expected = list(range(start, end + 1))
+
+    identical = True
+    print(f'{"sample":<12} {"service":<11} {"extractor":<10} {"blocks/s":>10} {"MB/s":>8}')
+    for name, blocks in samples.items():
+        with mock_server_process(
+            blocks,
+            args.block_size,
+            latency=args.latency,
+            bandwidth=args.bandwidth and args.bandwidth * 1024 * 1024,
+            max_streams=args.max_streams,
+            max_connection_streams=args.max_connection_streams
+        ) as port:
+            Config.GRPC_ENDPOINT = f'localhost:{port}'
+            for service in args.services:
+                load_stub_config(SERVICE_STUBS[service])
+                for extractor in args.extractors:
+                    seconds, extracted = measure(
+                        lambda _, extractor=extractor: asyncio.run(_extract_blocks(EXTRACTORS[extractor], start, end)),
+                        [],
+                        args.repeat
+                    )
+
+                    size = sum(block_size for _, block_size in extracted) / (1 << 20)
+                    print(f'{name:<12} {service:<11} {extractor:<10} {len(extracted) / seconds:>10.0f} '
+                          f'{size / seconds:>8.1f}')
+
+                    numbers = [number for number, _ in extracted]
+                    # Blocks without a top-level number field (e.g. NEAR) are only counted
+                    if (sorted(numbers) if None not in numbers else list(range(start, start + len(numbers)))) != expected:
+                        logging.error('"%s" extractor did not extract each block once through "%s" for the "%s" sample',
+                            extractor,
+                            service,
+                            name
+                        )
+                        identical = False
+
+    return identical
+
+BENCHMARKS = {
+    'extraction': benchmark_extraction,
+    'json-backend': benchmark_json_backend,
+    'json-output': benchmark_json_output,
+}
+
+def main() -> int:
+    """
+    Main function for parsing arguments and running a benchmark.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark the processing stages on recorded or synthetic blocks.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument('benchmark', choices=list(BENCHMARKS),
+                            help='benchmark to run')
+    arg_parser.add_argument('recorded', nargs='*', type=str,
+                            help='recorded blocks files (length-delimited packed blocks) or capture directories, synthetic if not set')
+    arg_parser.add_argument('-c', '--chains', nargs='+', choices=list(CHAIN_BLOCKS), default=list(CHAIN_BLOCKS),
+                            help='chain types of the synthetic blocks')
+    arg_parser.add_argument('-b', '--blocks', type=int, default=200,
+                            help='number of synthetic blocks of each chain type')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=3,
+                            help='number of measures (the best one is kept)')
+    arg_parser.add_argument('--json-backend', choices=list(BACKENDS), default='stdlib',
+                            help='JSON backend of the json-output benchmark')
+
+    extraction_group = arg_parser.add_argument_group('extraction benchmark')
+    extraction_group.add_argument('--services', nargs='+', choices=list(SERVICE_STUBS), default=list(SERVICE_STUBS),
+                                  help='block streaming services')
+    extraction_group.add_argument('--extractors', nargs='+', choices=list(EXTRACTORS), default=list(EXTRACTORS),
+                                  help='block extractors')
+    extraction_group.add_argument('--extract-blocks', type=int, default=5000,
+                                  help='number of blocks extracted')
+    extraction_group.add_argument('--block-size', type=int, default=None,
+                                  help='minimum size (in bytes) of the served blocks, padded if smaller')
+    extraction_group.add_argument('--latency', type=float, default=0.,
+                                  help='delay (in seconds) before the first block of each stream')
+    extraction_group.add_argument('--bandwidth', type=float, default=None,
+                                  help='maximum throughput (in MB/s) of each stream')
+    extraction_group.add_argument('--max-streams', type=int, default=None,
+                                  help='maximum number of concurrent streams, further streams being rejected')
+    extraction_group.add_argument('--max-connection-streams', type=int, default=None,
+                                  help='maximum number of concurrent streams of each HTTP/2 connection')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    logging.addLevelName(logging.INFO, '[*]')
+    logging.addLevelName(logging.ERROR, '[ERROR]')
+
+    Config.PROTO_MESSAGES_CLASSES = generate_proto_messages_classes()
+    set_json_backend(args.json_backend)
+
+    if args.recorded:
+        samples = {
+            path.rstrip('/').rsplit('/', 1)[-1]: read_capture_blocks(path) if os.path.isdir(path) else read_recorded_blocks(path)
+            for path in args.recorded
+        }
+    else:
+        samples = {
+            chain: [synthetic_block(CHAIN_BLOCKS[chain], number) for number in range(args.blocks)]
+            for chain in args.chains
+        }
+
+    return 0 if BENCHMARKS[args.benchmark](samples, args) else 1
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+SPDX-License-Identifier: MIT
+
+Persists the responses of the gRPC streams to a local cache, allowing to extract the same blocks again (e.g. with a
+different block processor) at disk speed instead of network speed.
+
+Responses are stored in an SQLite database by segment, a range of blocks that has been fully streamed for a given
+endpoint and request. Requests are identified by a hash of their parameters, excluding the block range and cursor.
+Segments are evicted as a whole, least recently used first, once the cache grows past its maximum size: a cached range
+is always complete, even if it holds no blocks at all.
+
+All the database work happens on a dedicated thread, off the event loop: the streamed blocks are written as segments of
+`segment_blocks` blocks while the stream progresses and cached blocks are read by batches of `read_batch_size` rows.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import AsyncIterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from google.protobuf.message import Message
+
+from substreams_firehose.config.parser import Config
+
+# Request fields excluded from the request hash
+RANGE_FIELDS = ('start_block_num', 'stop_block_num', 'start_cursor', 'cursor')
+
+class BlockCache: #pylint: disable=too-many-instance-attributes
+    """
+    Store the gRPC stream responses of each block to an SQLite database, keyed by endpoint, request hash and block \
+    number.
+
+    Attributes:
+        path: The cache database file path.
+        max_size: The maximum size (in bytes) of the cached responses.
+        endpoint: The gRPC endpoint the cached responses are coming from.
+        segment_blocks: The number of streamed blocks after which a segment is written to the cache.
+        read_batch_size: The number of cached blocks read at once from the database.
+        hits: The number of responses read from the cache.
+        misses: The number of responses stored to the cache after being streamed from the endpoint.
+    """
+    def __init__(self, path: str, max_size: int = 1 << 30, endpoint: str | None = None, #pylint: disable=too-many-arguments
+                 segment_blocks: int = 100, read_batch_size: int = 100) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.endpoint = endpoint or Config.GRPC_ENDPOINT
+        self.segment_blocks = segment_blocks
+        self.read_batch_size = read_batch_size
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # The connection is only used by the database thread once opened
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='block_cache')
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                request_hash TEXT NOT NULL,
+                start_block INTEGER NOT NULL,
+                end_block INTEGER NOT NULL,
+                response_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS segments_request ON segments (endpoint, request_hash, start_block);
+            CREATE INDEX IF NOT EXISTS segments_access ON segments (last_access);
+            CREATE TABLE IF NOT EXISTS blocks (
+                segment_id INTEGER NOT NULL,
+                block_number INTEGER NOT NULL,
+                response BLOB NOT NULL,
+                PRIMARY KEY (segment_id, block_number)
+            ) WITHOUT ROWID;
+        ''')
+
+    @staticmethod
+    def request_hash(method: str, request: Message) -> str:
+        """
+        Hash a request, ignoring its block range and cursor.
+
+        Args:
+            method: The name of the service method called with the request.
+            request: The request object sent to the gRPC endpoint.
+
+        Returns:
+            The hexadecimal digest of the request.
+        """
+        request = type(request).FromString(request.SerializeToString())
+        for name in RANGE_FIELDS:
+            if name in request.DESCRIPTOR.fields_by_name:
+                request.ClearField(name)
+
+        digest = hashlib.sha256(f'{method}:{request.DESCRIPTOR.full_name}:'.encode())
+        digest.update(request.SerializeToString(deterministic=True))
+        return digest.hexdigest()
+
+    async def _run(self, function, *args):
+        """
+        Run a database function on the database thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def lookup(self, request_hash: str, start: int, end: int) -> list[tuple[int, int, bool]]:
+        """
+        Split a block range between its cached and missing parts.
+
+        Args:
+            request_hash: The hash of the request (see `request_hash`).
+            start: The first block of the range.
+            end: The last block of the range.
+
+        Returns:
+            The consecutive sub-ranges covering the range as `(start, end, cached)` tuples.
+        """
+        return await self._run(self._lookup, request_hash, start, end)
+
+    def _lookup(self, request_hash: str, start: int, end: int) -> list[tuple[int, int, bool]]:
+        segments = self._connection.execute(
+            'SELECT start_block, end_block FROM segments '
+            'WHERE endpoint = ? AND request_hash = ? AND end_block >= ? AND start_block <= ? ORDER BY start_block',
+            (self.endpoint, request_hash, start, end)
+        )
+
+        ranges = []
+        position = start
+        for segment_start, segment_end in segments:
+            if segment_end < position:
+                continue
+
+            if segment_start > position:
+                ranges.append((position, segment_start - 1, False))
+                position = segment_start
+
+            segment_end = min(segment_end, end)
+            if ranges and ranges[-1][2]:
+                # Merge adjacent cached segments
+                ranges[-1] = (ranges[-1][0], segment_end, True)
+            else:
+                ranges.append((position, segment_end, True))
+            position = segment_end + 1
+
+        if position <= end:
+            ranges.append((position, end, False))
+
+        return ranges
+
+    async def get(self, request_hash: str, start: int, end: int) -> AsyncIterator[Message]:
+        """
+        Read the cached responses of a block range, in block order.
+
+        The responses are read lazily, `read_batch_size` blocks at a time.
+
+        Args:
+            request_hash: The hash of the request (see `request_hash`).
+            start: The first block of the range.
+            end: The last block of the range.
+
+        Yields:
+            The responses received from the gRPC stream for each cached block of the range.
+
+        Raises:
+            KeyError: If the response type is not present in the loaded `.proto` definitions.
+        """
+        cursor = await self._run(self._select, request_hash, start, end)
+
+        previous_block = None
+        while rows := await self._run(cursor.fetchmany, self.read_batch_size):
+            for response_type, block_number, response in rows:
+                # Overlapping segments may hold the same block
+                if block_number == previous_block:
+                    continue
+
+                previous_block = block_number
+                self.hits += 1
+                yield Config.PROTO_MESSAGES_CLASSES[response_type].FromString(response)
+
+    def _select(self, request_hash: str, start: int, end: int) -> sqlite3.Cursor:
+        segments = (self.endpoint, request_hash, start, end)
+        with self._connection:
+            self._connection.execute(
+                'UPDATE segments SET last_access = ? '
+                'WHERE endpoint = ? AND request_hash = ? AND end_block >= ? AND start_block <= ?',
+                (time.time(), *segments)
+            )
+
+        return self._connection.execute(
+            'SELECT response_type, block_number, response FROM blocks '
+            'JOIN segments ON blocks.segment_id = segments.id '
+            'WHERE endpoint = ? AND request_hash = ? AND end_block >= ? AND start_block <= ? '
+            'AND block_number BETWEEN ? AND ? ORDER BY block_number',
+            (*segments, start, end)
+        )
+
+    async def put(self, request_hash: str, start: int, end: int, responses: Sequence[tuple[int, Message]]) -> None:
+        """
+        Store the responses of a fully streamed block range as a segment, evicting the least recently used segments \
+        if needed.
+
+        Args:
+            request_hash: The hash of the request (see `request_hash`).
+            start: The first block of the range.
+            end: The last block of the range.
+            responses: The block number and response of each block received for the range.
+        """
+        self.misses += len(responses)
+        await self._run(self._put, request_hash, start, end, responses)
+
+    def _put(self, request_hash: str, start: int, end: int, responses: Sequence[tuple[int, Message]]) -> None:
+        serialized = [(block_number, response.SerializeToString()) for block_number, response in responses]
+        response_type = responses[0][1].DESCRIPTOR.full_name if responses else ''
+        size = sum(len(response) for _, response in serialized)
+
+        with self._connection:
+            segment_id = self._connection.execute(
+                'INSERT INTO segments (endpoint, request_hash, start_block, end_block, response_type, size, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.endpoint, request_hash, start, end, response_type, size, time.time())
+            ).lastrowid
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO blocks (segment_id, block_number, response) VALUES (?, ?, ?)',
+                [(segment_id, block_number, response) for block_number, response in serialized]
+            )
+
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used segments until the cache size is below its maximum size.
+        """
+        excess = (self._connection.execute('SELECT SUM(size) FROM segments').fetchone()[0] or 0) - self.max_size
+        if excess <= 0:
+            return
+
+        evicted = []
+        for segment_id, size in self._connection.execute('SELECT id, size FROM segments ORDER BY last_access').fetchall():
+            if excess <= 0:
+                break
+            evicted.append((segment_id,))
+            excess -= size
+
+        with self._connection:
+            self._connection.executemany('DELETE FROM blocks WHERE segment_id = ?', evicted)
+            self._connection.executemany('DELETE FROM segments WHERE id = ?', evicted)
+
+        logging.debug('Evicted %i segments from block cache "%s"', len(evicted), self.path)
+
+    def close(self) -> None:
+        """
+        Wait for the pending database work and close the cache database.
+        """
+        self._executor.submit(self._connection.close)
+        self._executor.shutdown(wait=True)
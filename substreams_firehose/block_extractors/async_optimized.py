@@ -6,39 +6,189 @@ coming from the parsing of the raw data. This allows for an increased throughput
 the gRPC stream.
 
 It uses asynchronous directives to divide the work into a *fixed* amount of workers defined by the `initial_tasks`
-argument. If a task fails, it waits for all the other tasks to finish before restarting the failed task again for
-the missing blocks.
+argument. If a task fails, the missing blocks are queued again for the next idle worker after a backoff delay set by the
+retry policy (which also halves the number of workers if the endpoint is congested). Once all the ranges
+have been given out, an idle worker steals the second half of the in-flight range with the most remaining blocks (its
+worker is cancelled and restarted with an earlier stop block), preventing slower ranges (with heavier blocks) from
+leaving the other workers idle.
+
+Blocks can either be collected in a list (`asyncio_main`) or yielded as soon as they are extracted (`asyncio_generator`)
+for processing them incrementally. The workers push the blocks into a bounded queue: when the consumer falls behind, the
+workers are paused until the consumer catches up.
+
+In `ordered` mode, the workers push the blocks into a bounded reorder buffer (see `reorder.ReorderBuffer`) releasing
+them to the queue in block number order. The earliest pending ranges are given out first and the earliest one is always
+being streamed, the workers ahead of it being paused once the reorder buffer is full.
 
 Diagram: see ['asynchronous_optimized_block_streaming.jpg'](../../block_extractors_explained/asynchronous_optimized_block_streaming.jpg).
 """
 
 import asyncio
+import heapq
 import logging
+import time
+from collections.abc import AsyncIterator
 
 from google.protobuf.message import Message
 
+from substreams_firehose.block_cache import BlockCache
 from substreams_firehose.block_extractors.common import get_secure_channel
+from substreams_firehose.block_extractors.common import RawBlock
 from substreams_firehose.block_extractors.common import stream_blocks
+from substreams_firehose.block_extractors.reorder import ReorderBuffer
+from substreams_firehose.block_extractors.retry import RetryHandler
+from substreams_firehose.capture import Recorder
+from substreams_firehose.checkpoint import Checkpoint
 from substreams_firehose.config.parser import Config
 from substreams_firehose.exceptions import BlockStreamException
 
-async def asyncio_main(period_start: int, period_end: int, initial_tasks: int = 25, **kwargs) -> list[Message]:
+async def asyncio_generator(period_start: int, period_end: int, initial_tasks: int = 25, queue_size: int = 1000, #pylint: disable=too-many-arguments, too-many-locals, too-many-statements
+                            checkpoint: Checkpoint | None = None, min_steal: int = 50,
+                            block_cache: BlockCache | None = None, lazy_decoding: bool = False,
+                            ordered: bool = False, reorder_size: int = 10000, recorder: Recorder | None = None,
+                            **kwargs) -> AsyncIterator[Message | RawBlock]:
     """
-    Extract blocks from a gRPC channel as raw blocks for later processing.
+    Extract blocks from a gRPC channel as raw blocks, yielding them as soon as they are received by a worker.
 
     Using asynchronous directives, a *fixed* amount of workers will be initially spawned to \
     extract data from the gRPC channel until all blocks have been retrieved. \
-    The returned list can then be parsed for extracting relevant data from the blocks.
+    Once there are no more ranges to give, idle workers steal the second half of the in-flight range with the most \
+    remaining blocks. \
+    Workers push the blocks into a bounded queue consumed by the caller: if the caller falls behind, the workers are \
+    paused until the queue has room again. \
+    If `ordered` is set, the blocks are yielded in block number order through a reorder buffer (see \
+    `reorder.ReorderBuffer`) and the earliest pending ranges are given out first.
 
     Args:
         period_start: The first block number of the targeted period.
         period_end: The last block number of the targeted period.
         initial_tasks: The initial number of concurrent tasks to start for streaming blocks.
+        queue_size: The maximum number of extracted blocks waiting to be consumed by the caller.
+        checkpoint: An optional checkpoint tracking the progress of the extraction. If it has been loaded from a \
+        checkpoint file, only the remaining blocks of the unfinished ranges are extracted.
+        min_steal: The minimum number of blocks an idle worker can steal from an in-flight range.
+        block_cache: An optional cache of the gRPC stream responses, only the non-cached blocks are streamed from \
+        the endpoint.
+        lazy_decoding: Keep the raw blocks serialized (as `RawBlock` objects) until they are processed.
+        ordered: Yield the blocks in block number order.
+        reorder_size: The maximum number of blocks held in the reorder buffer waiting for earlier blocks (if \
+        `ordered` is set).
+        recorder: An optional recorder writing the gRPC stream responses to a capture directory.
         kwargs: Additional keyword arguments to pass to the gRPC request (must match `.proto` file definition).
 
-    Returns:
-        A list of raw blocks (`google.protobuf.any_pb2.Any` objects) that can later be processed.
+    Yields:
+        Raw blocks (`google.protobuf.any_pb2.Any` or `RawBlock` objects) that can later be processed.
     """
+    def _spawn(start: int, end: int) -> None:
+        """
+        Start a new worker extracting the blocks from `start` to `end`.
+        """
+        task = asyncio.create_task(
+            stream_blocks(
+                start,
+                end,
+                secure_channel,
+                block_queue=block_queue,
+                checkpoint=checkpoint,
+                progress=progress,
+                block_cache=block_cache,
+                recorder=recorder,
+                lazy_decoding=lazy_decoding,
+                reorder_buffer=reorder_buffer,
+                **kwargs
+            )
+        )
+        running[task] = (start, end, time.perf_counter())
+
+    def _steal() -> bool:
+        """
+        Split the in-flight range with the most remaining blocks, cancelling its worker and giving back both halves \
+        to the pending ranges.
+
+        Returns:
+            Whether a range has been split.
+        """
+        def remaining(task):
+            start, end, _ = running[task]
+            return end - progress.get(end, start - 1)
+
+        candidates = [task for task in running if not task.done()]
+        if not candidates:
+            return False
+
+        victim = max(candidates, key=remaining)
+        if remaining(victim) < 2 * min_steal:
+            return False
+
+        start, end, _ = running.pop(victim)
+        victim.cancel()
+
+        # The cancelled worker stops before pushing another block, the progress is up-to-date
+        resume = progress.pop(end, start - 1) + 1
+        split = resume + (end - resume) // 2
+        if checkpoint:
+            checkpoint.split_range(end, split)
+        if reorder_buffer:
+            reorder_buffer.split_range(end, split)
+
+        logging.debug('Splitting in-flight range [%i, %i] at #%i (resuming from #%i)', start, end, split, resume)
+        heapq.heappush(pending, (resume, split))
+        heapq.heappush(pending, (split + 1, end))
+        return True
+
+    async def _scheduler(): #pylint: disable=too-many-branches
+        """
+        Give the pending ranges to idle workers, queuing back the missing blocks of failed workers according to the \
+        retry policy and splitting in-flight ranges once there are no more pending ranges.
+        """
+        workers = initial_tasks
+        last_shrink = time.perf_counter()
+
+        try:
+            while pending or running or retries:
+                while len(running) < workers and (pending or _steal()):
+                    _spawn(*heapq.heappop(pending))
+
+                # The earliest range is always streamed (even above the number of workers), as the blocks of the other \
+                # ranges are waiting for it in the reorder buffer
+                if reorder_buffer and pending and reorder_buffer.is_head(pending[0][0]):
+                    _spawn(*heapq.heappop(pending))
+
+                done, _ = await asyncio.wait({*running, *retries}, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task in retries:
+                        # Backoff delay of a failed range has elapsed
+                        retries.remove(task)
+                        heapq.heappush(pending, task.result())
+                        continue
+
+                    _, end, started = running.pop(task)
+                    progress.pop(end, None)
+
+                    try:
+                        task.result()
+                    except BlockStreamException as error:
+                        decision = await retry_handler.handle(error)
+                        if decision is None:
+                            continue
+
+                        # Workers started before the last reduction were congested by the previous number of workers
+                        if decision.congestion and workers > 1 and started >= last_shrink:
+                            workers = max(1, workers // 2)
+                            last_shrink = time.perf_counter()
+                            logging.warning('Endpoint congestion: reducing number of workers to %i', workers)
+
+                        retries.add(asyncio.create_task(asyncio.sleep(decision.delay, result=(error.failed, error.end))))
+                    else:
+                        # Recover from previous congestion, one worker at a time
+                        workers = min(initial_tasks, workers + 1)
+
+            if reorder_buffer:
+                await reorder_buffer.drain()
+        finally:
+            # Signal the end of the extraction to the consumer
+            await block_queue.put(None)
+
     block_diff = period_end - period_start
     split = block_diff//initial_tasks
 
@@ -47,56 +197,99 @@ async def asyncio_main(period_start: int, period_end: int, initial_tasks: int =
         split = block_diff
         initial_tasks = 1
 
+    block_ranges = [
+        (
+            period_start + i*split,
+            # Gives the remaining blocks to the last task in case the work can't be splitted equally
+            period_start + (i+1)*split - 1 if i < initial_tasks-1 else period_end
+        )
+        for i in range(initial_tasks)
+    ]
+
+    if checkpoint:
+        block_ranges = checkpoint.load_block_pool(block_ranges)
+
     logging.info('Streaming %i blocks on %s chain (running %i workers)...',
-        period_end - period_start + 1,
+        sum(end - start + 1 for start, end in block_ranges),
         Config.CHAIN,
         initial_tasks
     )
 
-    tasks = set()
-    data = []
-    failed_counter = {}
+    # Filled by the workers with the extracted blocks, consumed by the caller
+    block_queue = asyncio.Queue(maxsize=queue_size)
+    # Ranges waiting for a worker as (start, end), the earliest ones first
+    pending = sorted(block_ranges)
+    # Range and start time of each running worker as (start, end, start time)
+    running = {}
+    # Last block pushed to the queue by each running worker, keyed by the end of its range
+    progress = {}
+    # Failed ranges waiting for their backoff delay before being queued back as (start, end)
+    retries = set()
+    retry_handler = RetryHandler()
+    # Blocks pushed by the workers ahead of the earliest running range, if ordered
+    reorder_buffer = ReorderBuffer(block_queue, block_ranges, reorder_size, checkpoint) if ordered else None
     async with get_secure_channel() as secure_channel:
-        for i in range(initial_tasks):
-            tasks.add(
-                asyncio.create_task(
-                    stream_blocks(
-                        period_start + i*split,
-                        # Gives the remaining blocks to the last task in case the work can't be splitted equally
-                        period_start + (i+1)*split - 1 if i < initial_tasks-1 else period_end,
-                        secure_channel,
-                        **kwargs
-                    )
-                )
-            )
-
-        failed_tasks = tasks.copy()
-        while failed_tasks:
-            failed_tasks.clear()
-            for task in tasks:
-                try:
-                    data += await task
-                except BlockStreamException as error:
-                    failed_counter[error.failed] = failed_counter.get(error.failed, 0) + 1
-                    if failed_counter[error.failed] <= Config.MAX_FAILED_BLOCK_RETRIES:
-                        logging.warning('Could not fetch block #%i: retrying... (%i/%i retries)',
-                            error.failed,
-                            failed_counter[error.failed],
-                            Config.MAX_FAILED_BLOCK_RETRIES
-                        )
-
-                        failed_tasks.add(
-                            asyncio.create_task(
-                                stream_blocks(error.failed, error.end, secure_channel, **kwargs)
-                            )
-                        )
-                    else:
-                        logging.error('Could not fetch block #%i: maximum number of retries reached (%i)',
-                            error.failed,
-                            Config.MAX_FAILED_BLOCK_RETRIES
-                        )
+        scheduler_task = asyncio.create_task(_scheduler())
+        try:
+            block = await block_queue.get()
+            while block is not None:
+                yield block
+                block = await block_queue.get()
 
-            tasks = failed_tasks.copy()
+            # Propagate any unexpected exception from the scheduler
+            scheduler_task.result()
+        finally:
+            # Only relevant if the consumer stops iterating before all the blocks have been extracted
+            scheduler_task.cancel()
+            for task in [*running, *retries]:
+                task.cancel()
 
     logging.info('Block streaming done !')
-    return data
+
+async def asyncio_main(period_start: int, period_end: int, initial_tasks: int = 25, queue_size: int = 1000, #pylint: disable=too-many-arguments
+                       checkpoint: Checkpoint | None = None, min_steal: int = 50,
+                       block_cache: BlockCache | None = None, lazy_decoding: bool = False,
+                       ordered: bool = False, reorder_size: int = 10000, recorder: Recorder | None = None,
+                       **kwargs) -> list[Message | RawBlock]:
+    """
+    Extract blocks from a gRPC channel as raw blocks for later processing.
+
+    Using asynchronous directives, a *fixed* amount of workers will be initially spawned to \
+    extract data from the gRPC channel until all blocks have been retrieved. \
+    The returned list can then be parsed for extracting relevant data from the blocks.
+
+    Args:
+        period_start: The first block number of the targeted period.
+        period_end: The last block number of the targeted period.
+        initial_tasks: The initial number of concurrent tasks to start for streaming blocks.
+        queue_size: The maximum number of extracted blocks waiting to be collected.
+        checkpoint: An optional checkpoint tracking the progress of the extraction.
+        min_steal: The minimum number of blocks an idle worker can steal from an in-flight range.
+        block_cache: An optional cache of the gRPC stream responses, only the non-cached blocks are streamed from \
+        the endpoint.
+        lazy_decoding: Keep the raw blocks serialized (as `RawBlock` objects) until they are processed.
+        ordered: Collect the blocks in block number order.
+        reorder_size: The maximum number of blocks held in the reorder buffer waiting for earlier blocks (if \
+        `ordered` is set).
+        recorder: An optional recorder writing the gRPC stream responses to a capture directory.
+        kwargs: Additional keyword arguments to pass to the gRPC request (must match `.proto` file definition).
+
+    Returns:
+        A list of raw blocks (`google.protobuf.any_pb2.Any` or `RawBlock` objects) that can later be processed.
+    """
+    return [
+        block async for block in asyncio_generator(
+            period_start,
+            period_end,
+            initial_tasks,
+            queue_size,
+            checkpoint,
+            min_steal,
+            block_cache,
+            lazy_decoding,
+            ordered,
+            reorder_size,
+            recorder,
+            **kwargs
+        )
+    ]
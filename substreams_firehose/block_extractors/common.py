@@ -4,69 +4,643 @@ SPDX-License-Identifier: MIT
 Holds common functions used by the block extractors.
 """
 
+import asyncio
 import logging
-from collections.abc import Callable, Generator, Sequence
-from contextlib import asynccontextmanager
+import multiprocessing
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Generator, Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+from typing import NamedTuple
 
 import grpc
+from google.protobuf.any_pb2 import Any as AnyMessage #pylint: disable=no-name-in-module
 from google.protobuf.json_format import ParseDict
 from google.protobuf.message import Message
 
-from substreams_firehose.config.parser import Config, StubConfig
+from substreams_firehose.block_cache import BlockCache
+from substreams_firehose.block_extractors.reorder import ReorderBuffer
+from substreams_firehose.capture import Recorder
+from substreams_firehose.checkpoint import Checkpoint
+from substreams_firehose.config.parser import Config, StubConfig, get_message_class
 from substreams_firehose.exceptions import BlockStreamException
+from substreams_firehose.json_backend import get_json_backend, set_json_backend
 from substreams_firehose.requests import get_auth_token
-from substreams_firehose.utils import get_current_task_name
+from substreams_firehose.utils import generate_proto_messages_classes, get_current_task_name
+
+# Top-level fields holding the block number, depending on the chain
+BLOCK_NUMBER_FIELDS = ('number', 'height', 'slot')
+
+class RawBlock(NamedTuple):
+    """
+    Serialized raw block, cheap to hold in memory and to send to other processes.
+
+    Attributes:
+        type_url: The type URL of the serialized message (`type.googleapis.com/<message full name>`).
+        value: The serialized message bytes (`Any.value` for packed blocks).
+        packed: Whether the original block was a `google.protobuf.any_pb2.Any` wrapping the serialized message.
+    """
+    type_url: str
+    value: bytes
+    packed: bool
+
+def is_packed(block: Message | RawBlock) -> bool:
+    """
+    Check if a raw block is a packed block.
+
+    Responses decoded from a capture or the block cache use the message classes of the loaded `.proto` definitions \
+    (see `Config.PROTO_MESSAGES_CLASSES`), their packed blocks not being instances of `google.protobuf.any_pb2.Any`.
+
+    Args:
+        block: A raw block extracted from a gRPC stream, serialized or not.
+
+    Returns:
+        Whether the block is a `google.protobuf.Any` message.
+    """
+    return not isinstance(block, RawBlock) and block.DESCRIPTOR.full_name == 'google.protobuf.Any'
+
+def serialize_block(block: Message) -> RawBlock:
+    """
+    Serialize a raw block received from a gRPC stream.
+
+    Packed blocks (`google.protobuf.any_pb2.Any` objects) are not re-serialized: their `value` bytes are kept as-is. \
+    Already serialized blocks are returned as-is.
+
+    Args:
+        block: A raw block extracted from a gRPC stream.
+
+    Returns:
+        The serialized block.
+    """
+    if isinstance(block, RawBlock):
+        return block
+
+    if is_packed(block):
+        return RawBlock(block.type_url, block.value, True)
+
+    return RawBlock(f'type.googleapis.com/{block.DESCRIPTOR.full_name}', block.SerializeToString(), False)
+
+def deserialize_block(raw_block: RawBlock) -> Message:
+    """
+    Rebuild a raw block, as it was received from a gRPC stream, from its serialized form.
+
+    Args:
+        raw_block: A serialized block obtained from `serialize_block`.
+
+    Returns:
+        The raw block (`google.protobuf.any_pb2.Any` object if the original block was packed).
+
+    Raises:
+        KeyError: If the message type of the block is not present in the loaded `.proto` definitions.
+    """
+    if raw_block.packed:
+        return AnyMessage(type_url=raw_block.type_url, value=raw_block.value)
+
+    return get_message_class(raw_block.type_url).FromString(raw_block.value)
+
+def decode_block(block: Message | RawBlock) -> Message:
+    """
+    Decode a block kept serialized by a block extractor (see `lazy_decoding` in `stream_blocks`) for processing.
+
+    Args:
+        block: A raw block extracted from a gRPC stream, serialized or not.
+
+    Returns:
+        The raw block, deserialized if needed.
+    """
+    return deserialize_block(block) if isinstance(block, RawBlock) else block
+
+def unpack_block(block: Message | RawBlock) -> Message:
+    """
+    Unpack a raw block into its concrete message type (e.g. `sf.ethereum.type.v2.Block`), for block processors reading \
+    its fields directly.
+
+    Packed blocks (`google.protobuf.any_pb2.Any` objects) and serialized blocks are decoded once into the message \
+    class registered for their type URL (see `config.parser.get_message_class`). Other messages (e.g. Substreams \
+    `BlockScopedData` outputs) are returned as-is.
+
+    Args:
+        block: A raw block extracted from a gRPC stream, serialized or not.
+
+    Returns:
+        The unpacked block.
+
+    Raises:
+        KeyError: If the message type of the block is not present in the loaded `.proto` definitions.
+    """
+    if isinstance(block, RawBlock) or is_packed(block):
+        return get_message_class(block.type_url).FromString(block.value)
+
+    return block
+
+def _get_block_decoder(block_processor: Callable[[Message], dict]) -> Callable[[Message | RawBlock], Message]:
+    """
+    Get the function preparing the raw blocks for the given block processor: typed block processors (see \
+    `block_processors.processors.typed_block_processor`) get the unpacked blocks.
+    """
+    return unpack_block if getattr(block_processor, 'typed', False) else decode_block
+
+def _process_each(block_processor: Callable[[Message], Iterable], blocks: Sequence[Message]) -> list:
+    """
+    Parse a batch of blocks by calling a per-block processor on each block.
+    """
+    return [blob for block in blocks for blob in block_processor(block)]
+
+def _process_by_block(process_batch: Callable[[Sequence[Message]], Iterable], blocks: Sequence[Message]) -> list[list]:
+    """
+    Parse a batch of blocks using a batch processor, grouping the rows by block so that each block can be \
+    acknowledged once its own rows have been consumed.
+
+    The rows of batch processors reporting their row counts (see `block_processors.processors.batch_block_processor`) \
+    are split by block. Otherwise, all the rows are attributed to the first block of the batch.
+
+    Returns:
+        The list of rows of each block, in the same order as the blocks.
+    """
+    block_processor = getattr(process_batch, 'block_processor', None)
+    if block_processor is not None:
+        return [list(block_processor(block)) for block in blocks]
+
+    rows = list(process_batch(blocks))
+    row_counts = getattr(process_batch, 'row_counts', None)
+    if row_counts is None:
+        return [rows] + [[] for _ in range(len(blocks) - 1)]
+
+    groups = []
+    position = 0
+    for count in row_counts(blocks):
+        groups.append(rows[position:position + count])
+        position += count
+
+    return groups
+
+def batch_adapter(block_processor: Callable[[Message], Iterable]) -> Callable[[Sequence[Message]], Iterable]:
+    """
+    Wrap a per-block processor into a batch processor (see `block_processors.processors.batch_block_processor`).
+
+    The adapter can be sent to worker processes as long as the wrapped block processor can (i.e. is defined at the \
+    top level of a module).
+
+    Args:
+        block_processor: A generator function extracting relevant data from a block, or a batch processor which is \
+        returned as-is.
+
+    Returns:
+        A batch processor yielding the rows of each block, in order.
+    """
+    if getattr(block_processor, 'batch', False):
+        return block_processor
+
+    process_batch = partial(_process_each, block_processor)
+    process_batch.batch = True
+    process_batch.block_processor = block_processor
+    process_batch.typed = getattr(block_processor, 'typed', False)
+    return process_batch
+
+class AuthTokenMetadataPlugin(grpc.AuthMetadataPlugin): #pylint: disable=too-few-public-methods
+    """
+    Send the current JWT token with each call, allowing to refresh the token without re-opening the channels.
+
+    Attributes:
+        token: The JWT token shared by all the channels.
+    """
+    token: str = ''
+
+    def __call__(self, context: grpc.AuthMetadataContext, callback: grpc.AuthMetadataPluginCallback) -> None:
+        callback((('authorization', f'Bearer {AuthTokenMetadataPlugin.token}'),), None)
+
+def refresh_auth_token() -> None:
+    """
+    Fetch a new JWT token (bypassing the cache) for the calls of all opened channels.
+
+    Raises:
+        RuntimeError: If the JWT token could not be acquired from the endpoint.
+    """
+    if Config.INSECURE:
+        return
+
+    AuthTokenMetadataPlugin.token = get_auth_token(use_cache=False)
 
 @asynccontextmanager
-async def get_secure_channel() -> Generator[grpc.aio.Channel, None, None]:
+async def get_secure_channel(channel_id: int = 0) -> Generator[grpc.aio.Channel, None, None]:
     """
     Instantiate a secure gRPC channel as an asynchronous context manager for use by block extractors.
 
+    The channel is closed when exiting the context manager. Channels with different `channel_id` never share their \
+    underlying HTTP/2 connection. Insecure endpoints (see `Config.INSECURE`) get a plaintext channel without \
+    authentication instead.
+
+    Args:
+        channel_id: An identifier of the channel, used to open a distinct connection for each channel.
+
     Yields:
         A `grpc.aio.Channel` as an asynchronous context manager.
     """
-    jwt = get_auth_token()
-    creds = grpc.composite_channel_credentials(
-        grpc.ssl_channel_credentials(),
-        grpc.access_token_call_credentials(jwt)
-    )
+    # See https://github.com/grpc/grpc/blob/master/include/grpc/impl/codegen/grpc_types.h#L141 for a list of options
+    options = [
+        ('grpc.max_receive_message_length', Config.MAX_BLOCK_SIZE),
+        ('grpc.max_send_message_length', Config.MAX_BLOCK_SIZE),
+        # Subchannels (connections) are shared between channels with the same arguments unless using a local pool
+        ('grpc.use_local_subchannel_pool', 1),
+        ('substreams_firehose.channel_id', channel_id),
+    ]
 
-    yield grpc.aio.secure_channel(
-        Config.GRPC_ENDPOINT,
-        creds,
-        # See https://github.com/grpc/grpc/blob/master/include/grpc/impl/codegen/grpc_types.h#L141 for a list of options
-        options=[
-            ('grpc.max_receive_message_length', Config.MAX_BLOCK_SIZE),
-            ('grpc.max_send_message_length', Config.MAX_BLOCK_SIZE),
-        ],
-        compression=Config.COMPRESSION
-    )
+    if Config.INSECURE:
+        channel = grpc.aio.insecure_channel(Config.GRPC_ENDPOINT, options=options, compression=Config.COMPRESSION)
+    else:
+        AuthTokenMetadataPlugin.token = get_auth_token()
+        creds = grpc.composite_channel_credentials(
+            grpc.ssl_channel_credentials(),
+            grpc.metadata_call_credentials(AuthTokenMetadataPlugin())
+        )
+        channel = grpc.aio.secure_channel(Config.GRPC_ENDPOINT, creds, options=options, compression=Config.COMPRESSION)
+
+    async with channel as secure_channel:
+        yield secure_channel
+
+class ChannelPool:
+    """
+    Pool of secure gRPC channels, each on its own HTTP/2 connection, for use by block extractors as an asynchronous \
+    context manager.
+
+    A single HTTP/2 connection limits the number of concurrent streams, spreading the streams over multiple \
+    connections allows for more concurrent workers.
+
+    Attributes:
+        size: The number of channels in the pool.
+        channels: The opened channels.
+        load: The number of streams in-flight for each channel.
+    """
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.channels = []
+        self.load = []
+        self._exit_stack = AsyncExitStack()
 
-def process_blocks(raw_blocks: Sequence[Message], block_processor: Callable[[Message], dict]) -> list[dict]:
+    async def __aenter__(self) -> 'ChannelPool':
+        for channel_id in range(self.size):
+            self.channels.append(await self._exit_stack.enter_async_context(get_secure_channel(channel_id)))
+            self.load.append(0)
+
+        logging.debug('Opened %i gRPC channels to %s', self.size, Config.GRPC_ENDPOINT)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._exit_stack.aclose()
+        self.channels.clear()
+        self.load.clear()
+
+        logging.debug('Closed %i gRPC channels to %s', self.size, Config.GRPC_ENDPOINT)
+
+    def acquire(self) -> grpc.aio.Channel:
+        """
+        Reserve a stream on the least loaded channel.
+
+        Returns:
+            The channel to use for the stream, to be given back with `release` once the stream is done.
+        """
+        index = min(range(len(self.channels)), key=self.load.__getitem__)
+        self.load[index] += 1
+        return self.channels[index]
+
+    def release(self, secure_channel: grpc.aio.Channel) -> None:
+        """
+        Release a stream reserved with `acquire`.
+
+        Args:
+            secure_channel: The channel used by the stream.
+        """
+        # Streams cancelled on exit may be released after the channels have been closed
+        if secure_channel in self.channels:
+            self.load[self.channels.index(secure_channel)] -= 1
+
+def process_blocks(raw_blocks: Sequence[Message | RawBlock], block_processor: Callable[[Message], dict]) -> list[dict]:
     """
     Parse data using the given block processor, feeding it previously extracted raw blocks from a gRPC stream.
 
     Args:
-        raw_blocks: A sequence of packed blocks (`google.protobuf.any_pb2.Any` objects) extracted from a gRPC stream.
-        block_processor: A generator function extracting relevant data from a block.
+        raw_blocks: A sequence of packed blocks (`google.protobuf.any_pb2.Any` objects) extracted from a gRPC stream. \
+        Serialized blocks (`RawBlock` objects) are decoded before being processed.
+        block_processor: A generator function extracting relevant data from a block, or a batch processor called \
+        once with all the blocks.
 
     Returns:
         A list of parsed data in the format returned by the block processor.
     """
-    data = []
-    for raw_block in raw_blocks:
-        for blob in block_processor(raw_block):
-            data.append(blob)
+    data = [blob for block_rows in _process_blocks(block_processor, raw_blocks) for blob in block_rows]
 
     logging.info('Finished block processing, parsed %i rows of data [SUCCESS]', len(data))
 
     return data
 
-async def stream_blocks(start: int, end: int, secure_channel: grpc.aio.Channel,
-                        block_processor: Callable[[Message], dict] = lambda block: [block], **kwargs) -> list[Message | dict]:
+async def process_blocks_stream(raw_blocks: AsyncIterator[Message | RawBlock], block_processor: Callable[[Message], dict],
+                                checkpoint: Checkpoint | None = None, batch_size: int = 100) -> AsyncIterator[dict]:
+    """
+    Parse data using the given block processor as soon as raw blocks are yielded by a block extractor.
+
+    Contrary to `process_blocks`, no intermediate list is built: each parsed row is handed to the caller (e.g. for \
+    writing to the output file) before the next raw block is processed. Batch processors (see \
+    `block_processors.processors.batch_block_processor`) are called with batches of `batch_size` blocks instead, \
+    their rows being handed to the caller before the next batch is collected. The blocks of a batch are still \
+    acknowledged one at a time, after their own rows.
+
+    Args:
+        raw_blocks: An asynchronous iterator of packed blocks (`google.protobuf.any_pb2.Any` objects), usually obtained \
+        from the `asyncio_generator` function of a block extractor. Serialized blocks (`RawBlock` objects) are decoded \
+        before being processed.
+        block_processor: A generator function extracting relevant data from a block, or a batch processor.
+        checkpoint: An optional checkpoint acknowledging the blocks once all their parsed data has been consumed.
+        batch_size: The number of blocks handed at once to a batch processor.
+
+    Yields:
+        Parsed data in the format returned by the block processor.
+    """
+    rows = 0
+    decode = _get_block_decoder(block_processor)
+
+    if not getattr(block_processor, 'batch', False):
+        async for raw_block in raw_blocks:
+            for blob in block_processor(decode(raw_block)):
+                rows += 1
+                yield blob
+
+            if checkpoint:
+                checkpoint.acknowledge()
+
+        logging.info('Finished block processing, parsed %i rows of data [SUCCESS]', rows)
+        return
+
+    batch = []
+    async for raw_block in raw_blocks:
+        batch.append(decode(raw_block))
+        if len(batch) < batch_size:
+            continue
+
+        for block_rows in _process_by_block(block_processor, batch):
+            rows += len(block_rows)
+            for blob in block_rows:
+                yield blob
+
+            if checkpoint:
+                checkpoint.acknowledge()
+        batch = []
+
+    if batch:
+        for block_rows in _process_by_block(block_processor, batch):
+            rows += len(block_rows)
+            for blob in block_rows:
+                yield blob
+
+            if checkpoint:
+                checkpoint.acknowledge()
+
+    logging.info('Finished block processing, parsed %i rows of data [SUCCESS]', rows)
+
+def _init_processing_worker(block_processor: Callable[[Message], dict], request_parameters: dict,
+                            response_parameters: dict | list, json_backend: str) -> None:
+    """
+    Initialize a block processing worker process with the configuration needed to rebuild and process raw blocks.
+
+    Args:
+        block_processor: A generator function extracting relevant data from a block.
+        request_parameters: The request parameters of the stub config.
+        response_parameters: The response parameters (output filter) of the stub config.
+        json_backend: The name of the JSON backend selected by the main process.
+    """
+    Config.PROTO_MESSAGES_CLASSES = generate_proto_messages_classes()
+    StubConfig.REQUEST_PARAMETERS = request_parameters
+    StubConfig.RESPONSE_PARAMETERS = response_parameters
+    set_json_backend(json_backend)
+
+    # Save the block processor as function attribute for use by the worker
+    _process_serialized_blocks.block_processor = block_processor
+
+def _process_blocks(block_processor: Callable[[Message], dict], raw_blocks: Sequence[Message | RawBlock]) -> list[list[dict]]:
+    """
+    Parse a chunk of raw blocks using the given block processor.
+
+    Args:
+        block_processor: A generator function extracting relevant data from a block, or a batch processor called \
+        once with the whole chunk.
+        raw_blocks: A sequence of raw blocks, serialized or not.
+
+    Returns:
+        The parsed data of each block (see `_process_by_block`) in the format returned by the block processor, in the \
+        same order as the blocks.
+    """
+    process_batch = batch_adapter(block_processor)
+    decode = _get_block_decoder(process_batch)
+    return _process_by_block(process_batch, [decode(raw_block) for raw_block in raw_blocks])
+
+def _process_serialized_blocks(raw_blocks: list[RawBlock]) -> list[list[dict]]:
+    """
+    Parse a chunk of serialized blocks using the block processor set by `_init_processing_worker`.
+
+    Args:
+        raw_blocks: A list of serialized blocks.
+
+    Returns:
+        The parsed data of each block in the format returned by the block processor, in the same order as the blocks.
+    """
+    return _process_blocks(_process_serialized_blocks.block_processor, raw_blocks)
+
+async def process_blocks_parallel(raw_blocks: AsyncIterator[Message | RawBlock], block_processor: Callable[[Message], dict], #pylint: disable=too-many-arguments, too-many-locals
+                                  workers: int, chunk_size: int = 100, use_threads: bool = False,
+                                  checkpoint: Checkpoint | None = None) -> AsyncIterator[dict]:
+    """
+    Parse data using the given block processor on a pool of workers, as raw blocks are yielded by a block extractor.
+
+    Processing happens outside of the event loop, overlapping with the extraction of the next blocks from the gRPC \
+    streams. Blocks are sent to the workers in chunks of `chunk_size` blocks and parsed data is yielded in the same \
+    order as the raw blocks were received.
+
+    With worker processes (the default), the blocks are serialized (unless they were kept serialized by the block \
+    extractor) before being sent to the workers and each worker \
+    loads the `.proto` definitions once on startup. Worker threads don't need any serialization but are limited by \
+    the Python GIL for CPU-bound processing.
+
+    Args:
+        raw_blocks: An asynchronous iterator of packed blocks (`google.protobuf.any_pb2.Any` objects), usually obtained \
+        from the `asyncio_generator` function of a block extractor. Serialized blocks (`RawBlock` objects) are decoded \
+        before being processed.
+        block_processor: A generator function extracting relevant data from a block, or a batch processor called once \
+        for each chunk. Must be importable by the worker processes (i.e. defined at the top level of a module).
+        workers: The number of workers.
+        chunk_size: The number of blocks sent to a worker at once.
+        use_threads: Use a pool of worker threads instead of worker processes.
+        checkpoint: An optional checkpoint acknowledging the blocks once all their parsed data has been consumed.
+
+    Yields:
+        Parsed data in the format returned by the block processor.
+    """
+    loop = asyncio.get_running_loop()
+    rows = 0
+
+    logging.info('Processing blocks with %i worker %s...', workers, 'threads' if use_threads else 'processes')
+
+    if use_threads:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='block_processor')
+        process_chunk = partial(_process_blocks, block_processor)
+        prepare_block = lambda block: block #pylint: disable=unnecessary-lambda-assignment
+    else:
+        # Spawn fresh processes instead of forking the current one as gRPC doesn't support forking with active channels
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_processing_worker,
+            initargs=(
+                block_processor,
+                StubConfig.REQUEST_PARAMETERS,
+                StubConfig.RESPONSE_PARAMETERS,
+                get_json_backend().name
+            )
+        )
+        process_chunk = _process_serialized_blocks
+        prepare_block = serialize_block
+
+    with executor:
+        # Chunks being processed, each returning the rows of its blocks
+        pending = deque()
+        chunk = []
+        async for raw_block in raw_blocks:
+            chunk.append(prepare_block(raw_block))
+            if len(chunk) < chunk_size:
+                continue
+
+            pending.append(loop.run_in_executor(executor, process_chunk, chunk))
+            chunk = []
+
+            # Limit the number of chunks in-flight, yielding results in order as soon as they are available
+            while pending and (len(pending) > 2*workers or pending[0].done()):
+                for block_rows in await pending.popleft():
+                    rows += len(block_rows)
+                    for blob in block_rows:
+                        yield blob
+
+                    if checkpoint:
+                        checkpoint.acknowledge()
+
+        if chunk:
+            pending.append(loop.run_in_executor(executor, process_chunk, chunk))
+
+        while pending:
+            for block_rows in await pending.popleft():
+                rows += len(block_rows)
+                for blob in block_rows:
+                    yield blob
+
+                if checkpoint:
+                    checkpoint.acknowledge()
+
+    logging.info('Finished block processing, parsed %i rows of data [SUCCESS]', rows)
+
+def _read_varint_field(value: bytes, field_number: int) -> int | None:
+    """
+    Read a top-level varint field from a serialized message without deserializing it.
+
+    Args:
+        value: The serialized message bytes.
+        field_number: The number of the varint field.
+
+    Returns:
+        The field value or `None` if the field is not set.
+    """
+    def read_varint(position):
+        result = shift = 0
+        while True:
+            byte = value[position]
+            result |= (byte & 0x7F) << shift
+            position += 1
+            if not byte & 0x80:
+                return result, position
+            shift += 7
+
+    position = 0
+    try:
+        while position < len(value):
+            tag, position = read_varint(position)
+            wire_type = tag & 0x7
+
+            if wire_type == 0:
+                field_value, position = read_varint(position)
+                if tag >> 3 == field_number:
+                    return field_value
+            elif wire_type == 1:
+                position += 8
+            elif wire_type == 2:
+                length, position = read_varint(position)
+                position += length
+            elif wire_type == 5:
+                position += 4
+            else:
+                # Deprecated groups are not supported
+                return None
+    except IndexError:
+        logging.warning('Truncated message while looking for field #%i', field_number)
+
+    return None
+
+def get_block_number(block: Message) -> int | None:
+    """
+    Get the block number from a block received from a gRPC stream.
+
+    Packed blocks (`google.protobuf.any_pb2.Any` objects) are not deserialized: the block number is read directly from \
+    the serialized bytes. Substreams outputs (`BlockScopedData`) hold it in their `clock`.
+
+    Args:
+        block: A raw block extracted from a gRPC stream.
+
+    Returns:
+        The block number, or `None` if the block doesn't have a top-level number field (`number`, `height` or `slot`).
+    """
+    if is_packed(block):
+        try:
+            field_number = get_block_number.fields[block.type_url]
+        except KeyError:
+            field_number = None
+            try:
+                fields = get_message_class(block.type_url).DESCRIPTOR.fields_by_name
+                field_number = next((fields[name].number for name in BLOCK_NUMBER_FIELDS if name in fields), None)
+            except KeyError:
+                pass
+
+            get_block_number.fields[block.type_url] = field_number
+
+        return None if field_number is None else _read_varint_field(block.value, field_number)
+
+    if 'clock' in block.DESCRIPTOR.fields_by_name:
+        return block.clock.number
+
+    return next((getattr(block, name) for name in BLOCK_NUMBER_FIELDS if name in block.DESCRIPTOR.fields_by_name), None)
+
+# Block number field number for each packed block type URL
+get_block_number.fields = {}
+
+async def stream_blocks(start: int, end: int, secure_channel: grpc.aio.Channel, #pylint: disable=too-many-arguments, too-many-locals, too-many-branches, too-many-statements
+                        block_processor: Callable[[Message], dict] = lambda block: [block],
+                        block_queue: asyncio.Queue | None = None, checkpoint: Checkpoint | None = None,
+                        progress: dict[int, int] | None = None, block_cache: BlockCache | None = None,
+                        lazy_decoding: bool = False, reorder_buffer: ReorderBuffer | None = None,
+                        recorder: Recorder | None = None, **kwargs) -> list[Message | RawBlock | dict]:
     """
     Return raw blocks (or parsed data) for the subset period between `start` and `end`.
 
+    If a `block_queue` is supplied, the blocks are pushed to the queue as soon as they are received instead of being \
+    returned. Waiting for a full queue pauses the stream, propagating backpressure from the consumer of the queue.
+
+    If a `checkpoint` is supplied, the stream resumes from the saved cursor of the range (if any) and the blocks \
+    pushed to the queue are tracked by the checkpoint.
+
+    If a `block_cache` is supplied, the cached blocks of the range are read from the cache and only the missing parts \
+    of the range are streamed, the streamed blocks being stored to the cache by segments as the stream progresses.
+
+    If a `reorder_buffer` is supplied, the blocks are pushed to the buffer instead of the `block_queue`, the buffer \
+    releasing them to its queue in block number order (and tracking them with its checkpoint).
+
+    If a `recorder` is supplied, the raw responses holding a block (streamed or read from the `block_cache`) are \
+    written to its capture for replaying the extraction later.
+
     Args:
         start: The stream's starting block.
         end: The stream's ending block.
@@ -75,12 +649,23 @@ async def stream_blocks(start: int, end: int, secure_channel: grpc.aio.Channel,
         The function will then return the parsed blocks instead. \
         Discouraged as it might cause congestion issues for the gRPC channel if the block processing takes too long. \
         Parsing the blocks *after* extraction allows for maximum throughput from the gRPC stream.
+        block_queue: An optional queue receiving the blocks (or parsed data) as soon as they are extracted.
+        checkpoint: An optional checkpoint tracking the progress of the range ending at `end`.
+        progress: An optional dictionary updated with the last block number pushed to the `block_queue`, keyed by \
+        `end` (used by schedulers to split in-flight ranges).
+        block_cache: An optional cache of the gRPC stream responses.
+        lazy_decoding: Keep the raw blocks serialized (as `RawBlock` objects) until they are processed, holding only \
+        their bytes in memory and making them cheap to send to other processes.
+        reorder_buffer: An optional reorder buffer receiving the blocks, replacing the `block_queue`.
+        recorder: An optional recorder writing the raw responses to a capture directory.
 
     Returns:
-        A list of raw blocks (`google.protobuf.any_pb2.Any` objects) or parsed data if a block processor is supplied.
+        A list of raw blocks (`google.protobuf.any_pb2.Any` or `RawBlock` objects) or parsed data if a block processor \
+        is supplied. Empty if a `block_queue` is supplied.
 
     Raises:
-        BlockStreamException: If an rpc error is encountered. Contains the start, end, and failed block number.
+        BlockStreamException: If an rpc error is encountered. Contains the start, end, and failed block number, along \
+        with the blocks (or parsed data) received before the failure if no `block_queue` is supplied.
     """
     data = []
     current_block_number = start
@@ -95,14 +680,93 @@ async def stream_blocks(start: int, end: int, secure_channel: grpc.aio.Channel,
         )
         raise
 
-    # Move request parameters to dict to allow CLI keyword arguments to override the stub config
-    request_parameters = {
-        'start_block_num': start,
-        'stop_block_num': end + (1 if StubConfig.SUBSTREAMS_PACKAGE_OBJECT else 0),
-        **StubConfig.REQUEST_PARAMETERS,
-        **kwargs
-    }
-    req = ParseDict(request_parameters, StubConfig.REQUEST_OBJECT())
+    def build_request(range_start, range_end, cursor=''):
+        # Move request parameters to dict to allow CLI keyword arguments to override the stub config
+        request_parameters = {
+            'start_block_num': range_start,
+            'stop_block_num': range_end + (1 if StubConfig.SUBSTREAMS_PACKAGE_OBJECT else 0),
+            **StubConfig.REQUEST_PARAMETERS,
+            **kwargs
+        }
+
+        if cursor:
+            # Firehose V2 names the field `cursor`, Substreams and Dfuse name it `start_cursor`
+            cursor_field = 'start_cursor' if 'start_cursor' in StubConfig.REQUEST_OBJECT.DESCRIPTOR.fields_by_name else 'cursor'
+            request_parameters[cursor_field] = cursor
+
+        return ParseDict(request_parameters, StubConfig.REQUEST_OBJECT())
+
+    async def handle_response(response, streamed=None): #pylint: disable=too-many-branches
+        nonlocal current_block_number
+
+        response_data = None
+        try:
+            response_data = response.block
+        except AttributeError:
+            try:
+                if response.data.outputs:
+                    response_data = response.data
+            except AttributeError:
+                logging.warning('[%s] No valid output message found in response : %s',
+                    get_current_task_name(),
+                    response
+                )
+
+        if not response_data:
+            return
+
+        # Track the progress with the block number from the payload: some responses may not hold a block
+        block_number = get_block_number(response_data)
+        if block_number is None:
+            block_number = current_block_number
+
+        logging.debug('[%s] Getting block number #%i (%i blocks remaining)...',
+            get_current_task_name(),
+            block_number,
+            end - block_number
+        )
+        current_block_number = block_number + 1
+
+        if streamed is not None:
+            streamed.append((block_number, response))
+
+        if recorder:
+            await recorder.write(block_number, response)
+
+        # Firehose responses hold the cursor, Substreams holds it in the block scoped data
+        block_cursor = getattr(response, 'cursor', '') or getattr(response_data, 'cursor', '')
+        if lazy_decoding:
+            response_data = serialize_block(response_data)
+
+        if block_queue is None and reorder_buffer is None:
+            data.extend([b for b in block_processor(response_data) if b])
+            return
+
+        for blob in block_processor(response_data):
+            if not blob:
+                continue
+
+            if reorder_buffer is not None:
+                await reorder_buffer.put(start, end, block_number, block_cursor, blob)
+            else:
+                await block_queue.put(blob)
+                if checkpoint:
+                    checkpoint.track(end, block_number, block_cursor)
+
+        if progress is not None:
+            progress[end] = block_number
+
+        if reorder_buffer is not None:
+            # Releases the blocks now in order (including this one if the range is the earliest one)
+            await reorder_buffer.cover(start, block_number)
+
+    # Only the missing parts of the range are streamed if a block cache is supplied
+    ranges = [(start, end, False)]
+    if block_cache:
+        request_hash = block_cache.request_hash(StubConfig.SERVICE_METHOD_FUNCTION, build_request(start, end))
+        ranges = await block_cache.lookup(request_hash, start, end)
+
+    cursor = checkpoint.get_cursor(start, end) if checkpoint else ''
 
     logging.debug('[%s] Starting streaming blocks from #%i to #%i...',
         get_current_task_name(),
@@ -111,29 +775,45 @@ async def stream_blocks(start: int, end: int, secure_channel: grpc.aio.Channel,
     )
 
     try:
-        async for response in service_method(req):
-            response_data = None
-            try:
-                response_data = response.block
-            except AttributeError:
-                try:
-                    if response.data.outputs:
-                        response_data = response.data
-                except AttributeError:
-                    logging.warning('[%s] No valid output message found in response : %s',
-                        get_current_task_name(),
-                        response
-                    )
-
-            if response_data:
-                logging.debug('[%s] Getting block number #%i (%i blocks remaining)...',
+        for range_start, range_end, cached in ranges:
+            if cached:
+                logging.debug('[%s] Reading blocks #%i to #%i from cache...',
                     get_current_task_name(),
-                    current_block_number,
-                    end - current_block_number
+                    range_start,
+                    range_end
                 )
-                current_block_number += 1
+                async for response in block_cache.get(request_hash, range_start, range_end):
+                    await handle_response(response)
+                current_block_number = range_end + 1
+                if reorder_buffer is not None:
+                    await reorder_buffer.cover(start, range_end)
+                continue
 
-                data.extend([b for b in block_processor(response_data) if b])
+            streamed = [] if block_cache else None
+            # First block of the segment being streamed, not stored to the cache yet
+            segment_start = range_start
+            completed = False
+            try:
+                # The checkpoint cursor only applies to the start of the range
+                async for response in service_method(
+                    build_request(range_start, range_end, cursor if range_start == start else '')
+                ):
+                    await handle_response(response, streamed)
+                    if block_cache and len(streamed) >= block_cache.segment_blocks:
+                        await block_cache.put(request_hash, segment_start, current_block_number - 1, streamed)
+                        segment_start = current_block_number
+                        streamed = []
+                completed = True
+            finally:
+                # Blocks received before a failure (or cancellation) are also cached
+                cached_end = range_end if completed else current_block_number - 1
+                if block_cache and cached_end >= segment_start:
+                    await block_cache.put(request_hash, segment_start, cached_end, streamed)
+
+            current_block_number = max(current_block_number, range_end + 1)
+            if reorder_buffer is not None:
+                # Skipped blocks at the end of the range are covered as well
+                await reorder_buffer.cover(start, range_end)
 
     except grpc.aio.AioRpcError as error:
         logging.error('[%s] Failed to process block number #%i: %s',
@@ -142,7 +822,15 @@ async def stream_blocks(start: int, end: int, secure_channel: grpc.aio.Channel,
             error
         )
 
-        raise BlockStreamException(start, end, current_block_number) from error
+        # Blocks received before the failure are kept, only the remaining ones need to be streamed again
+        raise BlockStreamException(start, end, current_block_number, data) from error
+
+    # The stream ended without error: the range is complete once its blocks are consumed, even if its last blocks were \
+    # skipped by the endpoint
+    if reorder_buffer is not None:
+        await reorder_buffer.complete(end)
+    elif checkpoint:
+        checkpoint.complete(end)
 
     logging.debug('[%s] Done !\n', get_current_task_name())
     return data
@@ -0,0 +1,135 @@
+"""
+SPDX-License-Identifier: MIT
+
+Adaptive concurrency control for the block extractors spawning workers.
+
+The controller follows an AIMD (additive increase, multiplicative decrease) scheme similar to TCP congestion control:
+the concurrency limit grows by a fixed step for each round of workers completing their range (each worker adding a
+fraction `increase / limit` of the step), as long as the limit is actually in use and the smoothed per-worker throughput
+is not degrading. It is cut by a factor when the endpoint signals congestion (errors with a `shrink_concurrency` action
+in the retry policy of the main config) or when the per-worker throughput drops too far below the best one observed
+(i.e. the latency per block rises). The limit is held when the spawner is kept from using it (e.g. backpressure from the
+consumer) or when the per-worker throughput is lower than before, so that it doesn't inflate without any benefit.
+
+The history of the concurrency limit is kept (and logged) to help tuning the extractor parameters for each endpoint.
+"""
+
+import logging
+import time
+
+class ConcurrencyController: #pylint: disable=too-many-instance-attributes
+    """
+    Adjust the maximum number of concurrent workers based on the outcome of the finished workers.
+
+    Attributes:
+        limit: The current concurrency limit (fractional, use `max_tasks` for the number of workers allowed).
+        min_limit: The lowest concurrency limit.
+        max_limit: The highest concurrency limit (unbounded if `None`).
+        increase: The number of workers added to the limit for each round of successful workers (i.e. `limit` workers).
+        decrease_factor: The factor applied to the limit on congestion.
+        latency_tolerance: The ratio between the best and the current per-worker throughput above which the latency \
+        is considered rising.
+        smoothing: The weight of the latest worker throughput in its exponential moving average.
+        history: The concurrency limit changes as `(elapsed time in seconds, limit, reason)` tuples.
+    """
+    def __init__(self, initial_limit: int = 25, min_limit: int = 1, max_limit: int | None = None, #pylint: disable=too-many-arguments
+                 increase: float = 1., decrease_factor: float = 0.5, latency_tolerance: float = 1.5,
+                 smoothing: float = 0.2) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = self._clamp(initial_limit)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+
+        self._start_time = time.perf_counter()
+        self._last_decrease = self._start_time
+        self._throughput = None
+        self._best_throughput = None
+        self.history = [(0., self.max_tasks, 'initial')]
+
+    @property
+    def max_tasks(self) -> int:
+        """
+        Returns:
+            The number of concurrent workers currently allowed.
+        """
+        return int(self.limit)
+
+    def _clamp(self, limit: float) -> float:
+        return max(self.min_limit, limit if self.max_limit is None else min(self.max_limit, limit))
+
+    def _update(self, limit: float, reason: str) -> None:
+        previous = self.max_tasks
+        self.limit = self._clamp(limit)
+
+        if self.max_tasks != previous:
+            self.history.append((time.perf_counter() - self._start_time, self.max_tasks, reason))
+            logging.debug('Concurrency limit: %i -> %i (%s)', previous, self.max_tasks, reason)
+
+    def _decrease(self, started: float, reason: str) -> None:
+        # Workers started before the last decrease were congested by the previous limit, ignore them
+        if started < self._last_decrease:
+            return
+
+        self._last_decrease = time.perf_counter()
+        self._throughput = None
+        self._update(self.limit * self.decrease_factor, reason)
+
+    def on_success(self, started: float, blocks: int, running: int) -> None:
+        """
+        Register a worker that has extracted all of its blocks.
+
+        Args:
+            started: The worker start time (from `time.perf_counter`).
+            blocks: The number of blocks extracted by the worker.
+            running: The number of workers that were running when the worker finished (including it).
+        """
+        runtime = time.perf_counter() - started
+        if runtime <= 0 or blocks <= 0:
+            return
+
+        throughput = blocks / runtime
+        previous = self._throughput
+        if previous is None:
+            self._throughput = throughput
+        else:
+            self._throughput += self.smoothing * (throughput - previous)
+
+        if self._best_throughput is None or self._throughput > self._best_throughput:
+            self._best_throughput = self._throughput
+
+        if self._throughput * self.latency_tolerance < self._best_throughput:
+            # Lower the reference throughput to adapt to a permanent slowdown of the endpoint
+            self._best_throughput = (self._best_throughput + self._throughput) / 2
+            self._decrease(started, f'latency rising, {throughput:.1f} blocks/s per worker')
+        elif running >= self.max_tasks and previous is not None and self._throughput >= previous:
+            # Additive increase of one step for each round of `limit` workers
+            self._update(self.limit + self.increase / self.limit, f'{throughput:.1f} blocks/s per worker')
+
+    def on_congestion(self, started: float, reason: str) -> None:
+        """
+        Register a worker that failed because of a congestion of the endpoint (see the retry policy in the main config).
+
+        Args:
+            started: The worker start time (from `time.perf_counter`).
+            reason: A description of the congestion signal.
+        """
+        self._decrease(started, reason)
+
+    def report(self) -> str:
+        """
+        Returns:
+            A summary of the concurrency limit over time.
+        """
+        elapsed = time.perf_counter() - self._start_time
+        timeline = self.history + [(elapsed, self.max_tasks, 'final')]
+
+        # Weight each limit by the time it was in use
+        weighted = sum((t_next - t) * limit for (t, limit, _), (t_next, *_) in zip(timeline, timeline[1:]))
+
+        return (f'min {min(limit for _, limit, _ in timeline)} / '
+                f'mean {weighted / elapsed if elapsed > 0 else self.max_tasks:.1f} / '
+                f'max {max(limit for _, limit, _ in timeline)} / '
+                f'final {self.max_tasks} workers ({len(self.history) - 1} changes over {elapsed:.1f}s)')
@@ -0,0 +1,184 @@
+"""
+SPDX-License-Identifier: MIT
+
+Reorders the blocks extracted concurrently by the workers so that they reach the consumer in block number order.
+
+Each worker streams its range in order: once it has pushed a block, all the blocks of its range up to that block number
+are known (the missing numbers being skipped blocks). The reorder buffer keeps track of these covered spans and of the
+*watermark*, the highest block number below which every block has been covered. Blocks at or below the watermark are
+released to the consumer right away, the other ones are held in a heap keyed by block number until the ranges before
+them complete.
+
+The buffer is bounded: a worker pushing a block that cannot be released yet waits for room in the buffer, pausing its
+stream. The worker of the earliest pending range (the *head* range) is never paused as its blocks are released as soon
+as they are pushed, the extractors making sure the head range is always being streamed (see `ReorderBuffer.is_head`).
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+from collections.abc import Iterable
+
+from google.protobuf.message import Message
+
+from substreams_firehose.checkpoint import Checkpoint
+
+# Marker held in the buffer for completing a range in the checkpoint once its blocks are released
+_RANGE_END = object()
+
+class ReorderBuffer: #pylint: disable=too-many-instance-attributes
+    """
+    Hold the blocks pushed out of order by the workers, releasing contiguous prefixes of the period to a queue.
+
+    Blocks are tracked by the checkpoint when released (instead of when pushed by the workers), keeping the tracked \
+    blocks in the order they are acknowledged.
+
+    Attributes:
+        block_queue: The queue receiving the blocks in block number order.
+        max_size: The maximum number of blocks held in the buffer.
+        checkpoint: An optional checkpoint tracking the released blocks.
+        watermark: The highest block number below which all the blocks have been released.
+    """
+    def __init__(self, block_queue: asyncio.Queue, block_ranges: Iterable[tuple[int, int]], max_size: int = 10000,
+                 checkpoint: Checkpoint | None = None) -> None:
+        self.block_queue = block_queue
+        self.max_size = max_size
+        self.checkpoint = checkpoint
+
+        # Held blocks as (block number, push order, range end, cursor, blob)
+        self._blocks = []
+        # Covered spans not yet merged into the watermark as (start, end)
+        self._spans = []
+        self._counter = itertools.count()
+        self._room = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+        # Blocks outside of the ranges to extract (e.g. already extracted before resuming) are covered from the start
+        block_ranges = sorted(block_ranges)
+        self.watermark = block_ranges[0][0] - 1 if block_ranges else 0
+        for (_, previous_end), (start, _) in zip(block_ranges, block_ranges[1:]):
+            if start > previous_end + 1:
+                heapq.heappush(self._spans, (previous_end + 1, start - 1))
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def is_head(self, start: int) -> bool:
+        """
+        Check if the blocks of a range starting at `start` are released as soon as they are pushed.
+
+        Args:
+            start: The first block of the range.
+
+        Returns:
+            Whether all the blocks before the range have been covered.
+        """
+        return start <= self.watermark + 1
+
+    async def put(self, start: int, end: int, block_number: int, cursor: str, #pylint: disable=too-many-arguments
+                  blob: Message | dict) -> None:
+        """
+        Push a block streamed by a worker, waiting for room in the buffer if it cannot be released yet.
+
+        The block is only released once its block number is covered (see `cover`).
+
+        Args:
+            start: The first block of the stream (which covers all the blocks from `start`).
+            end: The last block of the range the block belongs to.
+            block_number: The block number.
+            cursor: The cursor of the block received from the gRPC stream.
+            blob: The block (or parsed data).
+        """
+        while not self.is_head(start) and len(self._blocks) >= self.max_size:
+            self._room.clear()
+            await self._room.wait()
+
+        heapq.heappush(self._blocks, (block_number, next(self._counter), end, cursor, blob))
+
+    async def cover(self, start: int, block_number: int) -> None:
+        """
+        Mark all the blocks from `start` to `block_number` as extracted, releasing the blocks that are now in order.
+
+        Args:
+            start: The first block of the stream.
+            block_number: The last block extracted by the stream (included).
+        """
+        if block_number < start:
+            return
+
+        heapq.heappush(self._spans, (start, block_number))
+        watermark = self.watermark
+        while self._spans and self._spans[0][0] <= self.watermark + 1:
+            self.watermark = max(self.watermark, heapq.heappop(self._spans)[1])
+
+        if self.watermark > watermark:
+            # Workers waiting for room may now be streaming the earliest range
+            self._room.set()
+
+        await self._release(self.watermark)
+
+    async def complete(self, end: int) -> None:
+        """
+        Register the end of the stream of a range, completing it in the checkpoint once all its blocks are released \
+        (see `Checkpoint.complete`).
+
+        Args:
+            end: The last block of the range.
+        """
+        if self.checkpoint:
+            # Released after the blocks of the range, as if it was the last block of the range
+            heapq.heappush(self._blocks, (end, next(self._counter), end, None, _RANGE_END))
+            await self._release(self.watermark)
+
+    def split_range(self, end: int, split: int) -> None:
+        """
+        Split the range ending at `end` in two, the first range now ending at `split` (see `Checkpoint.split_range`).
+
+        Args:
+            end: The last block of the range to split.
+            split: The last block of the first range.
+        """
+        self._blocks = [
+            (block_number, order, split if range_end == end and block_number <= split else range_end, cursor, blob)
+            for block_number, order, range_end, cursor, blob in self._blocks
+        ]
+        heapq.heapify(self._blocks)
+
+    async def drain(self) -> None:
+        """
+        Release all the remaining blocks, even if some blocks before them are missing (e.g. failed ranges).
+        """
+        if any(blob is not _RANGE_END for *_, blob in self._blocks):
+            logging.warning('Releasing %i out of order blocks (up to #%i), blocks before them are missing',
+                len(self._blocks),
+                max(self._blocks)[0]
+            )
+
+        await self._release(None)
+
+    async def _release(self, watermark: int | None) -> None:
+        """
+        Push the held blocks up to `watermark` (all of them if `None`) to the queue, in block number order.
+        """
+        # Releases from concurrent workers must not interleave
+        async with self._lock:
+            while self._blocks and (watermark is None or self._blocks[0][0] <= watermark):
+                entry = heapq.heappop(self._blocks)
+                block_number, _, end, cursor, blob = entry
+                if blob is _RANGE_END:
+                    self.checkpoint.complete(end)
+                    continue
+
+                try:
+                    await self.block_queue.put(blob)
+                except asyncio.CancelledError:
+                    # The releasing worker has been cancelled, the block is released by the next one
+                    heapq.heappush(self._blocks, entry)
+                    raise
+
+                if self.checkpoint:
+                    self.checkpoint.track(end, block_number, cursor)
+
+                if len(self._blocks) < self.max_size:
+                    self._room.set()
@@ -0,0 +1,86 @@
+"""
+SPDX-License-Identifier: MIT
+
+This extractor replays the raw responses recorded to a capture directory (see `capture.Recorder`, `--record`) instead of
+streaming them from a gRPC endpoint, yielding the same blocks as the extraction that recorded them at disk speed and
+without any network access.
+
+The responses are replayed in the order they were recorded, each block only once. In `ordered` mode, the responses of
+the period are read and sorted in memory before being replayed.
+"""
+
+import logging
+from collections.abc import AsyncIterator
+
+from google.protobuf.message import Message
+
+from substreams_firehose.block_extractors.common import RawBlock, serialize_block
+from substreams_firehose.capture import get_response_data, read_capture_metadata, read_records
+from substreams_firehose.checkpoint import Checkpoint
+from substreams_firehose.config.parser import Config
+
+async def asyncio_generator(period_start: int, period_end: int, capture: str, #pylint: disable=too-many-arguments, too-many-locals, unused-argument
+                            checkpoint: Checkpoint | None = None, lazy_decoding: bool = False,
+                            ordered: bool = False, **kwargs) -> AsyncIterator[Message | RawBlock]:
+    """
+    Replay the raw blocks recorded to a capture directory, yielding them as they are read.
+
+    Args:
+        period_start: The first block number of the targeted period.
+        period_end: The last block number of the targeted period.
+        capture: The capture directory path.
+        checkpoint: An optional checkpoint tracking the progress of the replay.
+        lazy_decoding: Keep the raw blocks serialized (as `RawBlock` objects) until they are processed.
+        ordered: Yield the blocks in block number order.
+        kwargs: Ignored, the gRPC request parameters being the recorded ones.
+
+    Yields:
+        The raw blocks (`google.protobuf.any_pb2.Any` or `RawBlock` objects) of the period.
+    """
+    metadata = read_capture_metadata(capture)
+    if period_start < metadata['period_start'] or period_end > metadata['period_end']:
+        logging.warning('Replayed period [%i, %i] is not fully covered by the recorded period [%i, %i]',
+            period_start,
+            period_end,
+            metadata['period_start'],
+            metadata['period_end']
+        )
+
+    if checkpoint:
+        checkpoint.load_block_pool([(period_start, period_end)])
+
+    logging.info('Replaying blocks #%i to #%i on %s chain from "%s"...',
+        period_start,
+        period_end,
+        Config.CHAIN,
+        capture
+    )
+
+    replayed = set()
+    if metadata['response_type']:
+        response_class = Config.PROTO_MESSAGES_CLASSES[metadata['response_type']]
+        records = (record for record in read_records(capture) if period_start <= record[0] <= period_end)
+        if ordered:
+            # Stable sort, the first record of each block is kept
+            records = sorted(records, key=lambda record: record[0])
+
+        for block_number, data in records:
+            if block_number in replayed:
+                continue
+            replayed.add(block_number)
+
+            response = response_class.FromString(data)
+            response_data = get_response_data(response)
+            # Firehose responses hold the cursor, Substreams holds it in the block scoped data
+            block_cursor = getattr(response, 'cursor', '') or getattr(response_data, 'cursor', '')
+            if lazy_decoding:
+                response_data = serialize_block(response_data)
+
+            if checkpoint:
+                checkpoint.track(period_end, block_number, block_cursor)
+            yield response_data
+
+    if checkpoint:
+        checkpoint.complete(period_end)
+
+    logging.info('Block replay done ! (%i blocks replayed)', len(replayed))
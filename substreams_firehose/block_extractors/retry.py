@@ -0,0 +1,122 @@
+"""
+SPDX-License-Identifier: MIT
+
+Applies the retry policy of the main config (see `config.parser.RetryPolicy`) to the failed block streams, shared by
+all the block extractors.
+
+Each failed range is retried after an exponential backoff (with jitter) depending on the number of retries of its
+failed block. The action taken depends on the gRPC status code of the failure: plain retry, retry with a fresh JWT
+token, retry while signaling a congestion to the extractor (for reducing the number of workers) or failing the whole
+extraction right away. A global retry budget prevents endlessly hammering a failing endpoint.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import NamedTuple
+
+import grpc
+
+from substreams_firehose.block_extractors.common import refresh_auth_token
+from substreams_firehose.config.parser import Config, RetryPolicy
+from substreams_firehose.exceptions import BlockStreamException
+
+class RetryDecision(NamedTuple):
+    """
+    How to retry a failed range.
+
+    Attributes:
+        delay: The time (in seconds) to wait before retrying the range.
+        congestion: Whether the failure signals a congestion of the endpoint (the extractor should reduce its number \
+        of workers).
+    """
+    delay: float
+    congestion: bool
+
+class RetryHandler: #pylint: disable=too-few-public-methods
+    """
+    Decide how to retry the failed ranges of an extraction according to the retry policy.
+
+    Attributes:
+        policy: The retry policy.
+        retries: The number of retries so far (counted against the policy's budget).
+        refresh_interval: The minimum time (in seconds) between two refreshes of the JWT token.
+    """
+    def __init__(self, policy: RetryPolicy | None = None, refresh_interval: float = 10.) -> None:
+        self.policy = policy or Config.RETRY_POLICY
+        self.retries = 0
+        self.refresh_interval = refresh_interval
+
+        self._failed_counter = {}
+        self._last_refresh = None
+        self._refresh_lock = asyncio.Lock()
+
+    async def _refresh_token(self) -> None:
+        # Workers failing at the same time only need a single refresh
+        async with self._refresh_lock:
+            if self._last_refresh and time.monotonic() - self._last_refresh < self.refresh_interval:
+                return
+
+            try:
+                await asyncio.to_thread(refresh_auth_token)
+                logging.info('Refreshed JWT token')
+            except RuntimeError as error:
+                logging.error('Could not refresh JWT token: %s', error)
+
+            self._last_refresh = time.monotonic()
+
+    async def handle(self, error: BlockStreamException) -> RetryDecision | None:
+        """
+        Apply the retry policy to a failed range.
+
+        Args:
+            error: The exception raised by the worker streaming the range.
+
+        Returns:
+            How to retry the remaining blocks of the range, or `None` if the maximum number of retries for the failed \
+            block has been reached.
+
+        Raises:
+            BlockStreamException: If the failure status calls for failing the extraction or if the retry budget is \
+            exhausted.
+        """
+        cause = error.__cause__
+        status = cause.code().name if isinstance(cause, grpc.aio.AioRpcError) else None
+        action = self.policy.status_actions.get(status, 'retry')
+
+        if action == 'fail':
+            logging.critical('Could not fetch block #%i: %s error, aborting...', error.failed, status)
+            raise error
+
+        if self.policy.budget is not None and self.retries >= self.policy.budget:
+            logging.critical('Could not fetch block #%i: retry budget exhausted (%i retries), aborting...',
+                error.failed,
+                self.policy.budget
+            )
+            raise error
+
+        self._failed_counter[error.failed] = self._failed_counter.get(error.failed, 0) + 1
+        attempt = self._failed_counter[error.failed]
+        if attempt > self.policy.max_retries:
+            logging.error('Could not fetch block #%i: maximum number of retries reached (%i)',
+                error.failed,
+                self.policy.max_retries
+            )
+            return None
+
+        self.retries += 1
+        if action == 'refresh_token':
+            await self._refresh_token()
+
+        delay = min(self.policy.max_backoff, self.policy.backoff * 2**(attempt - 1))
+        delay *= 1 - self.policy.jitter * random.random()
+
+        logging.warning('Could not fetch block #%i (%s): retrying in %.2fs... (%i/%i retries)',
+            error.failed,
+            status or type(cause).__name__,
+            delay,
+            attempt,
+            self.policy.max_retries
+        )
+        return RetryDecision(delay, action == 'shrink_concurrency')
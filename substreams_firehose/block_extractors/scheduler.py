@@ -0,0 +1,266 @@
+"""
+SPDX-License-Identifier: MIT
+
+Schedules the workers of the block extractors streaming a block pool over a pool of gRPC channels
+(`async_single_channel` and `async_multi_channel`).
+
+The period is split in ranges of `workload` blocks kept in a heap (the block pool), each range being streamed by a
+worker (see `common.stream_blocks`). A 'spawner' task spawns new workers on the least loaded channel as long as the
+concurrency controller allows it, and a 'supervisor' task handles the finished workers, adding back the blocks of the
+failed ones to the block pool according to the retry policy.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from collections.abc import AsyncIterator
+
+from google.protobuf.message import Message
+
+from substreams_firehose.block_cache import BlockCache
+from substreams_firehose.block_extractors.common import ChannelPool, RawBlock, stream_blocks
+from substreams_firehose.block_extractors.concurrency import ConcurrencyController
+from substreams_firehose.block_extractors.reorder import ReorderBuffer
+from substreams_firehose.block_extractors.retry import RetryHandler
+from substreams_firehose.capture import Recorder
+from substreams_firehose.checkpoint import Checkpoint
+from substreams_firehose.config.parser import Config
+from substreams_firehose.exceptions import BlockStreamException
+from substreams_firehose.utils import get_current_task_name
+
+async def stream_block_pool(period_start: int, period_end: int, channel_pool: ChannelPool, #pylint: disable=too-many-arguments, too-many-locals, too-many-statements
+                            initial_tasks: int, workload: int, max_tasks: int | None = None,
+                            spawn_frequency: float = 0.1, queue_size: int = 1000, checkpoint: Checkpoint | None = None,
+                            block_cache: BlockCache | None = None, lazy_decoding: bool = False,
+                            ordered: bool = False, reorder_size: int = 10000, recorder: Recorder | None = None,
+                            **kwargs) -> AsyncIterator[Message | RawBlock]:
+    """
+    Extract the blocks of a period split in ranges of `workload` blocks, spawning a worker (see `stream_blocks`) for \
+    each range on the least loaded channel of a channel pool and yielding the blocks as soon as they are received.
+
+    A 'spawner' task spawns new workers as long as the number of running workers is below the limit of an AIMD \
+    concurrency controller (see `concurrency.ConcurrencyController`) and the consumer keeps up with the extracted \
+    blocks. A 'supervisor' task handles the finished workers, reporting their outcome to the controller and adding \
+    back the non-extracted blocks of the failed ones to the block pool according to the retry policy (see \
+    `retry.RetryHandler`).
+
+    Args:
+        period_start: The first block number of the targeted period.
+        period_end: The last block number of the targeted period.
+        channel_pool: The pool of channels (not opened yet) used by the workers, closed once the extraction is done.
+        initial_tasks: The initial number of concurrent tasks over all channels.
+        workload: The number of blocks to extract for each task.
+        max_tasks: The maximum number of concurrent tasks over all channels (unbounded if `None`).
+        spawn_frequency: The sleep time (in seconds) for the spawner to wait before checking again if the queue has \
+        room for the blocks of new tasks.
+        queue_size: The maximum number of extracted blocks waiting to be consumed by the caller.
+        checkpoint: An optional checkpoint tracking the progress of the extraction. If it has been loaded from a \
+        checkpoint file, only the remaining blocks of the unfinished ranges are extracted.
+        block_cache: An optional cache of the gRPC stream responses, only the non-cached blocks are streamed from \
+        the endpoint.
+        lazy_decoding: Keep the raw blocks serialized (as `RawBlock` objects) until they are processed.
+        ordered: Yield the blocks in block number order.
+        reorder_size: The maximum number of blocks held in the reorder buffer waiting for earlier blocks (if \
+        `ordered` is set).
+        recorder: An optional recorder writing the gRPC stream responses to a capture directory.
+        kwargs: Additional keyword arguments to pass to the gRPC request (must match `.proto` file definition).
+
+    Yields:
+        Raw blocks (`google.protobuf.any_pb2.Any` or `RawBlock` objects) that can later be processed.
+
+    Raises:
+        BlockStreamException: If a failed range can't be retried (see `retry.RetryHandler.handle`).
+    """
+    async def _spawner():
+        """
+        Spawn new workers on the least loaded channel each time the concurrency limit allows it, until the block pool \
+        is empty and all workers are done.
+        """
+        def __task_done_callback(task):
+            """
+            When a task is done, release its channel, remove the task from the `running` set and add it to the `done` \
+            queue.
+            """
+            if task.cancelled():
+                logging.debug('%s was cancelled', task.get_name())
+            elif task.exception():
+                logging.error('%s encountered an exception', task.get_name())
+            else:
+                logging.debug('%s finished block streaming', task.get_name())
+            channel_pool.release(tasks_info[task][3])
+            tasks_running.remove(task)
+            tasks_done.put_nowait(task)
+
+        # Workers are only removed from `tasks_info` once handled by the supervisor (which may add back their blocks)
+        while block_pool or tasks_info or retries:
+            # Backpressure: don't add more workers while the consumer can't keep up with the extracted blocks
+            # The earliest range is always streamed (even above the concurrency limit), as the blocks of the other \
+            # ranges are waiting for it in the reorder buffer
+            while block_pool and not block_queue.full() and (
+                len(tasks_running) < controller.max_tasks
+                or (reorder_buffer and reorder_buffer.is_head(block_pool[0][0]))
+            ):
+                start, end = heapq.heappop(block_pool)
+                secure_channel = channel_pool.acquire()
+                new_task = asyncio.create_task(
+                    stream_blocks(
+                        start,
+                        end,
+                        secure_channel,
+                        block_queue=block_queue,
+                        checkpoint=checkpoint,
+                        block_cache=block_cache,
+                        recorder=recorder,
+                        lazy_decoding=lazy_decoding,
+                        reorder_buffer=reorder_buffer,
+                        **kwargs
+                    )
+                )
+                new_task.add_done_callback(__task_done_callback)
+                tasks_running.add(new_task)
+                tasks_info[new_task] = (start, end, time.perf_counter(), secure_channel)
+
+            logging.debug('[%s] %i/%i tasks running (%s per channel) | %i blocks remaining in block pool',
+                get_current_task_name(),
+                len(tasks_running),
+                controller.max_tasks,
+                channel_pool.load,
+                sum(end - start + 1 for start, end in block_pool),
+            )
+
+            # Woken up by the supervisor once a finished worker has been handled
+            spawn_event.clear()
+            try:
+                if block_pool and block_queue.full():
+                    # The queue doesn't signal when it has room again, check back periodically
+                    await asyncio.wait_for(spawn_event.wait(), timeout=spawn_frequency)
+                else:
+                    await spawn_event.wait()
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                logging.warning('[%s] Cancelled, stopping spawner task NOW...', get_current_task_name())
+                return
+
+        logging.debug('[%s] No more blocks in block pool, stopping spawner task NOW...', get_current_task_name())
+
+    async def _supervisor():
+        """
+        Handle the workers once they are done, reporting their outcome to the concurrency controller and adding back \
+        the non-extracted blocks of the failed ones to the block pool after the backoff delay of the retry policy.
+        """
+        def __retry_ready_callback(task):
+            """
+            When the backoff delay of a failed range has elapsed, add its blocks back to the block pool.
+            """
+            retries.discard(task)
+            if not task.cancelled():
+                heapq.heappush(block_pool, task.result())
+                spawn_event.set()
+
+        async def __retry(error, started):
+            """
+            Apply the retry policy to a failed worker, adding its non-extracted blocks back to the block pool once the \
+            backoff delay has elapsed.
+            """
+            decision = await retry_handler.handle(error)
+            if decision is None:
+                return
+
+            if decision.congestion:
+                controller.on_congestion(started, f'{error.__cause__.code().name} error')
+
+            retry_task = asyncio.create_task(asyncio.sleep(decision.delay, result=(error.failed, error.end)))
+            retry_task.add_done_callback(__retry_ready_callback)
+            retries.add(retry_task)
+
+        try:
+            # Keep going while finished tasks are yet to be handled or the spawner still has blocks to give
+            while tasks_running or not tasks_done.empty() or not spawner_task.done():
+                # Queue is filled by the workers when exiting (using __task_done_callback)
+                get_task = asyncio.create_task(tasks_done.get())
+                await asyncio.wait({get_task, spawner_task}, return_when=asyncio.FIRST_COMPLETED)
+                if not get_task.done():
+                    # Don't wait forever on the queue if the spawner exits
+                    get_task.cancel()
+                    continue
+
+                task = get_task.result()
+                start, end, started, _ = tasks_info[task]
+
+                if not task.cancelled():
+                    task_exception = task.exception()
+                    if task_exception is None:
+                        # The finished worker has already been removed from the running ones, and none of the workers
+                        # use the limit when held back by the consumer
+                        running = 0 if block_queue.full() else len(tasks_running) + 1
+                        controller.on_success(started, end - start + 1, running)
+                    elif isinstance(task_exception, BlockStreamException):
+                        await __retry(task_exception, started)
+                    else:
+                        # Not a stream failure (e.g. a bug in the block cache or the recorder), retrying won't help
+                        raise task_exception
+
+                # Only now the spawner can consider the worker gone, its blocks being back to the pool (or retrying)
+                del tasks_info[task]
+                spawn_event.set()
+
+            if reorder_buffer:
+                await reorder_buffer.drain()
+        finally:
+            # Signal the end of the extraction to the consumer
+            await block_queue.put(None)
+
+    # Filled by the workers of all the channels with the extracted blocks, consumed by the caller
+    block_queue = asyncio.Queue(maxsize=queue_size)
+    tasks_done = asyncio.Queue()
+    tasks_running = set()
+    # Range, start time and channel of each worker as (start, end, start time, channel)
+    tasks_info = {}
+    spawn_event = asyncio.Event()
+    # Failed ranges waiting for their backoff delay before being added back to the block pool
+    retries = set()
+    retry_handler = RetryHandler()
+    controller = ConcurrencyController(initial_limit=initial_tasks, max_limit=max_tasks)
+
+    # Split the period range into smaller ranges according to the workload given to each task, kept as a heap for
+    # giving out the earliest ranges first
+    block_pool = [(k, min(k + workload - 1, period_end)) for k in range(period_start, period_end + 1, workload)]
+    if checkpoint:
+        block_pool = checkpoint.load_block_pool(block_pool)
+    heapq.heapify(block_pool)
+    # Blocks pushed by the workers ahead of the earliest running range, if ordered
+    reorder_buffer = ReorderBuffer(block_queue, block_pool, reorder_size, checkpoint) if ordered else None
+    blocks_count = 0
+
+    logging.info('Streaming %i blocks on %s chain (using %i channels)...',
+        sum(end - start + 1 for start, end in block_pool),
+        Config.CHAIN,
+        channel_pool.size
+    )
+
+    async with channel_pool:
+        spawner_task = asyncio.create_task(_spawner())
+        supervisor_task = asyncio.create_task(_supervisor())
+        try:
+            block = await block_queue.get()
+            while block is not None:
+                blocks_count += 1
+                yield block
+                block = await block_queue.get()
+
+            # Propagate any unexpected exception from the supervisor
+            supervisor_task.result()
+        finally:
+            # Only relevant if the consumer stops iterating before all the blocks have been extracted
+            supervisor_task.cancel()
+            spawner_task.cancel()
+            for task in [*tasks_running, *retries]:
+                task.cancel()
+
+    logging.info('Concurrency limit: %s', controller.report())
+    logging.debug('Concurrency limit history (elapsed seconds, limit, reason): %s', controller.history)
+    logging.info('Finished block streaming, got %i blocks [SUCCESS]',
+        blocks_count,
+    )
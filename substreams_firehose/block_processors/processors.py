@@ -6,19 +6,26 @@ Provides block processors to parse information from the extracted blocks of a gR
 
 import json
 import logging
+import sys
 from datetime import datetime
+from functools import partial
+from collections.abc import Callable, Iterable, Sequence
 from typing import Iterator
 
-from google.protobuf.json_format import MessageToJson
 from google.protobuf.message import Message
 
+from substreams_firehose.block_extractors.common import batch_adapter, unpack_block #pylint: disable=unused-import
+from substreams_firehose.block_processors.projection import get_json_encoder, get_projection
 from substreams_firehose.config.parser import StubConfig
-from substreams_firehose.utils import filter_keys
+from substreams_firehose.json_backend import get_json_backend
 
 def _filter_data(data: Message, _filter: dict) -> dict:
     """
     Return the output of a gRPC response as JSON data using the given output filter.
 
+    Only the fields selected by the filter are read from the message, using a projection compiled once for each \
+    message type and filter (see `block_processors.projection`).
+
     Args:
         data: The output message from a gRPC service.
         _filter: A nested dictionary filter.
@@ -27,8 +34,101 @@ def _filter_data(data: Message, _filter: dict) -> dict:
         A dictionary representing the filtered output data as JSON.
     """
 
-    json_data = json.loads(MessageToJson(data, preserving_proto_field_name=True))
-    return filter_keys(json_data, _filter) if _filter else json_data
+    return get_projection(data.DESCRIPTOR, _filter)(data)
+
+def typed_block_processor(block_processor: Callable[[Message], Iterator]) -> Callable[[Message], Iterator]:
+    """
+    Mark a block processor as taking the unpacked blocks, its fields being read directly as attributes of the \
+    concrete message type (e.g. `block.header.timestamp` for an `sf.ethereum.type.v2.Block`) instead of going through \
+    JSON dictionaries.
+
+    Packed blocks (`google.protobuf.any_pb2.Any` objects) are unpacked once before being handed to the block processor \
+    (see `block_extractors.common.unpack_block`). Substreams outputs are not packed themselves, use `unpack_block` on \
+    their `map_output` instead.
+
+    Args:
+        block_processor: A generator function extracting relevant data from a block.
+
+    Returns:
+        The same block processor, marked as typed.
+
+    Example:
+    ```python
+    @typed_block_processor
+    def my_block_processor(block: Message) -> Iterator[dict]:
+        yield {'number': block.number, 'transactions': len(block.transaction_traces)}
+    ```
+    """
+    block_processor.typed = True
+    return block_processor
+
+def batch_block_processor(process_batch: Callable[[Sequence[Message]], Iterable] | None = None, *,
+                          row_counts: Callable[[Sequence[Message]], Iterable[int]] | None = None) -> Callable:
+    """
+    Mark a block processor as taking a batch of blocks at once (`process_batch(blocks) -> rows`) instead of a single \
+    block, amortizing the per-block overhead (generator setup, config lookups, etc.) over the whole batch.
+
+    Batch processors are called with chunks of blocks, in order, and return (or yield) the rows of all the blocks, \
+    in order. They can be combined with `typed_block_processor`. A batch processor named `<name>_batch` is used in \
+    place of the `<name>` block processor given to `--custom-processor` (see `get_batch_processor`).
+
+    The blocks are acknowledged to the checkpoint (and to the output shards) once their rows have been written: give \
+    the number of rows returned for each block with `row_counts`, otherwise the blocks of a batch are acknowledged \
+    together after all its rows.
+
+    Args:
+        process_batch: A function extracting relevant data from a list of blocks.
+        row_counts: An optional function returning the number of rows returned for each block of a batch, in order.
+
+    Returns:
+        The same function, marked as a batch processor (or a decorator doing so if only `row_counts` is given).
+
+    Example:
+    ```python
+    @batch_block_processor(row_counts=lambda blocks: [1] * len(blocks))
+    def my_block_processor_batch(blocks: list[Message]) -> list[dict]:
+        return [{'id': block.id} for block in blocks]
+    ```
+    """
+    if process_batch is None:
+        return partial(batch_block_processor, row_counts=row_counts)
+
+    process_batch.batch = True
+    if row_counts is not None:
+        process_batch.row_counts = row_counts
+    return process_batch
+
+def _one_row_per_block(blocks: Sequence[Message]) -> list[int]:
+    """
+    Row counts of the batch processors returning a single row for each block.
+    """
+    return [1] * len(blocks)
+
+def _one_row_per_output(blocks: Sequence[Message]) -> list[int]:
+    """
+    Row counts of the Substreams batch processors returning a row for each output module of a block.
+    """
+    return [len(block.outputs) for block in blocks]
+
+def get_batch_processor(block_processor: Callable) -> Callable[[Sequence[Message]], Iterable]:
+    """
+    Get the batch version of a block processor.
+
+    Args:
+        block_processor: A block processor or a batch processor.
+
+    Returns:
+        The batch processor itself, the `<name>_batch` batch processor defined alongside the block processor in its \
+        module if any, or the block processor wrapped by `batch_adapter`.
+    """
+    if getattr(block_processor, 'batch', False):
+        return block_processor
+
+    process_batch = getattr(sys.modules.get(block_processor.__module__), f'{block_processor.__name__}_batch', None)
+    if getattr(process_batch, 'batch', False):
+        return process_batch
+
+    return batch_adapter(block_processor)
 
 def default_processor(data: Message) -> Iterator[dict]:
     """
@@ -55,6 +155,164 @@ def default_substream_processor(data: Message) -> Iterator[dict]:
     for output in data.outputs:
         yield _filter_data(output.map_output, StubConfig.RESPONSE_PARAMETERS[output.name])
 
+@batch_block_processor(row_counts=_one_row_per_block)
+def default_processor_batch(blocks: Sequence[Message]) -> list[dict]:
+    """
+    Batch version of `default_processor`, looking up the output filter and its projection once for the whole batch.
+
+    Args:
+        blocks: The output messages from a gRPC service.
+
+    Returns:
+        The filtered data of each message.
+    """
+    if not blocks:
+        return []
+
+    keys_filter = StubConfig.RESPONSE_PARAMETERS
+    descriptor = blocks[0].DESCRIPTOR
+    if all(block.DESCRIPTOR is descriptor for block in blocks):
+        return list(map(get_projection(descriptor, keys_filter), blocks))
+
+    return [get_projection(block.DESCRIPTOR, keys_filter)(block) for block in blocks]
+
+@batch_block_processor(row_counts=_one_row_per_output)
+def default_substream_processor_batch(blocks: Sequence[Message]) -> list[dict]:
+    """
+    Batch version of `default_substream_processor`, looking up the projection of each output module once for the \
+    whole batch.
+
+    Args:
+        blocks: The output messages from the substream.
+
+    Returns:
+        The filtered data of the output modules present in each message.
+    """
+    keys_filters = StubConfig.RESPONSE_PARAMETERS
+    # Projections by (output module, message type)
+    projections = {}
+    rows = []
+    for block in blocks:
+        for output in block.outputs:
+            map_output = output.map_output
+            key = (output.name, map_output.DESCRIPTOR)
+            try:
+                projection = projections[key]
+            except KeyError:
+                projection = projections[key] = get_projection(map_output.DESCRIPTOR, keys_filters[output.name])
+
+            rows.append(projection(map_output))
+
+    return rows
+
+def json_text_processor(data: Message) -> Iterator[str]:
+    """
+    Yield the unfiltered output of a gRPC response as JSON text, encoded directly from the message without building \
+    a dictionary first (fast path of `default_processor` for stubs without an output filter).
+
+    Args:
+        data: The output message from a gRPC service.
+
+    Yields:
+        The JSON text of the output message.
+    """
+    yield get_json_encoder(data.DESCRIPTOR)(data)
+
+@batch_block_processor(row_counts=_one_row_per_block)
+def json_text_processor_batch(blocks: Sequence[Message]) -> list[str]:
+    """
+    Batch version of `json_text_processor`.
+
+    Args:
+        blocks: The output messages from a gRPC service.
+
+    Returns:
+        The JSON text of each message.
+    """
+    return [get_json_encoder(block.DESCRIPTOR)(block) for block in blocks]
+
+def substream_json_text_processor(data: Message) -> Iterator[str]:
+    """
+    Yield the unfiltered output of each output module from a Substreams-enabled gRPC endpoint as JSON text (fast \
+    path of `default_substream_processor` for stubs without an output filter).
+
+    Args:
+        data: The output message from the substream.
+
+    Yields:
+        The JSON text of each output module.
+    """
+    for output in data.outputs:
+        yield get_json_encoder(output.map_output.DESCRIPTOR)(output.map_output)
+
+@batch_block_processor(row_counts=_one_row_per_output)
+def substream_json_text_processor_batch(blocks: Sequence[Message]) -> list[str]:
+    """
+    Batch version of `substream_json_text_processor`.
+
+    Args:
+        blocks: The output messages from the substream.
+
+    Returns:
+        The JSON text of the output modules present in each message.
+    """
+    return [
+        get_json_encoder(output.map_output.DESCRIPTOR)(output.map_output) for block in blocks for output in block.outputs
+    ]
+
+def message_processor(data: Message) -> Iterator[Message]:
+    """
+    Yield the output message of a gRPC response as-is, leaving the output filter to the sink (e.g. for the columnar \
+    output formats reading the fields natively).
+
+    Args:
+        data: The output message from a gRPC service.
+
+    Yields:
+        The output message.
+    """
+    yield data
+
+def substream_message_processor(data: Message) -> Iterator[Message]:
+    """
+    Yield the output messages of each output module from a Substreams-enabled gRPC endpoint as-is, leaving the output \
+    filter to the sink.
+
+    Args:
+        data: The output message from the substream.
+
+    Yields:
+        The packed output message (`google.protobuf.any_pb2.Any`) of each output module.
+    """
+    for output in data.outputs:
+        yield output.map_output
+
+@batch_block_processor(row_counts=_one_row_per_block)
+def message_processor_batch(blocks: Sequence[Message]) -> list[Message]:
+    """
+    Batch version of `message_processor`.
+
+    Args:
+        blocks: The output messages from a gRPC service.
+
+    Returns:
+        The output messages.
+    """
+    return list(blocks)
+
+@batch_block_processor(row_counts=_one_row_per_output)
+def substream_message_processor_batch(blocks: Sequence[Message]) -> list[Message]:
+    """
+    Batch version of `substream_message_processor`.
+
+    Args:
+        blocks: The output messages from the substream.
+
+    Returns:
+        The packed output message of each output module.
+    """
+    return [output.map_output for block in blocks for output in block.outputs]
+
 def filtered_block_processor(raw_block: Message) -> Iterator[dict]:
     """
     Yield all transactions from a Firehose V1 gRPC filtered block, returning a subset of relevant properties.
@@ -95,7 +353,7 @@ def filtered_block_processor(raw_block: Message) -> Iterator[dict]:
 
                 action = action_trace['action']
                 try:
-                    json_data = json.loads(action['json_data'])
+                    json_data = get_json_backend().loads(action['json_data'])
                 except json.JSONDecodeError as error:
                     logging.warning('Could not parse action (trxid=%s): %s\n',
                         action_trace['transaction_id'],
@@ -0,0 +1,457 @@
+"""
+SPDX-License-Identifier: MIT
+
+Compiles the output filter of the stub config (`StubConfig.RESPONSE_PARAMETERS`) against a message descriptor into a
+projection, reading only the selected fields straight from the protobuf messages.
+
+The projection produces the same JSON-compatible dictionary as converting the whole message to JSON (with
+`MessageToJson` and `preserving_proto_field_name=True`) and filtering it afterwards with `utils.filter_keys`: 64-bit
+integers as strings, bytes as base64, enums by name, well-known types in their JSON form, etc. Unselected fields are
+never converted and selected sub-messages are only converted if the filter selects all of their fields. Packed
+messages (`google.protobuf.Any`) are not even decoded beyond their selected top-level fields.
+
+Without any output filter, the JSON text of a message can also be encoded directly (see `get_json_encoder`), skipping
+the intermediate dictionary: the text is the same as the JSON backend (see `json_backend`) encoding of the dictionary
+returned by the projection.
+"""
+
+import base64
+import logging
+import math
+from collections.abc import Callable, Mapping, Sequence
+from typing import Any
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.internal.type_checkers import ToShortestFloat
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+
+from substreams_firehose.block_processors.wire import prune_message
+from substreams_firehose.config.parser import get_message_class
+from substreams_firehose.json_backend import JsonBackend, get_json_backend
+from substreams_firehose.utils import filter_keys
+
+# Messages with a special JSON representation (see the Proto3 JSON mapping)
+WELL_KNOWN_TYPES = (
+    'google.protobuf.Any',
+    'google.protobuf.BoolValue',
+    'google.protobuf.BytesValue',
+    'google.protobuf.DoubleValue',
+    'google.protobuf.Duration',
+    'google.protobuf.FieldMask',
+    'google.protobuf.FloatValue',
+    'google.protobuf.Int32Value',
+    'google.protobuf.Int64Value',
+    'google.protobuf.ListValue',
+    'google.protobuf.StringValue',
+    'google.protobuf.Struct',
+    'google.protobuf.Timestamp',
+    'google.protobuf.UInt32Value',
+    'google.protobuf.UInt64Value',
+    'google.protobuf.Value',
+)
+
+def _is_map(field: FieldDescriptor) -> bool:
+    return (field.type == FieldDescriptor.TYPE_MESSAGE
+            and field.message_type.has_options
+            and field.message_type.GetOptions().map_entry)
+
+def _is_set(message: Message, field: FieldDescriptor) -> bool:
+    """
+    Check if a field would be listed by `ListFields` (i.e. printed to JSON), without converting its value.
+    """
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        return len(getattr(message, field.name)) > 0
+
+    if field.has_presence:
+        return message.HasField(field.name)
+
+    # Fields without presence are set if not zero (negative zero included)
+    value = getattr(message, field.name)
+    if field.cpp_type in (FieldDescriptor.CPPTYPE_FLOAT, FieldDescriptor.CPPTYPE_DOUBLE):
+        return value != 0 or math.copysign(1, value) < 0
+
+    return value != field.default_value
+
+def _json_value(field: FieldDescriptor, value: Any) -> Any: #pylint: disable=too-many-return-statements
+    """
+    Convert a single field value (an element for repeated fields) to its JSON representation.
+    """
+    cpp_type = field.cpp_type
+
+    if cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+        return MessageToDict(value, preserving_proto_field_name=True)
+
+    if cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        if field.enum_type.full_name == 'google.protobuf.NullValue':
+            return None
+        enum_value = field.enum_type.values_by_number.get(value)
+        return value if enum_value is None else enum_value.name
+
+    if cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        return base64.b64encode(value).decode('utf-8') if field.type == FieldDescriptor.TYPE_BYTES else value
+
+    if cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        return bool(value)
+
+    if cpp_type in (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64):
+        return str(value)
+
+    if cpp_type in (FieldDescriptor.CPPTYPE_FLOAT, FieldDescriptor.CPPTYPE_DOUBLE):
+        if math.isinf(value):
+            return '-Infinity' if value < 0 else 'Infinity'
+        if math.isnan(value):
+            return 'NaN'
+        if cpp_type == FieldDescriptor.CPPTYPE_FLOAT:
+            return ToShortestFloat(value)
+
+    return value
+
+def _field_json(field: FieldDescriptor, value: Any) -> Any:
+    """
+    Convert a field value (singular, repeated or map) to its JSON representation.
+    """
+    if _is_map(field):
+        value_field = field.message_type.fields_by_name['value']
+        return {
+            ('true' if key else 'false') if isinstance(key, bool) else str(key): _json_value(value_field, value[key])
+            for key in value
+        }
+
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        return [_json_value(field, element) for element in value]
+
+    return _json_value(field, value)
+
+def _filter_value(value: Any, keys_filter: dict | str) -> Any:
+    """
+    Filter a JSON value the same way `utils.filter_keys` filters the values of a dictionary.
+    """
+    if not isinstance(keys_filter, dict):
+        return value
+
+    if isinstance(value, Sequence):
+        if value and isinstance(value[0], dict):
+            return [filter_keys(element, keys_filter) for element in value]
+        return value
+
+    if isinstance(value, Mapping):
+        return filter_keys(value, keys_filter)
+
+    return value
+
+class MessageProjection: #pylint: disable=too-few-public-methods
+    """
+    Projection of a regular (i.e. not well-known) message type.
+
+    Attributes:
+        descriptor: The descriptor of the projected message type.
+        fields: The selected fields, in field number order, as `(field descriptor, sub-projection)` tuples. The \
+        sub-projection is `None` if the field value is converted as a whole.
+        field_numbers: The numbers of the selected fields.
+        filters: The filter applied to the JSON representation of the selected fields converted as a whole.
+    """
+    def __init__(self, descriptor: Descriptor, keys_filter: dict) -> None:
+        self.descriptor = descriptor
+        self.fields = []
+        self.filters = {}
+
+        for name, field_filter in keys_filter.items():
+            field = descriptor.fields_by_name.get(name)
+            if field is None:
+                continue
+
+            projection = None
+            if (isinstance(field_filter, dict) and field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE
+                and not _is_map(field)
+                and (field.message_type.full_name == 'google.protobuf.Any'
+                     or field.message_type.full_name not in WELL_KNOWN_TYPES)):
+                projection = compile_projection(field.message_type, field_filter)
+
+            self.fields.append((field, projection))
+            self.filters[name] = field_filter
+
+        # Keep the order of the JSON representation
+        self.fields.sort(key=lambda entry: entry[0].number)
+        self.field_numbers = frozenset(field.number for field, _ in self.fields)
+
+    def __call__(self, message: Message, output: dict | None = None) -> dict:
+        output = {} if output is None else output
+
+        for field, projection in self.fields:
+            if not _is_set(message, field):
+                continue
+
+            value = getattr(message, field.name)
+            if projection is None:
+                output[field.name] = _filter_value(_field_json(field, value), self.filters[field.name])
+            elif field.label == FieldDescriptor.LABEL_REPEATED:
+                output[field.name] = [projection(element) for element in value]
+            else:
+                output[field.name] = projection(value)
+
+        return output
+
+class AnyProjection: #pylint: disable=too-few-public-methods
+    """
+    Projection of `google.protobuf.Any` messages, the packed message type being known only when projecting.
+
+    The unselected top-level fields of the packed message are dropped from its serialized bytes before decoding it \
+    (see `wire.prune_message`). Pruning is disabled for a message type if the selected fields make up most of the \
+    message, walking the bytes being slower than decoding them.
+
+    Attributes:
+        keys_filter: The filter applied to the JSON representation of the packed message (with its `@type` key). \
+        Keeps all the fields if empty.
+        projections: The compiled projection of each packed message type, by type URL.
+        pruning: Whether the packed messages are pruned before being decoded, by type URL.
+    """
+    def __init__(self, keys_filter: dict | None = None) -> None:
+        self.keys_filter = keys_filter or {}
+        self.projections = {}
+        self.pruning = {}
+
+    def __call__(self, message: Message) -> dict:
+        if not message.ListFields():
+            return {}
+
+        type_url = message.type_url
+        try:
+            projection, message_class = self.projections[type_url]
+        except KeyError:
+            try:
+                message_class = get_message_class(type_url)
+            except KeyError:
+                message_class = None
+
+            if message_class and message_class.DESCRIPTOR.full_name in WELL_KNOWN_TYPES:
+                message_class = None
+
+            projection = None
+            if message_class and self.keys_filter:
+                projection = MessageProjection(message_class.DESCRIPTOR, self.keys_filter)
+
+            self.projections[type_url] = (projection, message_class)
+            self.pruning[type_url] = True
+
+        if message_class is None:
+            # Unknown and well-known packed types are converted as a whole
+            output = MessageToDict(message, preserving_proto_field_name=True)
+            return filter_keys(output, self.keys_filter) if self.keys_filter else output
+
+        if projection is None:
+            # All the fields are kept, the packed message is unpacked with its registered class
+            output = {'@type': type_url}
+            output.update(MessageToDict(message_class.FromString(message.value), preserving_proto_field_name=True))
+            return output
+
+        value = message.value
+        if self.pruning[type_url]:
+            pruned = prune_message(value, projection.field_numbers)
+            if 2*len(pruned) > len(value):
+                logging.debug('Disabled pruning of "%s" messages: %i/%i bytes selected', type_url, len(pruned), len(value))
+                self.pruning[type_url] = False
+            value = pruned
+
+        output = {'@type': type_url} if '@type' in self.keys_filter else {}
+        return projection(message_class.FromString(value), output)
+
+def compile_projection(descriptor: Descriptor, keys_filter: dict | str | None) -> Callable[[Message], dict]:
+    """
+    Compile an output filter into a projection for the given message type.
+
+    Args:
+        descriptor: The descriptor of the message type.
+        keys_filter: A nested dictionary filter (see `utils.filter_keys`). Keeps all the fields if empty or not a \
+        dictionary.
+
+    Returns:
+        A function converting a message of the given type to its filtered JSON representation.
+    """
+    if descriptor.full_name == 'google.protobuf.Any':
+        return AnyProjection(keys_filter if isinstance(keys_filter, dict) else None)
+
+    if not isinstance(keys_filter, dict) or not keys_filter:
+        return lambda message: MessageToDict(message, preserving_proto_field_name=True)
+
+    if descriptor.full_name in WELL_KNOWN_TYPES:
+        return lambda message: _filter_value(MessageToDict(message, preserving_proto_field_name=True), keys_filter)
+
+    return MessageProjection(descriptor, keys_filter)
+
+def get_projection(descriptor: Descriptor, keys_filter: dict | str | None) -> Callable[[Message], dict]:
+    """
+    Get the compiled projection of an output filter for the given message type, compiling it on first use.
+
+    Args:
+        descriptor: The descriptor of the message type.
+        keys_filter: A nested dictionary filter (see `utils.filter_keys`), usually from the stub config.
+
+    Returns:
+        A function converting a message of the given type to its filtered JSON representation.
+    """
+    key = (descriptor.full_name, id(keys_filter))
+    try:
+        return get_projection.cache[key][0]
+    except KeyError:
+        # Keep a reference to the filter so that its id cannot be reused by another filter
+        get_projection.cache[key] = (compile_projection(descriptor, keys_filter), keys_filter)
+        return get_projection.cache[key][0]
+
+# Compiled projections by (message full name, filter id)
+get_projection.cache = {}
+
+def _compile_json_value(field: FieldDescriptor, backend: JsonBackend) -> Callable[[Any], str]: #pylint: disable=too-many-return-statements
+    """
+    Compile the function encoding a single field value (an element for repeated fields) to JSON text.
+    """
+    cpp_type = field.cpp_type
+
+    if cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+        return get_json_encoder(field.message_type, backend)
+
+    if cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        if field.enum_type.full_name == 'google.protobuf.NullValue':
+            return lambda value: 'null'
+        names = {number: f'"{value.name}"' for number, value in field.enum_type.values_by_number.items()}
+        return lambda value: names.get(value) or str(value)
+
+    if cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        if field.type == FieldDescriptor.TYPE_BYTES:
+            # Base64 characters never need escaping
+            return lambda value: '"' + base64.b64encode(value).decode('ascii') + '"'
+        return backend.encode_string
+
+    if cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        return lambda value: 'true' if value else 'false'
+
+    if cpp_type in (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64):
+        return lambda value: f'"{value}"'
+
+    if cpp_type in (FieldDescriptor.CPPTYPE_FLOAT, FieldDescriptor.CPPTYPE_DOUBLE):
+        # Float formatting is specific to each backend
+        return lambda value: backend.dumps(_json_value(field, value))
+
+    return int.__repr__
+
+def _compile_json_field(field: FieldDescriptor, backend: JsonBackend) -> Callable[[Any], str]:
+    """
+    Compile the function encoding a field value (singular, repeated or map) to JSON text.
+    """
+    item_separator = backend.item_separator
+
+    if _is_map(field):
+        key_field = field.message_type.fields_by_name['key']
+        encode_value = _compile_json_value(field.message_type.fields_by_name['value'], backend)
+        key_separator = backend.key_separator
+        if key_field.cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+            encode_key = lambda key: '"true"' if key else '"false"' #pylint: disable=unnecessary-lambda-assignment
+        else:
+            encode_key = lambda key: backend.encode_string(str(key)) #pylint: disable=unnecessary-lambda-assignment
+        return lambda value: '{' + item_separator.join([
+            encode_key(key) + key_separator + encode_value(value[key]) for key in value
+        ]) + '}'
+
+    encode_value = _compile_json_value(field, backend)
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        return lambda value: '[' + item_separator.join(map(encode_value, value)) + ']'
+
+    return encode_value
+
+class MessageJsonEncoder: #pylint: disable=too-few-public-methods
+    """
+    Encoder of a regular (i.e. not well-known) message type to JSON text, without any output filter.
+
+    Only the fields listed by `ListFields` (i.e. the fields printed by `MessageToDict`) are visited, each with the \
+    encoder compiled for its type.
+
+    Attributes:
+        descriptor: The descriptor of the encoded message type.
+        backend: The JSON backend whose output format is reproduced.
+        fields: The JSON key (with its separator) and value encoder of each field, by field descriptor.
+    """
+    def __init__(self, descriptor: Descriptor, backend: JsonBackend) -> None:
+        self.descriptor = descriptor
+        self.backend = backend
+        self.fields = {}
+
+    def compile(self) -> None:
+        """
+        Compile the encoders of the fields, once the message encoder is reachable by recursive message types.
+        """
+        for field in self.descriptor.fields:
+            self.fields[field] = (f'"{field.name}"{self.backend.key_separator}', _compile_json_field(field, self.backend))
+
+    def __call__(self, message: Message) -> str:
+        fields = self.fields
+        parts = []
+        for field, value in message.ListFields():
+            key, encode = fields[field]
+            parts.append(key + encode(value))
+
+        return '{' + self.backend.item_separator.join(parts) + '}'
+
+class AnyJsonEncoder: #pylint: disable=too-few-public-methods
+    """
+    Encoder of `google.protobuf.Any` messages to JSON text, unpacking them with their registered class.
+
+    Attributes:
+        backend: The JSON backend whose output format is reproduced.
+    """
+    def __init__(self, backend: JsonBackend) -> None:
+        self.backend = backend
+
+    def __call__(self, message: Message) -> str:
+        if not message.ListFields():
+            return '{}'
+
+        try:
+            message_class = get_message_class(message.type_url)
+        except KeyError:
+            message_class = None
+
+        if message_class is None or message_class.DESCRIPTOR.full_name in WELL_KNOWN_TYPES:
+            return self.backend.dumps(MessageToDict(message, preserving_proto_field_name=True))
+
+        text = get_json_encoder(message_class.DESCRIPTOR, self.backend)(message_class.FromString(message.value))
+        fields = self.backend.item_separator + text[1:] if len(text) > 2 else '}'
+        return '{"@type"' + self.backend.key_separator + self.backend.encode_string(message.type_url) + fields
+
+def get_json_encoder(descriptor: Descriptor, backend: JsonBackend | None = None) -> Callable[[Message], str]:
+    """
+    Get the JSON text encoder of a message type, compiling it on first use.
+
+    Encoding a message gives the same text as encoding the dictionary of its projection without filter with the \
+    `dumps` function of the backend.
+
+    Args:
+        descriptor: The descriptor of the message type.
+        backend: The JSON backend whose output format is reproduced, the selected one by default (see \
+        `json_backend.get_json_backend`).
+
+    Returns:
+        A function converting a message of the given type to its unfiltered JSON text.
+    """
+    backend = backend or get_json_backend()
+    key = (descriptor.full_name, backend.name)
+    try:
+        return get_json_encoder.cache[key]
+    except KeyError:
+        pass
+
+    if descriptor.full_name == 'google.protobuf.Any':
+        encoder = AnyJsonEncoder(backend)
+    elif descriptor.full_name in WELL_KNOWN_TYPES:
+        def encoder(message: Message) -> str:
+            return backend.dumps(MessageToDict(message, preserving_proto_field_name=True))
+    else:
+        # Cached before compiling its fields for recursive message types
+        encoder = MessageJsonEncoder(descriptor, backend)
+        get_json_encoder.cache[key] = encoder
+        encoder.compile()
+
+    get_json_encoder.cache[key] = encoder
+    return encoder
+
+# Compiled JSON text encoders by (message full name, JSON backend name)
+get_json_encoder.cache = {}
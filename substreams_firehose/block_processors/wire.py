@@ -0,0 +1,81 @@
+"""
+SPDX-License-Identifier: MIT
+
+Walks the protobuf wire format of serialized messages, allowing to drop the unselected fields of a block before
+decoding it.
+
+Decoding a block (e.g. a few MB for an Ethereum block) materializes all of its fields while a narrow output filter only
+needs a handful of them. Pruning the top-level fields of the serialized block first, unselected fields (most of them
+length-delimited like transaction traces) are skipped over without being copied nor decoded.
+"""
+
+from collections.abc import Container
+
+def prune_message(value: bytes, field_numbers: Container[int]) -> bytes: #pylint: disable=too-many-branches
+    """
+    Keep only the given top-level fields of a serialized message.
+
+    Selected fields are kept as-is (nested messages included) and in the same order, so that decoding the pruned \
+    message gives the same values for these fields as decoding the original message.
+
+    Args:
+        value: The serialized message bytes.
+        field_numbers: The numbers of the fields to keep.
+
+    Returns:
+        The serialized message holding only the selected fields, or the original bytes if the message could not be \
+        walked (deprecated groups or truncated message), leaving the error to the decoder.
+    """
+    kept = []
+    pruned = False
+    position = 0
+    end = len(value)
+
+    try:
+        while position < end:
+            field_start = position
+
+            byte = value[position]
+            position += 1
+            tag = byte & 0x7F
+            shift = 7
+            while byte & 0x80:
+                byte = value[position]
+                position += 1
+                tag |= (byte & 0x7F) << shift
+                shift += 7
+
+            wire_type = tag & 0x7
+            if wire_type == 0:
+                while value[position] & 0x80:
+                    position += 1
+                position += 1
+            elif wire_type == 2:
+                byte = value[position]
+                position += 1
+                length = byte & 0x7F
+                shift = 7
+                while byte & 0x80:
+                    byte = value[position]
+                    position += 1
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                position += length
+            elif wire_type == 1:
+                position += 8
+            elif wire_type == 5:
+                position += 4
+            else:
+                return value
+
+            if tag >> 3 in field_numbers:
+                kept.append(value[field_start:position])
+            else:
+                pruned = True
+    except IndexError:
+        return value
+
+    if position != end or not pruned:
+        return value
+
+    return b''.join(kept)
@@ -0,0 +1,307 @@
+"""
+SPDX-License-Identifier: MIT
+
+Records the raw responses of the gRPC streams to a capture directory, allowing to replay an extraction later without
+any network access (see `--record` and `--replay`), either straight to the block processors or through a local gRPC
+server (see `mock_server --capture`).
+
+A capture directory holds:
+- `capture.json`: the metadata of the extraction (chain, endpoint, period, stub config and request parameters).
+- `responses.binpb.<gz|zst>`: the responses holding a block, in the order they were received (the workers of the block
+  extractors being interleaved), compressed in independent frames (see `sinks.compression`). Each record is
+  length-delimited (see `sinks.protobuf`) and holds the block number (varint) followed by the serialized response.
+- The Substreams package (`.spkg`) of the stub config, if any.
+
+Blocks may be recorded more than once (e.g. retried ranges or appended recordings), replays only keep the first record
+of each block.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from google.protobuf.message import Message
+
+from substreams_firehose.config.parser import Config, StubConfig, load_stub_config
+from substreams_firehose.sinks.compression import EXTENSIONS, CompressedFile, open_compressed
+from substreams_firehose.sinks.protobuf import encode_varint, read_delimited
+from substreams_firehose.utils import generate_proto_messages_classes, open_file_from_package
+
+# Metadata file of a capture directory
+CAPTURE_FILE = 'capture.json'
+# Responses file of a capture directory (without its compression extension)
+RESPONSES_FILE = 'responses.binpb'
+
+def _decode_varint(data: bytes) -> tuple[int, int]:
+    """
+    Decode a protobuf varint at the start of the data.
+
+    Returns:
+        The decoded value and the number of bytes it spans.
+    """
+    value = shift = position = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+class Recorder: #pylint: disable=too-many-instance-attributes
+    """
+    Write the raw responses of the gRPC streams to a capture directory.
+
+    The records are collected in batches of `batch_size` bytes, compressed and written in a dedicated thread, in order.
+
+    Attributes:
+        directory: The capture directory path.
+        compression: The compression format of the responses file (`gzip` or `zstd`).
+        append: Append the responses to an existing capture (e.g. when resuming an extraction).
+        batch_size: The size (in bytes) of the records written at once to the responses file.
+        responses: The number of responses written to the capture.
+    """
+    def __init__(self, directory: str, compression: str = 'gzip', append: bool = False, batch_size: int = 1 << 20) -> None:
+        self.directory = directory
+        self.compression = compression
+        self.append = append
+        self.batch_size = batch_size
+        self.responses = 0
+
+        self._metadata = {}
+        self._file = None
+        self._executor = None
+        self._batch = []
+        self._batch_bytes = 0
+        self._writing = None
+
+    def open(self, period_start: int, period_end: int, request_parameters: dict | None = None) -> None:
+        """
+        Write the metadata of the extraction and open the responses file.
+
+        The stub config is the one currently loaded (see `StubConfig.SOURCE_CONFIG`), its Substreams package being \
+        copied to the capture directory.
+
+        Args:
+            period_start: The first block number of the extraction period.
+            period_end: The last block number of the extraction period.
+            request_parameters: The additional keyword arguments sent with the gRPC requests.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        stub = json.loads(json.dumps(StubConfig.SOURCE_CONFIG))
+        modules = stub['request']['params'].get('modules')
+        if isinstance(modules, str) and '.spkg' in modules:
+            with open_file_from_package(modules, 'rb') as package_file, \
+                open(os.path.join(self.directory, os.path.basename(modules)), 'wb') as capture_package_file:
+                shutil.copyfileobj(package_file, capture_package_file)
+            stub['request']['params']['modules'] = os.path.basename(modules)
+
+        if self.append and os.path.exists(os.path.join(self.directory, CAPTURE_FILE)):
+            self._metadata = read_capture_metadata(self.directory)
+            self.compression = self._metadata['compression']
+            self.responses = self._metadata['responses']
+
+        self._metadata.update({
+            'chain': Config.CHAIN,
+            'endpoint': Config.GRPC_ENDPOINT,
+            'period_start': period_start,
+            'period_end': period_end,
+            'stub': stub,
+            'request_parameters': request_parameters or {},
+            'compression': self.compression,
+            'response_type': self._metadata.get('response_type'),
+            'responses': self.responses,
+        })
+        self._write_metadata()
+
+        self._file = CompressedFile(
+            os.path.join(self.directory, RESPONSES_FILE + EXTENSIONS[self.compression]),
+            self.compression,
+            append=self.append
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recorder')
+
+        logging.info('Recording gRPC responses to "%s"', self.directory)
+
+    async def write(self, block_number: int, response: Message) -> None:
+        """
+        Write a response holding a block to the capture.
+
+        Full batches are handed to the writer thread, waiting for the previous batch to be written if needed.
+
+        Args:
+            block_number: The block number of the response.
+            response: The response received from the gRPC stream.
+        """
+        if not self._metadata['response_type']:
+            self._metadata['response_type'] = response.DESCRIPTOR.full_name
+
+        data = encode_varint(block_number) + response.SerializeToString()
+        self._batch.append(encode_varint(len(data)) + data)
+        self._batch_bytes += len(self._batch[-1])
+        self.responses += 1
+
+        if self._batch_bytes >= self.batch_size:
+            # Keep a single batch in-flight, the next one being collected meanwhile
+            previous = self._writing
+            self._writing = self._submit_batch()
+            if previous:
+                await asyncio.wrap_future(previous)
+
+    def _submit_batch(self) -> Future:
+        """
+        Hand the current batch to the writer thread.
+
+        Returns:
+            The future of the batch write.
+        """
+        batch = b''.join(self._batch)
+        self._batch = []
+        self._batch_bytes = 0
+        return self._executor.submit(self._file.write, batch)
+
+    def close(self) -> None:
+        """
+        Write the remaining records, flush the responses file and update the metadata with the number of recorded \
+        responses.
+        """
+        if self._file is None:
+            return
+
+        try:
+            # Also propagates any error of the in-flight batch
+            futures = [self._writing] if self._writing else []
+            futures.append(self._submit_batch())
+            futures.append(self._executor.submit(self._file.close))
+            for future in futures:
+                future.result()
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+            self._writing = None
+            self._file = None
+
+        self._metadata['responses'] = self.responses
+        self._write_metadata()
+
+        logging.info('Recorded %i gRPC responses to "%s"', self.responses, self.directory)
+
+    def _write_metadata(self) -> None:
+        with open(os.path.join(self.directory, CAPTURE_FILE), 'w', encoding='utf8') as capture_file:
+            json.dump(self._metadata, capture_file, indent=4)
+
+def get_response_data(response: Message) -> Message:
+    """
+    Get the block held by a recorded response.
+
+    Args:
+        response: A response of the gRPC stream.
+
+    Returns:
+        The block (Firehose and Dfuse) or the block scoped data (Substreams) of the response.
+    """
+    return response.block if 'block' in response.DESCRIPTOR.fields_by_name else response.data
+
+def read_capture_metadata(directory: str) -> dict[str, Any]:
+    """
+    Read the metadata of a capture directory.
+
+    Args:
+        directory: The capture directory path.
+
+    Returns:
+        The metadata of the recorded extraction.
+
+    Raises:
+        FileNotFoundError: If the directory is not a capture directory.
+        JSONDecodeError: If the metadata file cannot be parsed.
+    """
+    with open(os.path.join(directory, CAPTURE_FILE), 'r', encoding='utf8') as capture_file:
+        return json.load(capture_file)
+
+def load_capture(directory: str) -> dict[str, Any]:
+    """
+    Load the main config and stub config of a recorded extraction, replacing the main config file.
+
+    Args:
+        directory: The capture directory path.
+
+    Returns:
+        The metadata of the recorded extraction.
+
+    Raises:
+        FileNotFoundError: If the directory is not a capture directory.
+        JSONDecodeError: If the metadata file cannot be parsed.
+        ImportError: If the recorded stub or request object cannot be imported.
+        KeyError: If a required key is missing from the recorded stub config.
+    """
+    metadata = read_capture_metadata(directory)
+
+    Config.CHAIN = metadata['chain']
+    Config.GRPC_ENDPOINT = metadata['endpoint']
+    Config.PROTO_MESSAGES_CLASSES = generate_proto_messages_classes()
+
+    stub = metadata['stub']
+    modules = stub['request']['params'].get('modules')
+    if isinstance(modules, str) and '.spkg' in modules:
+        stub['request']['params']['modules'] = os.path.join(directory, modules)
+    load_stub_config(stub)
+
+    return metadata
+
+def read_records(directory: str) -> Iterator[tuple[int, bytes]]:
+    """
+    Read the recorded responses of a capture directory, in the order they were received.
+
+    Args:
+        directory: The capture directory path.
+
+    Yields:
+        The block number and serialized response of each record.
+
+    Raises:
+        ValueError: If the responses file is truncated.
+    """
+    compression = read_capture_metadata(directory)['compression']
+    with open_compressed(os.path.join(directory, RESPONSES_FILE + EXTENSIONS[compression]), compression, binary=True) as file:
+        for record in read_delimited(file):
+            block_number, position = _decode_varint(record)
+            yield block_number, record[position:]
+
+def read_capture_blocks(directory: str) -> list[Message]:
+    """
+    Read the packed blocks of a capture directory (e.g. as samples for the benchmarks).
+
+    Args:
+        directory: The capture directory path.
+
+    Returns:
+        The packed blocks (`google.protobuf.any_pb2.Any`) of each recorded block in block number order, the packed map \
+        outputs of the Substreams modules for Substreams captures.
+    """
+    metadata = read_capture_metadata(directory)
+    if not metadata['response_type']:
+        return []
+
+    response_class = Config.PROTO_MESSAGES_CLASSES[metadata['response_type']]
+
+    blocks = {}
+    for block_number, response in read_records(directory):
+        if block_number not in blocks:
+            blocks[block_number] = response
+
+    packed_blocks = []
+    for block_number in sorted(blocks):
+        data = get_response_data(response_class.FromString(blocks[block_number]))
+        if 'outputs' in data.DESCRIPTOR.fields_by_name:
+            packed_blocks.extend(output.map_output for output in data.outputs if output.HasField('map_output'))
+        else:
+            packed_blocks.append(data)
+
+    return packed_blocks
@@ -0,0 +1,239 @@
+"""
+SPDX-License-Identifier: MIT
+
+Persists the extraction progress to a checkpoint file, allowing to resume a failed extraction where it stopped.
+
+The block pool of an extraction is divided into ranges, each identified by its last block (ranges never overlap and
+retries of a failed range keep the same end). For each range, the last block number and cursor of the blocks that have
+been written to the output are saved to the checkpoint file. A range is complete once its stream has ended without
+error and all its blocks have been written (skipped blocks at the end of a range never being received).
+"""
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+
+class Checkpoint: #pylint: disable=too-many-instance-attributes
+    """
+    Track the progress of each range of the block pool and periodically save it to a checkpoint file.
+
+    Block extractors report the blocks in the order they are handed to the consumer (`track`) and the consumer \
+    acknowledges them once they have been written to the output (`acknowledge`). Only acknowledged blocks are saved \
+    so no block can be skipped when resuming, although some blocks may be written twice.
+
+    Attributes:
+        path: The checkpoint file path.
+        period_start: The first block number of the extraction period.
+        period_end: The last block number of the extraction period.
+        ranges: A dictionary mapping the last block number of each range to its progress.
+        save_interval: The minimum time (in seconds) between two saves of the checkpoint file.
+        flush: An optional function called before each save (e.g. to flush the output file).
+        on_acknowledge: An optional function called with the block number of each acknowledged block, in order (e.g. \
+        to track the blocks written to each output shard).
+    """
+    def __init__(self, path: str, period_start: int, period_end: int, save_interval: float = 5., #pylint: disable=too-many-arguments
+                 flush: Callable[[], None] | None = None,
+                 on_acknowledge: Callable[[int], None] | None = None) -> None:
+        self.path = path
+        self.period_start = period_start
+        self.period_end = period_end
+        self.ranges = {}
+        self.save_interval = save_interval
+        self.flush = flush
+        self.on_acknowledge = on_acknowledge
+
+        # Blocks handed to the consumer but not acknowledged yet as (range end, block number, cursor)
+        self._tracked = deque()
+        # Number of tracked blocks of each range not acknowledged yet
+        self._outstanding = {}
+        # Ranges whose stream has ended, complete once their outstanding blocks are acknowledged
+        self._completed = set()
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'Checkpoint':
+        """
+        Load a checkpoint from a previously saved checkpoint file.
+
+        Args:
+            path: The checkpoint file path.
+            kwargs: Additional keyword arguments passed to the `Checkpoint` constructor.
+
+        Returns:
+            The checkpoint with the saved progress of each range.
+
+        Raises:
+            FileNotFoundError: If the checkpoint file doesn't exists.
+            JSONDecodeError: If the checkpoint file cannot be parsed.
+        """
+        with open(path, 'r', encoding='utf8') as checkpoint_file:
+            saved = json.load(checkpoint_file)
+
+        checkpoint = cls(path, saved['period_start'], saved['period_end'], **kwargs)
+        checkpoint.ranges = {int(end): progress for end, progress in saved['ranges'].items()}
+
+        logging.info('Loaded checkpoint from "%s": %i/%i ranges remaining',
+            path,
+            len(checkpoint.pending_ranges()),
+            len(checkpoint.ranges)
+        )
+        return checkpoint
+
+    def load_block_pool(self, ranges: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+        """
+        Get the ranges of the block pool for the extraction.
+
+        If the checkpoint has been loaded from a file, the remaining blocks of the unfinished ranges are returned. \
+        Otherwise, the given ranges are registered as the block pool of a new extraction.
+
+        Args:
+            ranges: The ranges of blocks (`(start, end)` tuples) of a new extraction.
+
+        Returns:
+            The ranges of blocks to extract.
+        """
+        if self.ranges:
+            return self.pending_ranges()
+
+        ranges = list(ranges)
+        for start, end in ranges:
+            self.ranges[end] = {'start': start, 'block': None, 'cursor': ''}
+
+        return ranges
+
+    def pending_ranges(self) -> list[tuple[int, int]]:
+        """
+        Returns:
+            The remaining blocks of the unfinished ranges as `(start, end)` tuples.
+        """
+        return sorted(
+            (progress['start'] if progress['block'] is None else progress['block'] + 1, end)
+            for end, progress in self.ranges.items()
+            if progress['block'] is None or progress['block'] < end
+        )
+
+    def get_cursor(self, start: int, end: int) -> str:
+        """
+        Get the cursor to resume streaming the range ending at `end` from the `start` block.
+
+        Args:
+            start: The first block to stream.
+            end: The last block of the range.
+
+        Returns:
+            The cursor of the last acknowledged block preceding `start` in the range, or an empty string if there is none.
+        """
+        progress = self.ranges.get(end)
+        if progress and progress['block'] is not None and progress['block'] + 1 == start:
+            return progress['cursor']
+
+        return ''
+
+    def split_range(self, end: int, split: int) -> None:
+        """
+        Split the range ending at `end` in two, the first range now ending at `split`.
+
+        Args:
+            end: The last block of the range to split.
+            split: The last block of the first range.
+        """
+        progress = self.ranges.pop(end)
+        self.ranges[split] = progress
+        self.ranges[end] = {'start': split + 1, 'block': None, 'cursor': ''}
+
+        # Blocks tracked before the split now belong to the first range
+        self._tracked = deque(
+            (split if tracked_end == end and block_number <= split else tracked_end, block_number, cursor)
+            for tracked_end, block_number, cursor in self._tracked
+        )
+        self._outstanding.pop(end, None)
+        for tracked_end, _, _ in self._tracked:
+            if tracked_end in (split, end):
+                self._outstanding[tracked_end] = self._outstanding.get(tracked_end, 0) + 1
+
+    def track(self, end: int, block_number: int, cursor: str) -> None:
+        """
+        Register a block handed to the consumer, in the order it will be acknowledged.
+
+        Args:
+            end: The last block of the range the block belongs to.
+            block_number: The block number.
+            cursor: The cursor of the block received from the gRPC stream.
+        """
+        self._tracked.append((end, block_number, cursor))
+        self._outstanding[end] = self._outstanding.get(end, 0) + 1
+
+    def complete(self, end: int) -> None:
+        """
+        Register the end of the stream of a range, the range being complete once all its tracked blocks are \
+        acknowledged.
+
+        Args:
+            end: The last block of the range.
+        """
+        if self._outstanding.get(end):
+            self._completed.add(end)
+        else:
+            self._mark_complete(end)
+
+    def _mark_complete(self, end: int) -> None:
+        self._completed.discard(end)
+        progress = self.ranges.get(end)
+        if progress is not None:
+            progress['block'] = end
+
+    def acknowledge(self, count: int = 1) -> None:
+        """
+        Mark the oldest tracked blocks as written to the output and save the checkpoint file if needed.
+
+        Args:
+            count: The number of blocks to acknowledge.
+        """
+        for _ in range(min(count, len(self._tracked))):
+            end, block_number, cursor = self._tracked.popleft()
+            if self.on_acknowledge:
+                self.on_acknowledge(block_number)
+
+            progress = self.ranges.get(end)
+            if progress is not None and (progress['block'] is None or block_number > progress['block']):
+                progress['block'] = block_number
+                progress['cursor'] = cursor
+
+            self._outstanding[end] -= 1
+            if not self._outstanding[end]:
+                del self._outstanding[end]
+                if end in self._completed:
+                    self._mark_complete(end)
+
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Atomically write the progress of each range to the checkpoint file.
+        """
+        if self.flush:
+            self.flush()
+
+        with open(f'{self.path}.tmp', 'w', encoding='utf8') as checkpoint_file:
+            json.dump({
+                'period_start': self.period_start,
+                'period_end': self.period_end,
+                'ranges': self.ranges,
+            }, checkpoint_file)
+
+        os.replace(f'{self.path}.tmp', self.path)
+        self._last_save = time.monotonic()
+        logging.debug('Saved checkpoint to "%s"', self.path)
+
+    def remove(self) -> None:
+        """
+        Remove the checkpoint file once the extraction is complete.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
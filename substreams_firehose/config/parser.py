@@ -5,15 +5,17 @@ Parses the main config and stub config files for use by the application.
 Refer to the [`README.md`](../../../README.md) and comments within the config files for more details about each parameters.
 """
 
+import copy
 import logging
 from argparse import ArgumentTypeError
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, ClassVar
 
 # https://hjson.github.io/hjson-py/ -- allow comments in JSON files for configuration purposes
 import hjson
 from google.protobuf.json_format import MessageToJson
-from grpc import Compression
+from google.protobuf.message import Message
+from grpc import Compression, StatusCode
 
 from substreams_firehose.utils import generate_proto_messages_classes, open_file_from_package
 
@@ -27,8 +29,41 @@ class StubConfig:
     REQUEST_PARAMETERS: ClassVar[dict]
     SERVICE_METHOD_FUNCTION: ClassVar[Any]
     SERVICE_OBJECT: ClassVar[Any]
+    SOURCE_CONFIG: ClassVar[dict]
     SUBSTREAMS_PACKAGE_OBJECT: ClassVar[Any]
 
+# Actions taken by the block extractors when a stream fails with a given status code
+RETRY_ACTIONS = ('retry', 'refresh_token', 'shrink_concurrency', 'fail')
+
+@dataclass
+class RetryPolicy:
+    """
+    Holds the retry policy for failed block streams.
+
+    Attributes:
+        max_retries: The maximum number of retries for a failed block.
+        budget: The maximum number of retries for the whole extraction (unlimited if `None`).
+        backoff: The delay (in seconds) before the first retry of a failed block, doubled for each subsequent retry.
+        max_backoff: The maximum delay (in seconds) before retrying a failed block.
+        jitter: The fraction of the delay randomly removed from it, to prevent retries from failing in sync.
+        status_actions: The action for each gRPC status code name (one of `RETRY_ACTIONS`), `retry` if not specified.
+    """
+    max_retries: int = 3
+    budget: int | None = None
+    backoff: float = 0.5
+    max_backoff: float = 30.
+    jitter: float = 0.5
+    status_actions: dict[str, str] = field(default_factory=lambda: {
+        'UNAUTHENTICATED': 'refresh_token',
+        'RESOURCE_EXHAUSTED': 'shrink_concurrency',
+        'UNAVAILABLE': 'shrink_concurrency',
+        'INVALID_ARGUMENT': 'fail',
+        'NOT_FOUND': 'fail',
+        'OUT_OF_RANGE': 'fail',
+        'PERMISSION_DENIED': 'fail',
+        'UNIMPLEMENTED': 'fail',
+    })
+
 @dataclass
 class Config:
     """
@@ -39,9 +74,81 @@ class Config:
     CHAIN: ClassVar[str]
     COMPRESSION: ClassVar[Compression]
     GRPC_ENDPOINT: ClassVar[str]
+    INSECURE: ClassVar[bool]
     MAX_BLOCK_SIZE: ClassVar[int]
     MAX_FAILED_BLOCK_RETRIES: ClassVar[int]
     PROTO_MESSAGES_CLASSES: ClassVar[dict[str, type]]
+    RETRY_POLICY: ClassVar[RetryPolicy]
+
+def get_message_class(type_url: str) -> type[Message]:
+    """
+    Get the message class of a packed message (`google.protobuf.any_pb2.Any`) from its type URL.
+
+    The registry of type URLs is built from `Config.PROTO_MESSAGES_CLASSES` on first use (and again if the loaded \
+    `.proto` definitions change), avoiding a descriptor pool lookup for each unpacked message.
+
+    Args:
+        type_url: The type URL of the packed message (e.g. `type.googleapis.com/sf.ethereum.type.v2.Block`).
+
+    Returns:
+        The Python class of the packed message.
+
+    Raises:
+        KeyError: If the message type is not present in the loaded `.proto` definitions.
+    """
+    if get_message_class.source is not Config.PROTO_MESSAGES_CLASSES:
+        get_message_class.source = Config.PROTO_MESSAGES_CLASSES
+        get_message_class.registry = {
+            f'type.googleapis.com/{name}': message_class
+            for name, message_class in Config.PROTO_MESSAGES_CLASSES.items()
+            if isinstance(message_class, type) and issubclass(message_class, Message)
+        }
+
+    try:
+        return get_message_class.registry[type_url]
+    except KeyError:
+        # Type URLs may use another host than `type.googleapis.com`
+        message_class = Config.PROTO_MESSAGES_CLASSES[type_url.rsplit('/', 1)[-1]]
+        get_message_class.registry[type_url] = message_class
+        return message_class
+
+# Message classes by type URL, built from the `Config.PROTO_MESSAGES_CLASSES` mapping saved as source
+get_message_class.registry = {}
+get_message_class.source = None
+
+def load_retry_policy(options: dict, max_retries: int = 3) -> RetryPolicy:
+    """
+    Load the retry policy from the `retry_policy` object of the main config.
+
+    Args:
+        options: The retry policy options, the `status` object overriding the default action for each status code.
+        max_retries: The default maximum number of retries for a failed block.
+
+    Returns:
+        The retry policy.
+
+    Raises:
+        ArgumentTypeError: If a status code or an action is not recognized.
+    """
+    policy = RetryPolicy(
+        max_retries=options.get('max_retries', max_retries),
+        budget=options.get('budget'),
+        backoff=options.get('backoff', 0.5),
+        max_backoff=options.get('max_backoff', 30.),
+        jitter=options.get('jitter', 0.5),
+    )
+
+    for status, action in options.get('status', {}).items():
+        if status.upper() not in StatusCode.__members__:
+            logging.exception('Unrecognized gRPC status code in retry policy: "%s"', status)
+            raise ArgumentTypeError
+        if action not in RETRY_ACTIONS:
+            logging.exception('Unrecognized retry action: "%s" not one of %s', action, RETRY_ACTIONS)
+            raise ArgumentTypeError
+
+        policy.status_actions[status.upper()] = action
+
+    return policy
 
 def load_config(file: str, grpc_entry_id: str | None = None) -> bool:
     """
@@ -79,10 +186,13 @@ def load_config(file: str, grpc_entry_id: str | None = None) -> bool:
             raise ArgumentTypeError from error
 
         default_grpc = options['grpc'][default_grpc_id]
-        default_auth = next(iter([o for o in options['auth'] if o['id'] == default_grpc['auth']]))
-        if not default_auth:
-            logging.exception('Could not find "%s" entry in auth providers array', default_grpc['auth'])
-            raise ArgumentTypeError
+        # Insecure endpoints (e.g. a local mock server) are reached in plaintext without authentication
+        default_auth = {'api_key': '', 'endpoint': ''}
+        if not default_grpc.get('insecure', False):
+            default_auth = next(iter([o for o in options['auth'] if o['id'] == default_grpc['auth']]))
+            if not default_auth:
+                logging.exception('Could not find "%s" entry in auth providers array', default_grpc['auth'])
+                raise ArgumentTypeError
 
         default_stub = default_grpc['stub'] if 'stub' in default_grpc else ''
 
@@ -90,8 +200,10 @@ def load_config(file: str, grpc_entry_id: str | None = None) -> bool:
         Config.AUTH_ENDPOINT 			= default_auth['endpoint']
         Config.CHAIN 					= default_grpc.get('chain', '<UNKNOWN CHAIN>')
         Config.GRPC_ENDPOINT 			= default_grpc['url']
+        Config.INSECURE 				= default_grpc.get('insecure', False)
         Config.MAX_BLOCK_SIZE 			= options.get('max_block_size', 8388608) # 8MB default
         Config.MAX_FAILED_BLOCK_RETRIES = options.get('max_failed_block_retries', 3)
+        Config.RETRY_POLICY 			= load_retry_policy(options.get('retry_policy', {}), Config.MAX_FAILED_BLOCK_RETRIES)
     except KeyError as error:
         logging.exception('Error parsing main config file (%s): %s', file, error)
         raise
@@ -158,6 +270,9 @@ def load_stub_config(stub: str | dict) -> None:
                 logging.exception('Error decoding stub config file (%s): %s', stub, error)
                 raise
 
+    # Keep the stub config as loaded (e.g. for recording it along the responses), the package modules are parsed in place
+    StubConfig.SOURCE_CONFIG = copy.deepcopy(stub_config)
+
     try:
         try:
             StubConfig.REQUEST_OBJECT = Config.PROTO_MESSAGES_CLASSES[f'{stub_config["base"]}.{stub_config["request"]["object"]}']
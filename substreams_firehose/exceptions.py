@@ -14,11 +14,14 @@ class BlockStreamException(Exception):
         start: The block stream's starting block.
         end: The block stream's ending block.
         failed: The block that failed processing.
+        data: The blocks (or parsed data) received before the failure, if they haven't already been handed to the \
+        consumer.
     """
-    def __init__(self, start: int, end: int, failed: int) -> None:
+    def __init__(self, start: int, end: int, failed: int, data: list | None = None) -> None:
         self.start = start
         self.end = end
         self.failed = failed
+        self.data = data or []
 
     def __str__(self) -> str:
         return (f'Block streaming failed for block #{self.failed} in range [{self.start}, {self.end}]'
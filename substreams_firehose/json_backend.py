@@ -0,0 +1,112 @@
+"""
+SPDX-License-Identifier: MIT
+
+Provides the JSON encoder/decoder used for the output data, backed by the standard library or by a faster library.
+
+The backend is selected once on startup (see `set_json_backend`, `--json-backend`): the standard library `json` module is
+used by default, `orjson` being opt-in (`pip install substreams_firehose[orjson]`, `--json-backend orjson`) as it changes
+the output format.
+
+Backends produce the same JSON values but not the same text: the `stdlib` backend keeps the output of previous versions
+(`json.dumps` defaults, with spaces after separators and non-ASCII characters escaped) while the `orjson` backend writes
+compact UTF-8 JSON. For a given backend, the JSON text encoded straight from the messages (see
+`block_processors.projection.get_json_encoder`) is byte-identical to the text of the dictionary route.
+"""
+
+import json
+from collections.abc import Callable
+from json.encoder import encode_basestring, encode_basestring_ascii
+from typing import Any, NamedTuple
+
+class JsonBackend(NamedTuple):
+    """
+    JSON encoder and decoder functions, with the parts of their output format used for encoding JSON text directly.
+
+    Attributes:
+        name: The name of the backend (one of `BACKENDS`).
+        dumps: Encode a JSON-compatible value as text.
+        loads: Decode a JSON text (`str` or `bytes`).
+        item_separator: The separator of the items of arrays and objects.
+        key_separator: The separator of the keys and values of objects.
+        encode_string: Encode a string as a quoted JSON string.
+    """
+    name: str
+    dumps: Callable[[Any], str]
+    loads: Callable[[str | bytes], Any]
+    item_separator: str
+    key_separator: str
+    encode_string: Callable[[str], str]
+
+def _stdlib_backend() -> JsonBackend:
+    """
+    Get the backend of the standard library `json` module, with the default `json.dumps` output format.
+    """
+    return JsonBackend('stdlib', json.dumps, json.loads, ', ', ': ', encode_basestring_ascii)
+
+def _orjson_backend() -> JsonBackend:
+    """
+    Get the backend of the `orjson` library, falling back to the standard library for the values it does not support.
+
+    Raises:
+        ImportError: If the `orjson` library is not installed.
+    """
+    import orjson #pylint: disable=import-outside-toplevel
+
+    orjson_dumps = orjson.dumps #pylint: disable=no-member
+    orjson_loads = orjson.loads #pylint: disable=no-member
+    # Non-string keys are converted to strings like the standard library does
+    options = orjson.OPT_NON_STR_KEYS #pylint: disable=no-member
+
+    def dumps(value: Any) -> str:
+        try:
+            return orjson_dumps(value, option=options).decode('utf8')
+        except TypeError:
+            # Integers over 64 bits, subclasses of dictionaries keys, etc.
+            return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+    def loads(text: str | bytes) -> Any:
+        try:
+            return orjson_loads(text)
+        except orjson.JSONDecodeError: #pylint: disable=no-member
+            # Integers over 64 bits, `NaN` and `Infinity` literals, etc.
+            return json.loads(text)
+
+    return JsonBackend('orjson', dumps, loads, ',', ':', encode_basestring)
+
+# Factory of each JSON backend
+BACKENDS = {
+    'orjson': _orjson_backend,
+    'stdlib': _stdlib_backend,
+}
+
+def set_json_backend(name: str = 'stdlib') -> JsonBackend:
+    """
+    Select the JSON backend used for the output data.
+
+    Args:
+        name: The name of the backend (one of `BACKENDS`).
+
+    Returns:
+        The selected backend.
+
+    Raises:
+        KeyError: If the backend is unknown.
+        ImportError: If the library of the backend is not installed.
+    """
+    get_json_backend.backend = BACKENDS[name]()
+    return get_json_backend.backend
+
+def get_json_backend() -> JsonBackend:
+    """
+    Get the JSON backend used for the output data.
+
+    Returns:
+        The backend selected with `set_json_backend`, the `stdlib` one if none was selected.
+    """
+    if get_json_backend.backend is None:
+        set_json_backend()
+
+    return get_json_backend.backend
+
+# Selected JSON backend
+get_json_backend.backend = None
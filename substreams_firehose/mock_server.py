@@ -0,0 +1,638 @@
+"""
+SPDX-License-Identifier: MIT
+
+Local gRPC server streaming synthetic or recorded blocks, for running and benchmarking the block extractors offline.
+
+```console
+$ python -m substreams_firehose.mock_server --chain ethereum --latency 0.05 --bandwidth 20
+$ python -m substreams_firehose.mock_server recorded/eth.binpb --address localhost:9000 --max-streams 20
+$ python -m substreams_firehose.mock_server --capture captures/eth
+```
+
+The server implements the block streaming services of the bundled protos:
+- `sf.firehose.v2.Stream/Blocks`
+- `sf.substreams.v1.Stream/Blocks` (map outputs of the requested output modules)
+- `dfuse.bstream.v1.BlockStreamV2/Blocks`
+
+Any block number can be requested: block `n` is built from the sample block `n % len(blocks)`, with its block number \
+field set to `n`. The cursor of a block is its number. Recorded blocks are read from streams of length-delimited packed \
+blocks (`google.protobuf.Any`), as written by `--output-format protobuf --custom-processor message_processor`. Without \
+recordings, synthetic blocks are built for the chosen chain type by filling every field of their message type (see \
+`synthetic_block`).
+
+With `--capture`, the raw responses recorded to a capture directory (see `capture.Recorder`, `--record`) are served
+as-is through the service they were recorded from, other services being unimplemented. Only the recorded blocks can be
+requested and the cursors are the recorded ones.
+
+Use a gRPC entry with `"insecure": true` in the main config to reach the server in plaintext without authentication \
+(see the `local_mock` entry of `sample.config.hjson`).
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import time
+from collections.abc import AsyncIterator, Generator, Iterable, Sequence
+from contextlib import contextmanager
+from multiprocessing.connection import Connection
+from typing import Any
+
+import grpc
+from google.protobuf.any_pb2 import Any as AnyMessage #pylint: disable=no-name-in-module
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import Message
+
+from substreams_firehose.block_extractors.common import BLOCK_NUMBER_FIELDS
+from substreams_firehose.capture import get_response_data, read_capture_metadata, read_records
+from substreams_firehose.config.parser import Config, get_message_class
+from substreams_firehose.proto.generated.dfuse.bstream.v1 import bstream_pb2, bstream_pb2_grpc
+from substreams_firehose.proto.generated.sf.firehose.v2 import firehose_pb2, firehose_pb2_grpc
+from substreams_firehose.proto.generated.sf.substreams.v1 import clock_pb2, substreams_pb2, substreams_pb2_grpc
+from substreams_firehose.sinks.protobuf import encode_varint, read_delimited
+from substreams_firehose.utils import generate_proto_messages_classes
+
+# Block message type of each supported chain type
+CHAIN_BLOCKS = {
+    'antelope': 'sf.antelope.type.v1.Block',
+    'aptos': 'aptos.extractor.v1.Block',
+    'arweave': 'sf.arweave.type.v1.Block',
+    'cosmos': 'sf.cosmos.type.v1.Block',
+    'dfuse': 'dfuse.eosio.codec.v1.Block',
+    'ethereum': 'sf.ethereum.type.v2.Block',
+    'near': 'sf.near.type.v1.Block',
+    'solana': 'sf.solana.type.v1.Block',
+}
+
+# Unknown field padding the served blocks up to the minimum block size (highest valid field number)
+PADDING_FIELD_NUMBER = (1 << 29) - 1
+
+def _fill_value(field: FieldDescriptor, seed: int) -> Any: #pylint: disable=too-many-return-statements
+    """
+    Build a deterministic value for a scalar field.
+    """
+    cpp_type = field.cpp_type
+    if cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        values = field.enum_type.values
+        return values[seed % len(values)].number
+    if cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        if field.type == FieldDescriptor.TYPE_BYTES:
+            return seed.to_bytes(32, 'big')
+        return f'{field.name}-{seed}'
+    if cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        return seed % 2 == 1
+    if cpp_type in (FieldDescriptor.CPPTYPE_FLOAT, FieldDescriptor.CPPTYPE_DOUBLE):
+        return seed / 8
+    if cpp_type in (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64):
+        return seed * 1_000_003
+    return seed % (1 << 31)
+
+def _fill(message: Message, seed: int, repeat: int, depth: int) -> None:
+    """
+    Set every field of a message, recursively up to `depth` nested messages.
+    """
+    for field in message.DESCRIPTOR.fields:
+        seed += 1
+        if field.cpp_type != FieldDescriptor.CPPTYPE_MESSAGE:
+            if field.label == FieldDescriptor.LABEL_REPEATED:
+                getattr(message, field.name).extend(_fill_value(field, seed + i) for i in range(repeat))
+            else:
+                setattr(message, field.name, _fill_value(field, seed))
+            continue
+
+        if depth <= 0 or field.message_type.full_name.startswith('google.protobuf.'):
+            continue
+
+        if field.message_type.has_options and field.message_type.GetOptions().map_entry:
+            continue
+
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            for i in range(repeat):
+                _fill(getattr(message, field.name).add(), seed + i, repeat, depth - 1)
+        else:
+            _fill(getattr(message, field.name), seed, repeat, depth - 1)
+
+def synthetic_block(full_name: str, number: int, repeat: int = 3, depth: int = 4) -> AnyMessage:
+    """
+    Build a packed block of the given message type with all its fields set.
+
+    Args:
+        full_name: The full name of the block message type (e.g. one of `CHAIN_BLOCKS`).
+        number: The seed of the field values (e.g. the block number).
+        repeat: The number of elements of each repeated field.
+        depth: The number of nested messages levels filled.
+
+    Returns:
+        The packed block.
+    """
+    block = get_message_class(f'type.googleapis.com/{full_name}')()
+    _fill(block, number, repeat, depth)
+
+    packed = AnyMessage()
+    packed.Pack(block)
+    return packed
+
+def read_recorded_blocks(path: str) -> list[AnyMessage]:
+    """
+    Read the packed blocks of a length-delimited protobuf stream.
+
+    Args:
+        path: The recorded blocks file.
+
+    Returns:
+        The packed blocks.
+    """
+    with open(path, 'rb') as file:
+        return [AnyMessage.FromString(value) for value in read_delimited(file)]
+
+class BlockSource:
+    """
+    Serve sample blocks for any block number, with the block number field of each served block set to its number.
+
+    Each sample block is serialized once with its block number field cleared: a served block is the serialized sample \
+    followed by its number field, protobuf parsers keeping the last value of a field.
+
+    Attributes:
+        blocks: The sample packed blocks.
+        block_size: The minimum size (in bytes) of the served blocks, smaller blocks being padded with an unknown \
+        field (no padding if `None`).
+    """
+    def __init__(self, blocks: Sequence[AnyMessage], block_size: int | None = None) -> None:
+        if not blocks:
+            raise ValueError('A block source needs at least one sample block')
+
+        self.blocks = blocks
+        self.block_size = block_size
+        self._templates = [self._template(block) for block in blocks]
+        # Block source of the map outputs of each message type (see `output`)
+        self._outputs = {}
+
+    def _template(self, block: AnyMessage) -> tuple[str, bytes, int | None]:
+        """
+        Serialize a sample block without its block number field, padded to the minimum block size.
+        """
+        message = get_message_class(block.type_url).FromString(block.value)
+        fields = message.DESCRIPTOR.fields_by_name
+        number_field = next((fields[name] for name in BLOCK_NUMBER_FIELDS if name in fields), None)
+        if number_field and number_field.type not in (
+            FieldDescriptor.TYPE_INT32, FieldDescriptor.TYPE_INT64, FieldDescriptor.TYPE_UINT32, FieldDescriptor.TYPE_UINT64
+        ):
+            number_field = None
+
+        if number_field:
+            message.ClearField(number_field.name)
+
+        value = message.SerializeToString()
+        if self.block_size and len(value) < self.block_size:
+            padding = self.block_size - len(value)
+            value += encode_varint(PADDING_FIELD_NUMBER << 3 | 2) + encode_varint(padding) + bytes(padding)
+
+        return block.type_url, value, number_field.number if number_field else None
+
+    def block(self, number: int) -> AnyMessage:
+        """
+        Get the packed block of a block number.
+
+        Args:
+            number: The block number.
+
+        Returns:
+            The packed block.
+        """
+        type_url, value, field_number = self._templates[number % len(self._templates)]
+        if field_number:
+            value += encode_varint(field_number << 3) + encode_varint(number)
+
+        return AnyMessage(type_url=type_url, value=value)
+
+    def output(self, number: int, full_name: str) -> AnyMessage:
+        """
+        Get the packed map output of a block number for a Substreams output module.
+
+        The sample blocks of the output message type are used if any, synthetic outputs otherwise.
+
+        Args:
+            number: The block number.
+            full_name: The full name of the output message type.
+
+        Returns:
+            The packed map output.
+
+        Raises:
+            KeyError: If the output message type is unknown.
+        """
+        try:
+            source = self._outputs[full_name]
+        except KeyError:
+            type_url = f'type.googleapis.com/{full_name}'
+            samples = [block for block in self.blocks if block.type_url == type_url]
+            source = BlockSource(samples or [synthetic_block(full_name, 0)], self.block_size)
+            self._outputs[full_name] = source
+
+        return source.block(number)
+
+class CaptureSource: #pylint: disable=too-few-public-methods
+    """
+    Serve the raw responses recorded to a capture directory.
+
+    Attributes:
+        directory: The capture directory path.
+        response_type: The full name of the recorded response message type.
+        responses: The first recorded serialized response of each block number.
+        cursors: The block number of each recorded cursor.
+        last_block: The last recorded block number (`-1` if no block was recorded).
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.response_type = read_capture_metadata(directory)['response_type']
+        self.responses = {}
+        self.cursors = {}
+
+        for block_number, data in read_records(directory):
+            if block_number in self.responses:
+                continue
+
+            self.responses[block_number] = data
+            response = Config.PROTO_MESSAGES_CLASSES[self.response_type].FromString(data)
+            cursor = getattr(response, 'cursor', '') or getattr(get_response_data(response), 'cursor', '')
+            if cursor:
+                self.cursors[cursor] = block_number
+
+        self.last_block = max(self.responses, default=-1)
+        logging.info('Loaded %i recorded blocks from "%s"', len(self.responses), directory)
+
+class MockServer: #pylint: disable=too-many-instance-attributes
+    """
+    gRPC server streaming the blocks of a block source through the Firehose, Substreams and Dfuse services.
+
+    Streams are answered in plaintext without checking their authorization. Streams over `max_streams` are rejected \
+    with a `RESOURCE_EXHAUSTED` status, like rate-limited endpoints. `max_connection_streams` limits the concurrent \
+    streams of each HTTP/2 connection instead, further streams waiting on the client side.
+
+    If a `capture` is supplied, its recorded responses are served instead of the blocks of the `source`.
+
+    Attributes:
+        source: The block source.
+        capture: The recorded responses source (replacing the block source if set).
+        latency: The delay (in seconds) before the first response of each stream.
+        bandwidth: The maximum throughput (in bytes per second) of each stream (unbounded if `None`).
+        max_streams: The maximum number of concurrent streams (unbounded if `None`).
+        max_connection_streams: The maximum number of concurrent streams of each connection (unbounded if `None`).
+        port: The port the server is listening on (set by `start`).
+        streams: The number of streams served.
+    """
+    def __init__(self, source: BlockSource | None, latency: float = 0., bandwidth: float | None = None, #pylint: disable=too-many-arguments
+                 max_streams: int | None = None, max_connection_streams: int | None = None,
+                 capture: CaptureSource | None = None) -> None:
+        self.source = source
+        self.capture = capture
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_streams = max_streams
+        self.max_connection_streams = max_connection_streams
+        self.port = None
+        self.streams = 0
+        self._server = None
+
+    async def start(self, address: str = 'localhost:0') -> int:
+        """
+        Start serving.
+
+        Args:
+            address: The address to listen on (a random free port if the port is 0).
+
+        Returns:
+            The port the server is listening on.
+        """
+        options = [('grpc.max_send_message_length', -1)]
+        if self.max_connection_streams:
+            options.append(('grpc.max_concurrent_streams', self.max_connection_streams))
+
+        self._server = grpc.aio.server(options=options, maximum_concurrent_rpcs=self.max_streams)
+        firehose_pb2_grpc.add_StreamServicer_to_server(FirehoseServicer(self), self._server)
+        substreams_pb2_grpc.add_StreamServicer_to_server(SubstreamsServicer(self), self._server)
+        bstream_pb2_grpc.add_BlockStreamV2Servicer_to_server(DfuseServicer(self), self._server)
+
+        self.port = self._server.add_insecure_port(address)
+        await self._server.start()
+
+        logging.info('Mock server listening on port %i', self.port)
+        return self.port
+
+    async def stop(self, grace: float | None = None) -> None:
+        """
+        Stop serving, cancelling the streams in progress after the `grace` period (in seconds).
+        """
+        await self._server.stop(grace)
+
+    async def wait_for_termination(self) -> None:
+        """
+        Wait for the server to be stopped.
+        """
+        await self._server.wait_for_termination()
+
+    def block_numbers(self, request: Message, cursor: str, context: grpc.aio.ServicerContext,
+                      exclusive_stop: bool = False) -> Iterable[int]:
+        """
+        Get the block numbers requested by a stream, resuming after the block of the cursor if set.
+
+        When serving a capture, the cursors are the recorded ones and the block numbers end at the last recorded block.
+
+        Args:
+            request: The stream request.
+            cursor: The cursor of the request.
+            context: The context of the stream.
+            exclusive_stop: Whether the stop block is excluded from the range (Substreams).
+
+        Returns:
+            The block numbers, unbounded if the stop block is not set (live streaming).
+        """
+        start = request.start_block_num
+        if cursor:
+            try:
+                start = (self.capture.cursors[cursor] if self.capture else int(cursor)) + 1
+            except (KeyError, ValueError):
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(f'Invalid cursor "{cursor}"')
+                return []
+
+        stop = request.stop_block_num - (1 if exclusive_stop else 0) if request.stop_block_num else None
+        if self.capture:
+            stop = self.capture.last_block if stop is None else min(stop, self.capture.last_block)
+
+        if stop is None:
+            return itertools.count(start)
+
+        return range(start, stop + 1)
+
+    async def captured_responses(self, response_class: type[Message], request: Message, cursor: str, #pylint: disable=too-many-arguments
+                                 context: grpc.aio.ServicerContext, exclusive_stop: bool = False) -> Iterable[Message]:
+        """
+        Get the recorded responses requested by a stream, skipping the blocks that were not recorded.
+
+        Args:
+            response_class: The response message class of the service.
+            request: The stream request.
+            cursor: The cursor of the request.
+            context: The context of the stream.
+            exclusive_stop: Whether the stop block is excluded from the range (Substreams).
+
+        Returns:
+            The recorded responses, in block number order.
+
+        Raises:
+            grpc.aio.AbortError: If the capture was not recorded from the service (`UNIMPLEMENTED` status).
+        """
+        if response_class.DESCRIPTOR.full_name != self.capture.response_type:
+            await context.abort(grpc.StatusCode.UNIMPLEMENTED, f'Capture "{self.capture.directory}" holds '
+                                f'"{self.capture.response_type}" responses, not "{response_class.DESCRIPTOR.full_name}"')
+
+        return (
+            response_class.FromString(self.capture.responses[number])
+            for number in self.block_numbers(request, cursor, context, exclusive_stop)
+            if number in self.capture.responses
+        )
+
+    async def stream(self, responses: Iterable[Message]) -> AsyncIterator[Message]:
+        """
+        Stream responses, delayed by the latency and throttled to the bandwidth.
+
+        Args:
+            responses: The responses of the stream.
+
+        Yields:
+            The responses, as they are sent.
+        """
+        self.streams += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        start = time.perf_counter()
+        sent = 0
+        for response in responses:
+            yield response
+
+            if self.bandwidth:
+                sent += response.ByteSize()
+                delay = sent / self.bandwidth - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+class FirehoseServicer(firehose_pb2_grpc.StreamServicer): #pylint: disable=too-few-public-methods
+    """
+    Firehose V2 block streaming service of a mock server.
+    """
+    def __init__(self, server: MockServer) -> None:
+        self.server = server
+
+    async def Blocks(self, request, context): #pylint: disable=invalid-name, invalid-overridden-method
+        if self.server.capture:
+            responses = await self.server.captured_responses(firehose_pb2.Response, request, request.cursor, context) #pylint: disable=no-member
+        else:
+            source = self.server.source
+            responses = (
+                firehose_pb2.Response(block=source.block(number), step='STEP_FINAL', cursor=str(number)) #pylint: disable=no-member
+                for number in self.server.block_numbers(request, request.cursor, context)
+            )
+
+        async for response in self.server.stream(responses):
+            yield response
+
+class SubstreamsServicer(substreams_pb2_grpc.StreamServicer): #pylint: disable=too-few-public-methods
+    """
+    Substreams V1 block streaming service of a mock server, streaming the map outputs of the requested modules.
+    """
+    def __init__(self, server: MockServer) -> None:
+        self.server = server
+
+    async def Blocks(self, request, context): #pylint: disable=invalid-name, invalid-overridden-method
+        if self.server.capture:
+            responses = await self.server.captured_responses(
+                substreams_pb2.Response, #pylint: disable=no-member
+                request,
+                request.start_cursor,
+                context,
+                exclusive_stop=True
+            )
+            async for response in self.server.stream(responses):
+                yield response
+            return
+
+        # Output message type of each requested module, from its `proto:<type>` output type
+        module_types = {module.name: module.output.type.split(':', 1)[-1] for module in request.modules.modules}
+        outputs = list(request.output_modules) or [request.output_module]
+        for name in outputs:
+            if name not in module_types:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, f'Unknown output module "{name}"')
+
+            try:
+                get_message_class(f'type.googleapis.com/{module_types[name]}')
+            except KeyError:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, f'Unknown output type "{module_types[name]}"')
+
+        source = self.server.source
+        responses = (
+            substreams_pb2.Response(data=substreams_pb2.BlockScopedData( #pylint: disable=no-member
+                outputs=[
+                    substreams_pb2.ModuleOutput(name=name, map_output=source.output(number, module_types[name])) #pylint: disable=no-member
+                    for name in outputs
+                ],
+                clock=clock_pb2.Clock(id=f'{number:064x}', number=number), #pylint: disable=no-member
+                step='STEP_IRREVERSIBLE',
+                cursor=str(number),
+            ))
+            for number in self.server.block_numbers(request, request.start_cursor, context, exclusive_stop=True)
+        )
+        async for response in self.server.stream(responses):
+            yield response
+
+class DfuseServicer(bstream_pb2_grpc.BlockStreamV2Servicer): #pylint: disable=too-few-public-methods
+    """
+    Dfuse block streaming service of a mock server.
+    """
+    def __init__(self, server: MockServer) -> None:
+        self.server = server
+
+    async def Blocks(self, request, context): #pylint: disable=invalid-name, invalid-overridden-method
+        if self.server.capture:
+            responses = await self.server.captured_responses(
+                bstream_pb2.BlockResponseV2, #pylint: disable=no-member
+                request,
+                request.start_cursor,
+                context
+            )
+        else:
+            source = self.server.source
+            responses = (
+                bstream_pb2.BlockResponseV2(block=source.block(number), step='STEP_IRREVERSIBLE', cursor=str(number)) #pylint: disable=no-member
+                for number in self.server.block_numbers(request, request.start_cursor, context)
+            )
+
+        async for response in self.server.stream(responses):
+            yield response
+
+async def _serve(source: BlockSource | None, address: str, connection: Connection | None = None, **options) -> None:
+    """
+    Run a mock server until it is terminated, sending its port to the `connection` once started.
+    """
+    server = MockServer(source, **options)
+    port = await server.start(address)
+    if connection:
+        connection.send(port)
+
+    await server.wait_for_termination()
+
+def _serve_process(connection: Connection, blocks: list[bytes], block_size: int | None, options: dict) -> None:
+    """
+    Run a mock server in a new process.
+    """
+    Config.PROTO_MESSAGES_CLASSES = generate_proto_messages_classes()
+    source = BlockSource([AnyMessage.FromString(block) for block in blocks], block_size)
+    asyncio.run(_serve(source, 'localhost:0', connection, **options))
+
+@contextmanager
+def mock_server_process(blocks: Sequence[AnyMessage], block_size: int | None = None,
+                        **options) -> Generator[int, None, None]:
+    """
+    Run a mock server in a separate process as a context manager, the server being terminated on exit.
+
+    Serving from another process keeps the server from competing with the extractors for the event loop and the GIL.
+
+    Args:
+        blocks: The sample packed blocks.
+        block_size: The minimum size (in bytes) of the served blocks.
+        options: Additional keyword arguments passed to the `MockServer` (latency, bandwidth, etc.).
+
+    Yields:
+        The port the server is listening on (on `localhost`).
+
+    Raises:
+        RuntimeError: If the server did not start.
+    """
+    # Forking a process using gRPC is not supported
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_serve_process,
+        args=(sender, [block.SerializeToString() for block in blocks], block_size, options),
+        daemon=True
+    )
+    process.start()
+
+    try:
+        if not receiver.poll(60):
+            raise RuntimeError('Mock server did not start')
+
+        yield receiver.recv()
+    finally:
+        process.terminate()
+        process.join()
+
+def main() -> int:
+    """
+    Main function for parsing arguments and running a mock server.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Serve synthetic, recorded or captured blocks through the Firehose, Substreams and Dfuse gRPC services.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument('recorded', nargs='*', type=str,
+                            help='recorded blocks files (length-delimited packed blocks), synthetic blocks if not set')
+    arg_parser.add_argument('--capture', type=str,
+                            help='capture directory of recorded gRPC responses (see --record), served instead of the blocks')
+    arg_parser.add_argument('-a', '--address', type=str, default='localhost:9000',
+                            help='address to listen on')
+    arg_parser.add_argument('-c', '--chain', choices=list(CHAIN_BLOCKS), default='ethereum',
+                            help='chain type of the synthetic blocks')
+    arg_parser.add_argument('-b', '--blocks', type=int, default=100,
+                            help='number of distinct synthetic blocks')
+    arg_parser.add_argument('--repeat', type=int, default=3,
+                            help='number of elements of each repeated field of the synthetic blocks')
+    arg_parser.add_argument('--block-size', type=int, default=None,
+                            help='minimum size (in bytes) of the served blocks, padded if smaller')
+    arg_parser.add_argument('--latency', type=float, default=0.,
+                            help='delay (in seconds) before the first block of each stream')
+    arg_parser.add_argument('--bandwidth', type=float, default=None,
+                            help='maximum throughput (in MB/s) of each stream')
+    arg_parser.add_argument('--max-streams', type=int, default=None,
+                            help='maximum number of concurrent streams, further streams being rejected')
+    arg_parser.add_argument('--max-connection-streams', type=int, default=None,
+                            help='maximum number of concurrent streams of each HTTP/2 connection')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    logging.addLevelName(logging.INFO, '[*]')
+    logging.addLevelName(logging.ERROR, '[ERROR]')
+
+    Config.PROTO_MESSAGES_CLASSES = generate_proto_messages_classes()
+
+    capture = None
+    if args.capture:
+        capture = CaptureSource(args.capture)
+        source = None
+    elif args.recorded:
+        source = BlockSource([block for path in args.recorded for block in read_recorded_blocks(path)], args.block_size)
+    else:
+        source = BlockSource(
+            [synthetic_block(CHAIN_BLOCKS[args.chain], number, args.repeat) for number in range(args.blocks)],
+            args.block_size
+        )
+
+    try:
+        asyncio.run(_serve(
+            source,
+            args.address,
+            capture=capture,
+            latency=args.latency,
+            bandwidth=args.bandwidth and args.bandwidth * 1024 * 1024,
+            max_streams=args.max_streams,
+            max_connection_streams=args.max_connection_streams,
+        ))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+SPDX-License-Identifier: MIT
+
+Holds the base class of the output sinks and the writing stage feeding them with the parsed data.
+
+The writing stage groups the rows yielded by the block processing stage in batches and hands each batch to the sink in a
+dedicated writer thread, off the event loop: the next batch is collected while the previous one is being written. Sinks
+encode a whole batch before writing it to a buffered file at once instead of issuing several small writes for each row.
+"""
+
+import asyncio
+import importlib
+import io
+import os
+from collections.abc import AsyncIterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple
+
+from substreams_firehose.checkpoint import Checkpoint
+from substreams_firehose.sinks.compression import CompressedFile
+
+# Sink class of each output format as (module, class name), imported on demand for optional dependencies
+SINKS = {
+    'jsonl': ('jsonl', 'JsonlSink'),
+    'csv': ('csv', 'CsvSink'),
+    'protobuf': ('protobuf', 'ProtobufSink'),
+    'parquet': ('parquet', 'ParquetSink'),
+}
+
+class BlockEnd(NamedTuple):
+    """
+    Marker inserted after the rows of each written block for sinks tracking the blocks (see `Sink.tracks_blocks`).
+
+    Attributes:
+        number: The block number.
+    """
+    number: int
+
+class Sink:
+    """
+    Write batches of rows to an output file.
+
+    Sinks are used from a single writer thread (see `write_rows`): `open`, `write_batch`, `flush` and `close` are never \
+    called concurrently.
+
+    Attributes:
+        extension: The file extension of the output format.
+        binary: Whether the output file is opened in binary mode.
+        tracks_blocks: Whether the batches also hold a `BlockEnd` marker after the rows of each block.
+        path: The output file path.
+        append: Append to the output file instead of overwriting it (e.g. when resuming an extraction).
+        buffer_size: The size (in bytes) of the output file buffer.
+        compression: The compression format of the output file (see `compression.CompressedFile`), if any.
+    """
+    extension = ''
+    binary = False
+    tracks_blocks = False
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = 1 << 20,
+                 compression: str | None = None) -> None:
+        self.path = path
+        self.append = append
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self._file = None
+
+    def __enter__(self) -> 'Sink':
+        self.open()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """
+        Open the output file.
+
+        Raises:
+            OSError: If the output file cannot be opened.
+        """
+        if self.compression:
+            # Frames are made of whole writes, rows never span two frames
+            self._file = CompressedFile(self.path, self.compression, self.append)
+            if not self.binary:
+                self._file = io.TextIOWrapper(self._file, encoding='utf8', newline='', write_through=True)
+            return
+
+        mode = ('a' if self.append else 'w') + ('b' if self.binary else '')
+        self._file = open(self.path, mode, buffering=self.buffer_size, #pylint: disable=consider-using-with
+                          encoding=None if self.binary else 'utf8', newline=None if self.binary else '')
+
+    def write_batch(self, rows: Sequence[Any]) -> None:
+        """
+        Encode a batch of rows and write them to the output file.
+
+        Args:
+            rows: The parsed data in the format returned by the block processor.
+        """
+        raise NotImplementedError
+
+    def tell(self) -> int:
+        """
+        Get the size (in bytes) of the data written to the output file so far, including the buffered data.
+
+        Returns:
+            The current position in the output file, or its size on disk if the position is not available (e.g. \
+            compressed files, whose size only grows once each frame has been compressed).
+        """
+        try:
+            return self._file.tell()
+        except (AttributeError, OSError):
+            return os.path.getsize(self.path)
+
+    def flush(self) -> None:
+        """
+        Flush the rows written so far to the output file.
+        """
+        if self._file:
+            self._file.flush()
+
+    def close(self) -> None:
+        """
+        Close the output file, flushing the written rows.
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+
+def get_sink(output_format: str) -> type[Sink]:
+    """
+    Get the sink class of an output format.
+
+    Args:
+        output_format: The name of the output format (one of `SINKS`).
+
+    Returns:
+        The sink class.
+
+    Raises:
+        KeyError: If the output format is unknown.
+        ImportError: If the optional dependencies of the sink are not installed.
+    """
+    module, name = SINKS[output_format]
+    return getattr(importlib.import_module(f'substreams_firehose.sinks.{module}'), name)
+
+async def write_rows(data: AsyncIterator[Any], sink: Sink, batch_size: int = 1000,
+                     checkpoint: Checkpoint | None = None) -> int:
+    """
+    Write parsed data to an opened sink in batches as soon as it is yielded by the block processing stage.
+
+    Batches are written in a dedicated thread, in order. Rows consumed from `data` are only guaranteed to be written \
+    once the checkpoint is saved (its `flush` writes the current batch) or once the function returns, even if the \
+    iteration fails.
+
+    Args:
+        data: An asynchronous iterator of parsed data (usually from `process_blocks_stream`).
+        sink: The opened sink.
+        batch_size: The number of rows written at once to the sink.
+        checkpoint: An optional checkpoint flushing the consumed rows to the sink before each save. Also marks the end \
+        of each block in the batches for sinks tracking the blocks.
+
+    Returns:
+        The number of rows written to the sink.
+    """
+    rows = 0
+    batch = []
+    writing = None
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='sink') as executor:
+        def _flush():
+            """
+            Write the current batch and flush the sink, blocking until all the consumed rows have been written.
+            """
+            nonlocal batch
+            futures = [executor.submit(sink.write_batch, batch)] if batch else []
+            futures.append(executor.submit(sink.flush))
+            batch = []
+
+            for future in futures:
+                future.result()
+
+        if checkpoint:
+            checkpoint.flush = _flush
+            if sink.tracks_blocks:
+                # Blocks are acknowledged once all their rows have been consumed
+                checkpoint.on_acknowledge = lambda block_number: batch.append(BlockEnd(block_number))
+
+        try:
+            async for row in data:
+                batch.append(row)
+                rows += 1
+
+                if len(batch) >= batch_size:
+                    # Keep a single batch in-flight, the next one being collected meanwhile
+                    if writing:
+                        await asyncio.wrap_future(writing)
+                    writing = executor.submit(sink.write_batch, batch)
+                    batch = []
+        finally:
+            if checkpoint:
+                # The writer thread is about to be stopped
+                checkpoint.flush = sink.flush
+                checkpoint.on_acknowledge = None
+
+            # Also propagates any error of the in-flight batch
+            futures = [writing] if writing else []
+            if batch:
+                futures.append(executor.submit(sink.write_batch, batch))
+            futures.append(executor.submit(sink.flush))
+
+            for future in futures:
+                await asyncio.wrap_future(future)
+
+    return rows
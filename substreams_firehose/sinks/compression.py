@@ -0,0 +1,392 @@
+"""
+SPDX-License-Identifier: MIT
+
+Compresses the output files as a sequence of independently compressed frames (gzip members or zstd frames).
+
+The written data is split in frames of at least `frame_size` bytes, each frame only ending after a complete write so
+that rows never span two frames. Frames are compressed in parallel on a thread pool (both compressors release the GIL)
+and written in order: the result is a regular gzip/zstd file that any decompressor can read as a whole. Each frame is
+also recorded to a seekable index file next to the output file (`<path>.index`), one JSON object per line:
+
+```json
+{"offset": 0, "size": 1048713, "uncompressed_offset": 0, "uncompressed_size": 4195712}
+```
+
+A frame can then be decompressed on its own (see `read_frame`) for random access into a large output file.
+
+Flushing the file (e.g. when saving a checkpoint) only ends the current frame if it holds at least `min_frame_size`
+bytes. Smaller data is kept aside in a tail file (`<path>.tail`) until its frame is complete, so that frequent flushes
+don't result in many tiny frames. When appending to an existing file, the frames written after the last index entry are
+indexed again from the compressed data, an incomplete last frame is dropped and the data of the tail file is written
+back to the next frame.
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO
+
+# File extension of each compression format
+EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+def get_compressor(compression: str, level: int | None = None) -> Callable[[bytes], bytes]:
+    """
+    Get a function compressing a frame on its own (a complete gzip member or zstd frame).
+
+    Args:
+        compression: The compression format (`gzip` or `zstd`).
+        level: The compression level, the default level of the format if `None`.
+
+    Returns:
+        The compression function, safe to call from several threads.
+
+    Raises:
+        ImportError: If the `zstandard` module is not installed.
+        ValueError: If the compression format is unknown.
+    """
+    if compression == 'gzip':
+        return lambda data: gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+
+    if compression == 'zstd':
+        import zstandard #pylint: disable=import-outside-toplevel
+
+        # Compressor objects are not thread-safe, use one for each thread of the pool
+        local = threading.local()
+        def compress(data: bytes) -> bytes:
+            if not hasattr(local, 'compressor'):
+                local.compressor = zstandard.ZstdCompressor(level=3 if level is None else level, write_content_size=True)
+            return local.compressor.compress(data)
+
+        return compress
+
+    raise ValueError(f'Unknown compression format "{compression}"')
+
+def get_decompressor(compression: str) -> tuple[Callable[[], Any], type[Exception]]:
+    """
+    Get a function creating a streaming decompressor for a single frame.
+
+    Args:
+        compression: The compression format (`gzip` or `zstd`).
+
+    Returns:
+        A function returning a new decompression object, with the `decompress` method and the `eof` and `unused_data` \
+        attributes of `zlib` decompression objects, and the exception raised when decompressing corrupted data.
+
+    Raises:
+        ImportError: If the `zstandard` module is not installed.
+        ValueError: If the compression format is unknown.
+    """
+    if compression == 'gzip':
+        return lambda: zlib.decompressobj(wbits=31), zlib.error
+
+    if compression == 'zstd':
+        import zstandard #pylint: disable=import-outside-toplevel
+        return zstandard.ZstdDecompressor().decompressobj, zstandard.ZstdError
+
+    raise ValueError(f'Unknown compression format "{compression}"')
+
+def scan_frames(file: BinaryIO, compression: str, chunk_size: int = 1 << 20) -> Iterator[tuple[int, int]]:
+    """
+    Read the complete frames of a compressed file from its current position, decompressing them to get their size.
+
+    Args:
+        file: The compressed file, opened in binary mode.
+        compression: The compression format (`gzip` or `zstd`).
+        chunk_size: The number of compressed bytes read at once.
+
+    Yields:
+        The compressed and uncompressed size of each complete frame, in order. An incomplete or corrupted last frame \
+        is not yielded.
+
+    Raises:
+        ImportError: If the `zstandard` module is not installed.
+        ValueError: If the compression format is unknown.
+    """
+    new_decompressor, error = get_decompressor(compression)
+    decompressor = None
+    while chunk := file.read(chunk_size):
+        while chunk:
+            if decompressor is None:
+                decompressor = new_decompressor()
+                size = uncompressed_size = 0
+
+            try:
+                uncompressed_size += len(decompressor.decompress(chunk))
+            except error:
+                return
+            if not decompressor.eof:
+                size += len(chunk)
+                break
+
+            # The next frame starts in the same chunk
+            yield size + len(chunk) - len(decompressor.unused_data), uncompressed_size
+            chunk = decompressor.unused_data
+            decompressor = None
+
+def get_compression(path: str) -> str | None:
+    """
+    Get the compression format of a file from its extension.
+
+    Args:
+        path: The file path.
+
+    Returns:
+        The compression format (see `EXTENSIONS`), `None` if not compressed.
+    """
+    for compression, extension in EXTENSIONS.items():
+        if path.endswith(extension):
+            return compression
+
+    return None
+
+def split_extension(path: str) -> tuple[str, str, str]:
+    """
+    Split a file path into its root, its extension and its compression extension (e.g. `.jsonl` and `.gz`).
+
+    Args:
+        path: The file path.
+
+    Returns:
+        The root, extension and compression extension (empty if not compressed) of the path.
+    """
+    compression = get_compression(path)
+    compression_extension = EXTENSIONS[compression] if compression else ''
+    root, extension = os.path.splitext(path[:len(path) - len(compression_extension)])
+    return root, extension, compression_extension
+
+def read_frame(path: str, frame: dict) -> bytes:
+    """
+    Read and decompress a single frame of a compressed output file.
+
+    Args:
+        path: The compressed output file path.
+        frame: The index entry of the frame (a line of the `<path>.index` file).
+
+    Returns:
+        The uncompressed frame data.
+    """
+    with open(path, 'rb') as compressed:
+        compressed.seek(frame['offset'])
+        data = compressed.read(frame['size'])
+
+    if path.endswith(EXTENSIONS['zstd']):
+        import zstandard #pylint: disable=import-outside-toplevel
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return gzip.decompress(data)
+
+def open_compressed(path: str, compression: str, binary: bool = False) -> io.IOBase:
+    """
+    Open a compressed output file for reading it.
+
+    Args:
+        path: The compressed output file path.
+        compression: The compression format (`gzip` or `zstd`).
+        binary: Read the uncompressed data as bytes instead of text.
+
+    Returns:
+        The file object reading the uncompressed data.
+    """
+    if compression == 'zstd':
+        import zstandard #pylint: disable=import-outside-toplevel
+        if binary:
+            return io.BufferedReader(zstandard.open(path, 'rb'), buffer_size=1 << 20)
+        return zstandard.open(path, 'rt', encoding='utf8', newline='')
+
+    if binary:
+        return gzip.open(path, 'rb')
+    return gzip.open(path, 'rt', encoding='utf8', newline='')
+
+class CompressedFile(io.BufferedIOBase): #pylint: disable=too-many-instance-attributes
+    """
+    Binary file-like object compressing the written data in independent frames on a thread pool.
+
+    Flushing waits for all the frames to be written, so that all the data written so far can be decompressed from the \
+    file and its tail file. The current frame is only ended if it holds at least `min_frame_size` bytes, smaller data \
+    being written to the tail file instead. Closing the file always ends the last frame and removes the tail file.
+
+    Attributes:
+        path: The compressed file path.
+        compression: The compression format (`gzip` or `zstd`).
+        frame_size: The minimum size (in bytes) of the uncompressed data of a frame.
+        min_frame_size: The minimum size (in bytes) of the uncompressed data of a frame ended by a flush.
+        workers: The number of threads compressing the frames.
+    """
+    def __init__(self, path: str, compression: str, append: bool = False, frame_size: int = 4 << 20, #pylint: disable=too-many-arguments
+                 min_frame_size: int = 1 << 20, workers: int | None = None, level: int | None = None) -> None:
+        super().__init__()
+        self.path = path
+        self.compression = compression
+        self.frame_size = frame_size
+        self.min_frame_size = min_frame_size
+        self.workers = workers or min(8, os.cpu_count() or 1)
+
+        self._compress = get_compressor(compression, level)
+        self._buffer = bytearray()
+        # Frames being compressed as (uncompressed size, future of the compressed data)
+        self._frames = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='compress')
+        self._tail_path = f'{path}.tail'
+        self._tail = False
+        self._closing = False
+
+        frames = self._read_frames() if append and os.path.exists(path) else []
+        self._offset = frames[-1]['offset'] + frames[-1]['size'] if frames else 0
+        self._uncompressed_offset = frames[-1]['uncompressed_offset'] + frames[-1]['uncompressed_size'] if frames else 0
+        if append:
+            self._read_tail()
+        elif os.path.exists(self._tail_path):
+            os.remove(self._tail_path)
+
+        self._file = open(path, 'ab' if append else 'wb') #pylint: disable=consider-using-with
+        self._index = open(f'{path}.index', 'w', encoding='utf8') #pylint: disable=consider-using-with
+        self._index.writelines(json.dumps(frame) + '\n' for frame in frames)
+
+    def _read_frames(self) -> list[dict]:
+        """
+        Read the index entries of the frames already written, indexing the frames written after the last index entry \
+        from the compressed data and truncating the file after the last complete frame.
+
+        Returns:
+            The index entries of the complete frames of the file.
+        """
+        size = os.path.getsize(self.path)
+        frames = []
+        if os.path.exists(f'{self.path}.index'):
+            with open(f'{self.path}.index', 'r', encoding='utf8') as index:
+                for line in index:
+                    try:
+                        frame = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Interrupted while writing the index entry
+                        break
+                    if frame['offset'] + frame['size'] > size:
+                        break
+                    frames.append(frame)
+
+        offset = frames[-1]['offset'] + frames[-1]['size'] if frames else 0
+        uncompressed_offset = frames[-1]['uncompressed_offset'] + frames[-1]['uncompressed_size'] if frames else 0
+        indexed = len(frames)
+        with open(self.path, 'rb') as compressed:
+            compressed.seek(offset)
+            for frame_size, uncompressed_size in scan_frames(compressed, self.compression):
+                frames.append({
+                    'offset': offset,
+                    'size': frame_size,
+                    'uncompressed_offset': uncompressed_offset,
+                    'uncompressed_size': uncompressed_size,
+                })
+                offset += frame_size
+                uncompressed_offset += uncompressed_size
+
+        if len(frames) > indexed:
+            logging.info('Indexed %i frames written after the last index entry of "%s"', len(frames) - indexed, self.path)
+
+        if offset < size:
+            logging.warning('Dropping the incomplete last frame of "%s" (%i bytes)', self.path, size - offset)
+            os.truncate(self.path, offset)
+
+        return frames
+
+    def _read_tail(self) -> None:
+        """
+        Buffer the data of the tail file which is not part of a complete frame yet.
+        """
+        if not os.path.exists(self._tail_path):
+            return
+
+        with open(self._tail_path, 'rb') as tail:
+            # The tail data starts at the given uncompressed offset, some of it may have been written in a frame since
+            start = int.from_bytes(tail.read(8), 'big')
+            data = tail.read()
+
+        if start <= self._uncompressed_offset:
+            self._buffer += data[self._uncompressed_offset - start:]
+        else:
+            logging.warning('Ignoring the tail file of "%s" starting after the end of the last frame', self.path)
+        self._tail = True
+
+    def _write_tail(self) -> None:
+        """
+        Atomically write the buffered data to the tail file, or remove the tail file if there is no buffered data.
+        """
+        if self._buffer:
+            with open(f'{self._tail_path}.tmp', 'wb') as tail:
+                tail.write(self._uncompressed_offset.to_bytes(8, 'big'))
+                tail.write(self._buffer)
+            os.replace(f'{self._tail_path}.tmp', self._tail_path)
+            self._tail = True
+        elif self._tail:
+            os.remove(self._tail_path)
+            self._tail = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self.frame_size:
+            self._submit_frame()
+
+        return len(data)
+
+    def _submit_frame(self) -> None:
+        """
+        Start compressing the buffered data as a new frame, writing the frames already compressed.
+        """
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._frames.append((len(data), self._executor.submit(self._compress, data)))
+
+        # Bound the number of frames in memory, waiting for the oldest one if needed
+        while self._frames and (self._frames[0][1].done() or len(self._frames) > 2 * self.workers):
+            self._write_frame(*self._frames.popleft())
+
+    def _write_frame(self, uncompressed_size: int, compressed: Future) -> None:
+        data = compressed.result()
+        self._file.write(data)
+        self._index.write(json.dumps({
+            'offset': self._offset,
+            'size': len(data),
+            'uncompressed_offset': self._uncompressed_offset,
+            'uncompressed_size': uncompressed_size,
+        }) + '\n')
+
+        self._offset += len(data)
+        self._uncompressed_offset += uncompressed_size
+
+    def flush(self) -> None:
+        # Only end the current frame if it is large enough, or once closing the file
+        if self._buffer and (self._closing or len(self._buffer) >= self.min_frame_size):
+            self._submit_frame()
+
+        while self._frames:
+            self._write_frame(*self._frames.popleft())
+
+        self._file.flush()
+        self._index.flush()
+        # Written once the frames holding the previous tail data are on disk
+        self._write_tail()
+
+    def close(self) -> None:
+        if self.closed: #pylint: disable=using-constant-test
+            return
+
+        try:
+            # Flushes the remaining data as the last frame
+            self._closing = True
+            super().close()
+        finally:
+            self._executor.shutdown()
+            self._file.close()
+            self._index.close()
@@ -0,0 +1,60 @@
+"""
+SPDX-License-Identifier: MIT
+
+Writes the parsed data as CSV, one row per line with a header line holding the column names.
+"""
+
+import csv
+import os
+from collections.abc import Sequence
+
+from substreams_firehose.json_backend import get_json_backend
+from substreams_firehose.sinks.common import Sink
+from substreams_firehose.sinks.compression import open_compressed
+
+class CsvSink(Sink):
+    """
+    Write each row (a dictionary) as a CSV line.
+
+    The columns are the keys of the rows of the first batch, in order of appearance: other keys found in the following \
+    batches are ignored and missing keys are left empty. When appending to an existing file, the columns are read \
+    from its header line instead. Nested values (dictionaries and lists) are written as JSON.
+
+    Attributes:
+        fieldnames: The column names, `None` until the first batch is written.
+    """
+    extension = '.csv'
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = 1 << 20,
+                 compression: str | None = None) -> None:
+        super().__init__(path, append, buffer_size, compression)
+        self.fieldnames = None
+        self._writer = None
+
+    def open(self) -> None:
+        if self.append and os.path.isfile(self.path):
+            if self.compression:
+                existing = open_compressed(self.path, self.compression)
+            else:
+                existing = open(self.path, 'r', encoding='utf8', newline='') #pylint: disable=consider-using-with
+
+            with existing:
+                self.fieldnames = next(csv.reader(existing), None)
+
+        super().open()
+
+    def write_batch(self, rows: Sequence[dict]) -> None:
+        if self._writer is None:
+            header = self.fieldnames is None
+            if header:
+                self.fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+
+            self._writer = csv.DictWriter(self._file, self.fieldnames, extrasaction='ignore')
+            if header:
+                self._writer.writeheader()
+
+        dumps = get_json_backend().dumps
+        self._writer.writerows(
+            {key: dumps(value) if isinstance(value, (dict, list)) else value for key, value in row.items()}
+            for row in rows
+        )
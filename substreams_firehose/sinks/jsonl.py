@@ -0,0 +1,33 @@
+"""
+SPDX-License-Identifier: MIT
+
+Writes the parsed data as JSON lines, one row per line (default output format).
+"""
+
+from collections.abc import Sequence
+from typing import Any
+
+from substreams_firehose.json_backend import get_json_backend
+from substreams_firehose.sinks.common import Sink
+
+class JsonlSink(Sink):
+    """
+    Write each row as a JSON object on its own line, encoded by the selected JSON backend (see `json_backend`).
+
+    Attributes:
+        json_output: Convert the rows to JSON, otherwise they are written as-is (e.g. already formatted strings).
+    """
+    extension = '.jsonl'
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = 1 << 20, #pylint: disable=too-many-arguments
+                 compression: str | None = None, json_output: bool = True) -> None:
+        super().__init__(path, append, buffer_size, compression)
+        self.json_output = json_output
+
+    def write_batch(self, rows: Sequence[Any]) -> None:
+        if self.json_output:
+            lines = map(get_json_backend().dumps, rows)
+        else:
+            lines = map(str, rows)
+
+        self._file.write('\n'.join(lines) + '\n')
@@ -0,0 +1,237 @@
+"""
+SPDX-License-Identifier: MIT
+
+Writes the parsed data as an Apache Parquet file, each batch of rows being written as a row group.
+
+Rows are expected to be protobuf messages (see `block_processors.processors.message_processor`): the Arrow schema is
+derived from the descriptor of the first message, restricted to the fields selected by the output filter of the stub
+config (`StubConfig.RESPONSE_PARAMETERS`), and the fields keep their native types (64-bit integers, bytes, nested
+messages as structs, timestamps, etc.). Packed messages (`google.protobuf.Any`) are unpacked first. Rows that are
+dictionaries are also accepted, their schema being inferred from the first batch.
+
+Requires the optional `pyarrow` dependency (`pip install substreams_firehose[parquet]`).
+"""
+
+import logging
+import os
+from collections.abc import Callable, Sequence
+from typing import Any
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+
+from substreams_firehose.config.parser import get_message_class
+from substreams_firehose.json_backend import get_json_backend
+from substreams_firehose.sinks.common import Sink
+
+# Arrow type of each protobuf scalar type
+SCALAR_TYPES = {
+    FieldDescriptor.TYPE_DOUBLE: pa.float64(),
+    FieldDescriptor.TYPE_FLOAT: pa.float32(),
+    FieldDescriptor.TYPE_INT64: pa.int64(),
+    FieldDescriptor.TYPE_SINT64: pa.int64(),
+    FieldDescriptor.TYPE_SFIXED64: pa.int64(),
+    FieldDescriptor.TYPE_UINT64: pa.uint64(),
+    FieldDescriptor.TYPE_FIXED64: pa.uint64(),
+    FieldDescriptor.TYPE_INT32: pa.int32(),
+    FieldDescriptor.TYPE_SINT32: pa.int32(),
+    FieldDescriptor.TYPE_SFIXED32: pa.int32(),
+    FieldDescriptor.TYPE_UINT32: pa.uint32(),
+    FieldDescriptor.TYPE_FIXED32: pa.uint32(),
+    FieldDescriptor.TYPE_BOOL: pa.bool_(),
+    FieldDescriptor.TYPE_STRING: pa.string(),
+    FieldDescriptor.TYPE_BYTES: pa.binary(),
+    FieldDescriptor.TYPE_ENUM: pa.string(),
+}
+
+# Well-known types stored as their wrapped value
+WRAPPER_TYPES = (
+    'google.protobuf.BoolValue',
+    'google.protobuf.BytesValue',
+    'google.protobuf.DoubleValue',
+    'google.protobuf.FloatValue',
+    'google.protobuf.Int32Value',
+    'google.protobuf.Int64Value',
+    'google.protobuf.StringValue',
+    'google.protobuf.UInt32Value',
+    'google.protobuf.UInt64Value',
+)
+
+# Well-known types without a columnar equivalent, stored as their JSON representation
+JSON_TYPES = (
+    'google.protobuf.Any',
+    'google.protobuf.FieldMask',
+    'google.protobuf.ListValue',
+    'google.protobuf.Struct',
+    'google.protobuf.Value',
+)
+
+def _message_json(message: Message) -> str:
+    return get_json_backend().dumps(MessageToDict(message, preserving_proto_field_name=True))
+
+def _compile_value(field: FieldDescriptor, keys_filter: Any, #pylint: disable=too-many-return-statements
+                   parents: tuple[str, ...]) -> tuple[pa.DataType, Callable[[Any], Any]]:
+    """
+    Compile the Arrow type and the conversion function of a single field value (an element for repeated fields).
+    """
+    if field.type == FieldDescriptor.TYPE_ENUM:
+        names = {value.number: value.name for value in field.enum_type.values}
+        return pa.string(), lambda value: names.get(value, str(value))
+
+    if field.type not in (FieldDescriptor.TYPE_MESSAGE, FieldDescriptor.TYPE_GROUP):
+        return SCALAR_TYPES[field.type], None
+
+    full_name = field.message_type.full_name
+    if full_name == 'google.protobuf.Timestamp':
+        return pa.timestamp('ns', tz='UTC'), lambda value: value.seconds * 1_000_000_000 + value.nanos
+
+    if full_name == 'google.protobuf.Duration':
+        return pa.duration('ns'), lambda value: value.seconds * 1_000_000_000 + value.nanos
+
+    if full_name in WRAPPER_TYPES:
+        return _compile_value(field.message_type.fields_by_name['value'], None, parents)[0], lambda value: value.value
+
+    if full_name in JSON_TYPES or full_name in parents:
+        # Recursive messages cannot be represented by a fixed schema
+        return pa.string(), _message_json
+
+    return compile_schema(field.message_type, keys_filter, parents)
+
+def _compile_field(field: FieldDescriptor, keys_filter: Any, #pylint: disable=too-many-return-statements
+                   parents: tuple[str, ...]) -> tuple[pa.DataType, Callable[[Message], Any]]:
+    """
+    Compile the Arrow type of a field and the function reading its value from a message.
+    """
+    name = field.name
+
+    if (field.type == FieldDescriptor.TYPE_MESSAGE and field.message_type.has_options
+            and field.message_type.GetOptions().map_entry):
+        key_type, _ = _compile_value(field.message_type.fields_by_name['key'], None, parents)
+        value_type, convert = _compile_value(field.message_type.fields_by_name['value'], keys_filter, parents)
+        if convert:
+            return pa.map_(key_type, value_type), lambda message: [
+                (key, convert(value)) for key, value in getattr(message, name).items()
+            ]
+        return pa.map_(key_type, value_type), lambda message: list(getattr(message, name).items())
+
+    value_type, convert = _compile_value(field, keys_filter, parents)
+
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        if convert:
+            return pa.list_(value_type), lambda message: [convert(value) for value in getattr(message, name)]
+        return pa.list_(value_type), lambda message: list(getattr(message, name))
+
+    if field.type in (FieldDescriptor.TYPE_MESSAGE, FieldDescriptor.TYPE_GROUP):
+        # Unset sub-messages are null
+        return value_type, lambda message: convert(getattr(message, name)) if message.HasField(name) else None
+
+    if convert:
+        return value_type, lambda message: convert(getattr(message, name))
+    return value_type, lambda message: getattr(message, name)
+
+def compile_schema(descriptor: Descriptor, keys_filter: Any,
+                   parents: tuple[str, ...] = ()) -> tuple[pa.StructType, Callable[[Message], dict]]:
+    """
+    Compile an output filter into an Arrow schema for the given message type.
+
+    Args:
+        descriptor: The descriptor of the message type.
+        keys_filter: A nested dictionary filter (see `utils.filter_keys`). Keeps all the fields if empty or not a \
+        dictionary.
+        parents: The full name of the enclosing message types, for detecting recursive messages.
+
+    Returns:
+        The Arrow struct type of the selected fields (in field number order) and a function converting a message \
+        to a dictionary of native values matching it.
+    """
+    parents = (*parents, descriptor.full_name)
+    selected = keys_filter if isinstance(keys_filter, dict) and keys_filter else None
+
+    fields = []
+    readers = []
+    for field in sorted(descriptor.fields, key=lambda field: field.number):
+        if selected is not None and field.name not in selected:
+            continue
+
+        field_type, reader = _compile_field(field, selected.get(field.name) if selected else None, parents)
+        fields.append(pa.field(field.name, field_type))
+        readers.append((field.name, reader))
+
+    def convert(message: Message) -> dict:
+        return {name: reader(message) for name, reader in readers}
+
+    return pa.struct(fields), convert
+
+class ParquetSink(Sink):
+    """
+    Write the rows as Parquet row groups, one for each batch.
+
+    Compression is handled by Parquet itself, compressing each column chunk (`snappy` by default). Parquet files \
+    cannot be appended to: when appending (e.g. resuming an extraction) to an existing file, rows are \
+    written to a new part file next to it instead (`<name>.1.parquet`, `<name>.2.parquet`, etc.). The file is only \
+    readable once closed (the Parquet footer being written last).
+
+    Attributes:
+        codec: The Parquet compression codec.
+        keys_filter: The output filter selecting the columns from the message rows.
+        schema: The Arrow schema of the file, `None` until the first batch is written.
+    """
+    extension = '.parquet'
+    binary = True
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = 1 << 20, #pylint: disable=too-many-arguments
+                 compression: str | None = None, keys_filter: dict | None = None) -> None:
+        super().__init__(path, append, buffer_size)
+        self.codec = compression or 'snappy'
+        self.keys_filter = keys_filter
+        self.schema = None
+        self._convert = None
+        self._writer = None
+
+    def open(self) -> None:
+        if self.append and os.path.exists(self.path):
+            root, extension = os.path.splitext(self.path)
+            part = 1
+            while os.path.exists(f'{root}.{part}{extension}'):
+                part += 1
+
+            logging.info('Cannot append to Parquet file "%s", writing to "%s" instead', self.path, f'{root}.{part}{extension}')
+            self.path = f'{root}.{part}{extension}'
+
+        self.append = False
+        super().open()
+
+    def _unpack(self, row: Message) -> Message:
+        if row.DESCRIPTOR.full_name == 'google.protobuf.Any':
+            return get_message_class(row.type_url).FromString(row.value)
+        return row
+
+    def write_batch(self, rows: Sequence[Message | dict]) -> None:
+        if not rows:
+            return
+
+        if isinstance(rows[0], Message):
+            messages = [self._unpack(row) for row in rows]
+            if self.schema is None:
+                struct, self._convert = compile_schema(messages[0].DESCRIPTOR, self.keys_filter)
+                self.schema = pa.schema(list(struct))
+            table = pa.Table.from_pylist([self._convert(message) for message in messages], schema=self.schema)
+        else:
+            table = pa.Table.from_pylist(list(rows), schema=self.schema)
+            if self.schema is None:
+                self.schema = table.schema
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._file, self.schema, compression=self.codec)
+
+        self._writer.write_table(table, row_group_size=len(rows))
+
+    def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+        super().close()
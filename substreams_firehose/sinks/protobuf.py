@@ -0,0 +1,100 @@
+"""
+SPDX-License-Identifier: MIT
+
+Writes the parsed data as a stream of length-delimited binary protobuf messages.
+
+Each message is prefixed by its size encoded as a varint (the framing used by `writeDelimitedTo` in the Java and C++
+protobuf libraries), as serialized messages may contain any byte including newlines. Rows that are protobuf messages
+are written as-is while dictionaries are converted to `google.protobuf.Struct` messages.
+"""
+
+from collections.abc import Iterator, Sequence
+from typing import BinaryIO
+
+from google.protobuf.message import Message
+from google.protobuf.struct_pb2 import Struct #pylint: disable=no-name-in-module
+
+from substreams_firehose.sinks.common import Sink
+
+def encode_varint(value: int) -> bytes:
+    """
+    Encode an unsigned integer as a protobuf varint.
+
+    Args:
+        value: A positive integer.
+
+    Returns:
+        The varint bytes.
+    """
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+def read_delimited(file: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    """
+    Read the serialized messages of a stream of length-delimited protobuf messages.
+
+    Args:
+        file: The binary file object, positioned at the start of a message size.
+        chunk_size: The number of bytes read from the file at once.
+
+    Yields:
+        The serialized messages, in order.
+
+    Raises:
+        ValueError: If the stream ends in the middle of a message.
+    """
+    buffer = b''
+    position = 0
+    while True:
+        # Decode the next message size, reading more data if the varint or the message is incomplete
+        size = shift = 0
+        cursor = position
+        while cursor < len(buffer):
+            byte = buffer[cursor]
+            cursor += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        else:
+            cursor = None
+
+        if cursor is not None and cursor + size <= len(buffer):
+            yield buffer[cursor:cursor + size]
+            position = cursor + size
+            continue
+
+        chunk = file.read(max(chunk_size, size))
+        if not chunk:
+            if position < len(buffer):
+                raise ValueError('Truncated length-delimited protobuf stream')
+            return
+
+        buffer = buffer[position:] + chunk
+        position = 0
+
+class ProtobufSink(Sink):
+    """
+    Write each row as a length-delimited serialized protobuf message.
+    """
+    extension = '.binpb'
+    binary = True
+
+    def write_batch(self, rows: Sequence[Message | dict]) -> None:
+        chunks = []
+        for row in rows:
+            if not isinstance(row, Message):
+                message = Struct()
+                message.update(row)
+                row = message
+
+            serialized = row.SerializeToString()
+            chunks.append(encode_varint(len(serialized)))
+            chunks.append(serialized)
+
+        self._file.write(b''.join(chunks))
@@ -0,0 +1,285 @@
+"""
+SPDX-License-Identifier: MIT
+
+Splits the output in rolling shards, each shard being a complete output file on its own.
+
+The writer rolls to a new shard once the current one holds a given number of blocks, rows or bytes (whichever comes
+first). Shards only roll at block boundaries, as reported by the checkpoint when acknowledging the blocks (see
+`common.write_rows`), so that the rows of a block never span two shards. Shard files are named after the output file
+with their index (`<name>.00000.jsonl`, `<name>.00001.jsonl`, etc.).
+
+Each completed shard is recorded to a manifest next to the output file (`<name>.manifest.jsonl`), one JSON object per
+line (wrapped here):
+
+```json
+{"shard": 0, "path": "eth.00000.jsonl", "first_block": 0, "last_block": 999, "ranges": [[0, 999]], "blocks": 1000,
+ "rows": 1000, "bytes": 405640, "sha256": "..."}
+```
+
+`ranges` lists the blocks held by the shard as sorted and disjoint `[first, last]` block ranges, `first_block` and
+`last_block` being their bounds. Without `--ordered`, the blocks of concurrent workers are interleaved: the bounds of
+consecutive shards overlap and each shard holds several ranges, which never overlap across shards. With `--ordered`,
+each shard holds a single contiguous range (split only by the block numbers skipped by the chain) that can be extracted
+again on its own.
+
+Consumers can process the shards listed in the manifest while the extraction continues.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from substreams_firehose.sinks.common import BlockEnd, Sink
+from substreams_firehose.sinks.compression import CompressedFile, split_extension
+
+class ShardedSink(Sink): #pylint: disable=too-many-instance-attributes
+    """
+    Write the rows to rolling shards, each shard being written by its own sink.
+
+    A rolled shard is closed (flushing its file, writing the Parquet footer or the last compressed frames) and hashed \
+    on a thread pool while the rows of the next shard are being written. The rows of a batch are handed to the sink \
+    of the shard at once (unless the shard rolls in the middle of the batch). The size of a shard is measured by its \
+    sink (see `Sink.tell`) from the batches already handed to it, compressed shards only growing once each frame has \
+    been compressed.
+
+    A full shard is only rolled when the rows of the next block arrive. Blocks processed by a batch processor which \
+    doesn't report its row counts (see `block_processors.processors.batch_block_processor`) are acknowledged by \
+    batches, the shards then holding whole batches.
+
+    When appending (e.g. resuming an extraction), the shards are numbered after the ones listed in the manifest. A \
+    shard left unfinished by an interrupted extraction is added to the manifest with the progress saved by the last \
+    `flush` (its file may hold more rows).
+
+    Attributes:
+        sink_class: The sink class writing each shard.
+        max_blocks: The maximum number of blocks of a shard (unbounded if `None`).
+        max_rows: The maximum number of rows of a shard (unbounded if `None`).
+        max_size: The maximum size (in bytes) of a shard (unbounded if `None`).
+        workers: The number of threads closing the rolled shards.
+        sink_options: Additional keyword arguments passed to the sink of each shard.
+        manifest_path: The path of the manifest file.
+        shards: The number of shards recorded to the manifest.
+    """
+    tracks_blocks = True
+
+    def __init__(self, path: str, sink_class: type[Sink], append: bool = False, buffer_size: int = 1 << 20, #pylint: disable=too-many-arguments
+                 max_blocks: int | None = None, max_rows: int | None = None, max_size: int | None = None,
+                 workers: int = 2, **sink_options) -> None:
+        super().__init__(path, append, buffer_size, sink_options.get('compression'))
+        self.sink_class = sink_class
+        self.max_blocks = max_blocks
+        self.max_rows = max_rows
+        self.max_size = max_size
+        self.workers = workers
+        self.sink_options = sink_options
+        self.shards = 0
+
+        root, extension, compression_extension = split_extension(path)
+        self.manifest_path = f'{root}.manifest.jsonl'
+        self._shard_format = f'{root}.{{:05d}}{extension}{compression_extension}'
+
+        self._sink = None
+        # Progress of the current shard (see the manifest format)
+        self._current = None
+        # Block ranges of the current shard by last block, extended as the blocks of each worker are written
+        self._range_ends = {}
+        self._full = False
+        # Shards being closed as futures of their manifest entry, in order
+        self._finishing = deque()
+        self._executor = None
+        self._manifest = None
+
+    def open(self) -> None:
+        index = 0
+        unfinished = None
+        if self.append and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf8') as manifest:
+                for line in manifest:
+                    index = json.loads(line)['shard'] + 1
+
+            if os.path.exists(f'{self.manifest_path}.partial'):
+                with open(f'{self.manifest_path}.partial', 'r', encoding='utf8') as partial:
+                    unfinished = json.load(partial)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='shard')
+        self._manifest = open(self.manifest_path, 'a' if self.append else 'w', encoding='utf8') #pylint: disable=consider-using-with
+
+        if unfinished and unfinished['shard'] == index and os.path.exists(unfinished['path']):
+            logging.info('Adding unfinished shard "%s" to the manifest', unfinished['path'])
+            self._finishing.append(self._executor.submit(self._finish, None, unfinished))
+            self._write_manifest(wait=True)
+            index += 1
+
+        self._open_shard(index)
+
+    def _open_shard(self, index: int) -> None:
+        """
+        Open the sink of a new shard.
+        """
+        path = self._shard_format.format(index)
+        self._sink = self.sink_class(path, buffer_size=self.buffer_size, **self.sink_options)
+        self._sink.open()
+        self._current = {
+            'shard': index,
+            'path': self._sink.path,
+            'first_block': None,
+            'last_block': None,
+            'ranges': [],
+            'blocks': 0,
+            'rows': 0,
+        }
+        self._range_ends = {}
+        self._full = False
+
+    def _finish(self, sink: Sink | None, entry: dict) -> dict:
+        """
+        Close the sink of a shard and complete its manifest entry with the size and checksum of its file.
+        """
+        if sink:
+            sink.close()
+        elif self.compression and os.path.exists(f'{entry["path"]}.index'):
+            # Index the frames of the unfinished compressed shard, writing the data kept aside by its last flush
+            CompressedFile(entry['path'], self.compression, append=True).close()
+
+        checksum = hashlib.sha256()
+        with open(entry['path'], 'rb') as shard:
+            while chunk := shard.read(1 << 20):
+                checksum.update(chunk)
+
+        return {
+            **entry,
+            'ranges': merge_ranges(entry.get('ranges', [])),
+            'path': os.path.relpath(entry['path'], os.path.dirname(os.path.abspath(self.manifest_path))),
+            'bytes': os.path.getsize(entry['path']),
+            'sha256': checksum.hexdigest(),
+        }
+
+    def _write_manifest(self, wait: bool = False) -> None:
+        """
+        Record the closed shards to the manifest, in order.
+
+        Args:
+            wait: Wait for all the shards being closed, otherwise only the ones already closed are recorded.
+        """
+        while self._finishing and (wait or self._finishing[0].done() or len(self._finishing) > 2 * self.workers):
+            future: Future = self._finishing.popleft()
+            self._manifest.write(json.dumps(future.result()) + '\n')
+            self.shards += 1
+
+        self._manifest.flush()
+
+    def _roll(self) -> None:
+        """
+        Hand the current shard to the thread pool for closing it and open the next one.
+        """
+        logging.debug('Rolling shard "%s" (%i blocks, %i rows)',
+            self._current['path'],
+            self._current['blocks'],
+            self._current['rows']
+        )
+        self._finishing.append(self._executor.submit(self._finish, self._sink, self._current))
+        self._write_manifest()
+        self._open_shard(self._current['shard'] + 1)
+
+    def _end_block(self, block_number: int) -> None:
+        """
+        Register a block whose rows have all been written to the current shard, checking if the shard is full.
+        """
+        current = self._current
+        current['first_block'] = block_number if current['first_block'] is None else min(current['first_block'], block_number)
+        current['last_block'] = block_number if current['last_block'] is None else max(current['last_block'], block_number)
+        current['blocks'] += 1
+
+        # Each worker streams its blocks in order, extending its own range
+        block_range = self._range_ends.pop(block_number - 1, None)
+        if block_range:
+            block_range[1] = block_number
+        else:
+            block_range = [block_number, block_number]
+            current['ranges'].append(block_range)
+        self._range_ends[block_number] = block_range
+
+        self._full = bool((self.max_blocks and current['blocks'] >= self.max_blocks)
+            or (self.max_rows and current['rows'] >= self.max_rows)
+            or (self.max_size and self._sink.tell() >= self.max_size))
+
+    def write_batch(self, rows: Sequence[Any]) -> None:
+        # Rows are handed to the shard sink at once (e.g. a single Parquet row group), until the shard rolls
+        segment = []
+        for row in rows:
+            if isinstance(row, BlockEnd):
+                self._end_block(row.number)
+                continue
+
+            if self._full:
+                # All the blocks of the full shard have been acknowledged, the row belongs to the next block
+                if segment:
+                    self._sink.write_batch(segment)
+                    segment = []
+                self._roll()
+
+            segment.append(row)
+            self._current['rows'] += 1
+
+        if segment:
+            self._sink.write_batch(segment)
+
+    def flush(self) -> None:
+        if self._sink is None:
+            return
+
+        self._write_manifest(wait=True)
+        self._sink.flush()
+
+        # Progress of the current shard for adding it to the manifest if the extraction is interrupted
+        with open(f'{self.manifest_path}.partial.tmp', 'w', encoding='utf8') as partial:
+            json.dump(self._current, partial)
+        os.replace(f'{self.manifest_path}.partial.tmp', f'{self.manifest_path}.partial')
+
+    def close(self) -> None:
+        if self._sink is None:
+            return
+
+        try:
+            if self._current['rows']:
+                self._finishing.append(self._executor.submit(self._finish, self._sink, self._current))
+            else:
+                self._sink.close()
+                os.remove(self._current['path'])
+
+            self._write_manifest(wait=True)
+        finally:
+            self._sink = None
+            self._executor.shutdown()
+            self._manifest.close()
+
+        try:
+            os.remove(f'{self.manifest_path}.partial')
+        except FileNotFoundError:
+            pass
+
+        logging.info('Wrote %i shards, listed in manifest "%s"', self.shards, self.manifest_path)
+
+def merge_ranges(ranges: list[list[int]]) -> list[list[int]]:
+    """
+    Sort and merge the contiguous or overlapping block ranges of a shard.
+
+    Args:
+        ranges: The `[first, last]` block ranges.
+
+    Returns:
+        The sorted and disjoint block ranges.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+
+    return merged
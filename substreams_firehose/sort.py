@@ -0,0 +1,544 @@
+"""
+SPDX-License-Identifier: MIT
+
+External merge sort of the output files by a key path, for outputs larger than the available memory.
+
+Extracted blocks are written in the order they are received (see `--ordered` otherwise). This tool sorts an existing
+output file by a key of its rows such as `number` or `block_num`:
+
+```console
+$ python -m substreams_firehose.sort jsonl/eth.jsonl --key number
+```
+
+The rows are read in chunks of about `--memory` MB, each chunk being sorted and written to a temporary run file (on
+several processes with `--parallel`). The sorted runs are then merged with a k-way heap merge, in several passes if there
+are more than `--fan-in` runs, into the sorted output file. The sort is stable: rows with the same key keep the order of
+the input file.
+
+All the output formats are supported (`jsonl`, `csv`, `protobuf` and `parquet`), including compressed files (`.gz` and
+`.zst`). Rows are written back as they were read (e.g. JSON lines are not re-encoded).
+"""
+
+import argparse
+import csv
+import heapq
+import io
+import json
+import logging
+import os
+import pickle
+import tempfile
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from typing import Any, BinaryIO, TextIO
+
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.struct_pb2 import Struct #pylint: disable=no-name-in-module
+
+from substreams_firehose.json_backend import get_json_backend
+from substreams_firehose.sinks.compression import CompressedFile, get_compression, open_compressed, split_extension
+from substreams_firehose.sinks.protobuf import encode_varint, read_delimited
+
+# Number of rows pickled at once in the run files
+RUN_BATCH_SIZE = 1024
+
+# Estimated memory used by each row on top of its encoded size (Python objects, sort key)
+ROW_OVERHEAD = 200
+
+def get_path(row: Any, key_path: Iterable[str]) -> Any:
+    """
+    Get the value of a row at a key path.
+
+    Args:
+        row: A row as a JSON-like value (nested dictionaries and lists).
+        key_path: The keys (or list indices) of the nested value.
+
+    Returns:
+        The value, `None` if missing.
+    """
+    for key in key_path:
+        try:
+            row = row[int(key)] if isinstance(row, list) else row[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None
+
+    return row
+
+def sort_key(value: Any) -> tuple:
+    """
+    Convert a key value to a comparable sort key.
+
+    Numbers (including numbers encoded as strings, e.g. 64-bit integers in JSON) are sorted numerically and before the \
+    other values, then strings. Missing values are sorted as 0, as the JSON encoding of protobuf messages omits the \
+    fields set to their default value (e.g. the block number 0).
+
+    Args:
+        value: The key value of a row.
+
+    Returns:
+        The sort key.
+    """
+    if isinstance(value, (int, float)):
+        return (0, value)
+
+    if isinstance(value, str):
+        try:
+            return (0, int(value))
+        except ValueError:
+            pass
+
+        try:
+            return (0, float(value))
+        except ValueError:
+            return (1, value)
+
+    if value is None:
+        return (0, 0)
+
+    return (1, json.dumps(value, sort_keys=True))
+
+class RowFormat:
+    """
+    Read, key and write the rows of an output format.
+
+    Instances are sent to the processes generating the runs and must be picklable.
+
+    Attributes:
+        binary: Whether the file is read and written in binary mode.
+        key_path: The key path of the sort key.
+    """
+    binary = True
+
+    def __init__(self, key_path: tuple[str, ...]) -> None:
+        self.key_path = key_path
+
+    def open(self, path: str, write: bool = False) -> BinaryIO | TextIO:
+        """
+        Open a file of the format, compressed if its extension is `.gz` or `.zst`.
+
+        Args:
+            path: The file path.
+            write: Open the file for writing (overwriting it) instead of reading.
+
+        Returns:
+            The file object.
+        """
+        compression = get_compression(path)
+        if write:
+            file = CompressedFile(path, compression) if compression else open(path, 'wb', buffering=1 << 20) #pylint: disable=consider-using-with
+            return file if self.binary else io.TextIOWrapper(file, encoding='utf8', newline='', write_through=True)
+
+        if compression:
+            return open_compressed(path, compression, self.binary)
+
+        if self.binary:
+            return open(path, 'rb', buffering=1 << 20) #pylint: disable=consider-using-with
+        return open(path, 'r', encoding='utf8', newline='') #pylint: disable=consider-using-with
+
+    def read(self, path: str) -> Iterator[Any]:
+        """
+        Read the rows of a file.
+
+        Args:
+            path: The file path.
+
+        Yields:
+            The rows, as encoded in the file when possible.
+        """
+        raise NotImplementedError
+
+    def size(self, row: Any) -> int:
+        """
+        Get the estimated size of a row in memory.
+
+        Args:
+            row: A row returned by `read`.
+
+        Returns:
+            The estimated size (in bytes).
+        """
+        return len(row) + ROW_OVERHEAD
+
+    def key(self, row: Any) -> tuple:
+        """
+        Get the sort key of a row.
+
+        Args:
+            row: A row returned by `read`.
+
+        Returns:
+            The sort key (see `sort_key`).
+        """
+        raise NotImplementedError
+
+    def write(self, path: str, rows: Iterable[Any]) -> int:
+        """
+        Write rows to a file, overwriting it.
+
+        Args:
+            path: The file path.
+            rows: The rows returned by `read`.
+
+        Returns:
+            The number of rows written.
+        """
+        raise NotImplementedError
+
+class JsonlFormat(RowFormat):
+    """
+    JSON lines, each line being kept as-is.
+    """
+    def read(self, path: str) -> Iterator[bytes]:
+        with self.open(path) as file:
+            for line in file:
+                if line.strip():
+                    yield line if line.endswith(b'\n') else line + b'\n'
+
+    def key(self, row: bytes) -> tuple:
+        return sort_key(get_path(get_json_backend().loads(row), self.key_path))
+
+    def write(self, path: str, rows: Iterable[bytes]) -> int:
+        count = 0
+        with self.open(path, write=True) as file:
+            while batch := list(islice(rows, RUN_BATCH_SIZE)):
+                file.write(b''.join(batch))
+                count += len(batch)
+
+        return count
+
+class CsvFormat(RowFormat):
+    """
+    CSV with a header line, nested values being stored as JSON (see `sinks.csv.CsvSink`).
+
+    Attributes:
+        header: The column names, `None` until the file is read.
+    """
+    binary = False
+
+    def __init__(self, key_path: tuple[str, ...]) -> None:
+        super().__init__(key_path)
+        self.header = None
+        self._column = None
+
+    def read(self, path: str) -> Iterator[list[str]]:
+        with self.open(path) as file:
+            reader = csv.reader(file)
+            self.header = next(reader, [])
+            if self.key_path[0] not in self.header:
+                raise KeyError(f'Column "{self.key_path[0]}" not found in the CSV header')
+
+            self._column = self.header.index(self.key_path[0])
+            yield from reader
+
+    def size(self, row: list[str]) -> int:
+        return sum(map(len, row)) + ROW_OVERHEAD
+
+    def key(self, row: list[str]) -> tuple:
+        value = row[self._column] if self._column < len(row) else None
+        if value and len(self.key_path) > 1:
+            try:
+                value = get_path(get_json_backend().loads(value), self.key_path[1:])
+            except json.JSONDecodeError:
+                value = None
+
+        return sort_key(value)
+
+    def write(self, path: str, rows: Iterable[list[str]]) -> int:
+        count = 0
+        with self.open(path, write=True) as file:
+            writer = csv.writer(file)
+            writer.writerow(self.header)
+            while batch := list(islice(rows, RUN_BATCH_SIZE)):
+                writer.writerows(batch)
+                count += len(batch)
+
+        return count
+
+class ProtobufFormat(RowFormat):
+    """
+    Length-delimited `google.protobuf.Struct` messages (see `sinks.protobuf.ProtobufSink`), each message being kept \
+    serialized.
+    """
+    def read(self, path: str) -> Iterator[bytes]:
+        with self.open(path) as file:
+            yield from read_delimited(file)
+
+    def key(self, row: bytes) -> tuple:
+        return sort_key(get_path(MessageToDict(Struct.FromString(row)), self.key_path))
+
+    def write(self, path: str, rows: Iterable[bytes]) -> int:
+        count = 0
+        with self.open(path, write=True) as file:
+            while batch := list(islice(rows, RUN_BATCH_SIZE)):
+                file.write(b''.join(encode_varint(len(row)) + row for row in batch))
+                count += len(batch)
+
+        return count
+
+class ParquetFormat(RowFormat):
+    """
+    Parquet file read by record batches, the rows being written back with the schema of the input file.
+
+    Requires the optional `pyarrow` dependency.
+
+    Attributes:
+        schema: The Arrow schema of the file, `None` until the file is read.
+    """
+    def __init__(self, key_path: tuple[str, ...]) -> None:
+        super().__init__(key_path)
+        self.schema = None
+        self._row_size = ROW_OVERHEAD
+
+    def read(self, path: str) -> Iterator[dict]:
+        import pyarrow.parquet as pq #pylint: disable=import-outside-toplevel
+
+        parquet_file = pq.ParquetFile(path)
+        self.schema = parquet_file.schema_arrow
+        for batch in parquet_file.iter_batches(batch_size=RUN_BATCH_SIZE):
+            if batch.num_rows:
+                self._row_size = batch.nbytes // batch.num_rows + ROW_OVERHEAD
+            yield from batch.to_pylist()
+
+    def size(self, row: dict) -> int:
+        return self._row_size
+
+    def key(self, row: dict) -> tuple:
+        return sort_key(get_path(row, self.key_path))
+
+    def write(self, path: str, rows: Iterable[dict]) -> int:
+        import pyarrow as pa #pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq #pylint: disable=import-outside-toplevel
+
+        count = 0
+        with pq.ParquetWriter(path, self.schema) as writer:
+            while batch := list(islice(rows, 64 * RUN_BATCH_SIZE)):
+                writer.write_table(pa.Table.from_pylist(batch, schema=self.schema))
+                count += len(batch)
+
+        return count
+
+# Row format of each output format
+FORMATS = {
+    'jsonl': JsonlFormat,
+    'csv': CsvFormat,
+    'protobuf': ProtobufFormat,
+    'parquet': ParquetFormat,
+}
+
+# Output format of each file extension
+FORMAT_EXTENSIONS = {
+    '.jsonl': 'jsonl',
+    '.json': 'jsonl',
+    '.csv': 'csv',
+    '.binpb': 'protobuf',
+    '.parquet': 'parquet',
+}
+
+def write_run(rows: list, row_format: RowFormat, path: str) -> str:
+    """
+    Sort a chunk of rows and write them to a run file, as pickled batches of `(sort key, row)` tuples.
+
+    Args:
+        rows: The rows of the chunk.
+        row_format: The row format of the rows.
+        path: The run file path.
+
+    Returns:
+        The run file path.
+    """
+    keyed = sorted(((row_format.key(row), row) for row in rows), key=itemgetter(0))
+    with open(path, 'wb') as run:
+        for i in range(0, len(keyed), RUN_BATCH_SIZE):
+            pickle.dump(keyed[i:i + RUN_BATCH_SIZE], run, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return path
+
+def read_run(path: str) -> Iterator[tuple[tuple, Any]]:
+    """
+    Read the `(sort key, row)` tuples of a run file, in order.
+
+    Args:
+        path: The run file path.
+
+    Yields:
+        The `(sort key, row)` tuples.
+    """
+    with open(path, 'rb', buffering=1 << 20) as run:
+        while True:
+            try:
+                yield from pickle.load(run)
+            except EOFError:
+                return
+
+def merge_runs(paths: list[str], temp_dir: str, fan_in: int = 64) -> Iterator[tuple[tuple, Any]]:
+    """
+    Merge sorted run files with a k-way heap merge.
+
+    If there are more than `fan_in` runs, groups of `fan_in` runs are first merged into intermediate runs (removing \
+    the merged ones), limiting the number of files opened at once.
+
+    Args:
+        paths: The run file paths, in input order (for a stable merge).
+        temp_dir: The directory of the intermediate runs.
+        fan_in: The maximum number of runs merged at once.
+
+    Returns:
+        An iterator of the merged `(sort key, row)` tuples.
+    """
+    merge_pass = 0
+    while len(paths) > fan_in:
+        merge_pass += 1
+        logging.info('Merge pass %i: merging %i runs by groups of %i...', merge_pass, len(paths), fan_in)
+
+        merged = []
+        for i in range(0, len(paths), fan_in):
+            group = paths[i:i + fan_in]
+            path = os.path.join(temp_dir, f'merge-{merge_pass}-{i // fan_in}.run')
+            with open(path, 'wb') as run:
+                rows = heapq.merge(*map(read_run, group), key=itemgetter(0))
+                while batch := list(islice(rows, RUN_BATCH_SIZE)):
+                    pickle.dump(batch, run, protocol=pickle.HIGHEST_PROTOCOL)
+
+            for run_path in group:
+                os.remove(run_path)
+            merged.append(path)
+
+        paths = merged
+
+    return heapq.merge(*map(read_run, paths), key=itemgetter(0))
+
+def sort_file(input_path: str, output_path: str, key_path: str, output_format: str | None = None, #pylint: disable=too-many-arguments, too-many-locals
+              memory: int = 512 << 20, temp_dir: str | None = None, parallel: int = 1, fan_in: int = 64) -> int:
+    """
+    Sort an output file by a key path using an external merge sort.
+
+    Args:
+        input_path: The file to sort.
+        output_path: The sorted file path (must be different from `input_path`).
+        key_path: The dot-separated path of the sort key in the rows (e.g. `number` or `header.number`).
+        output_format: The output format of the file (one of `FORMATS`), guessed from its extension if `None`.
+        memory: The approximate memory budget (in bytes) of the sorted runs held in memory.
+        temp_dir: The directory of the temporary run files, the system default if `None`.
+        parallel: The number of processes sorting the runs.
+        fan_in: The maximum number of runs merged at once.
+
+    Returns:
+        The number of rows written.
+
+    Raises:
+        KeyError: If the output format is unknown (or the key column is missing from a CSV file).
+        ImportError: If the optional dependencies of the output format are not installed.
+    """
+    if output_format is None:
+        output_format = FORMAT_EXTENSIONS[split_extension(input_path)[1]]
+
+    row_format = FORMATS[output_format](tuple(key_path.split('.')))
+    # Chunks being sorted by the workers are held in memory as well as the chunk being read
+    chunk_memory = max(1, memory // (parallel + 1 if parallel > 1 else 1))
+
+    with tempfile.TemporaryDirectory(prefix='substreams_firehose-sort-', dir=temp_dir) as run_dir:
+        executor = ProcessPoolExecutor(max_workers=parallel) if parallel > 1 else None
+        paths = []
+        futures = []
+        try:
+            def _submit(chunk):
+                path = os.path.join(run_dir, f'{len(paths) + len(futures)}.run')
+                if executor is None:
+                    paths.append(write_run(chunk, row_format, path))
+                    return
+
+                # Bound the number of chunks in memory, keeping the runs in input order
+                while len(futures) >= parallel:
+                    paths.append(futures.pop(0).result())
+                futures.append(executor.submit(write_run, chunk, row_format, path))
+
+            chunk = []
+            chunk_size = 0
+            for row in row_format.read(input_path):
+                chunk.append(row)
+                chunk_size += row_format.size(row)
+                if chunk_size >= chunk_memory:
+                    _submit(chunk)
+                    chunk = []
+                    chunk_size = 0
+
+            if chunk or not (paths or futures):
+                _submit(chunk)
+
+            paths.extend(future.result() for future in futures)
+            futures.clear()
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        logging.info('Sorted %i runs, merging them into "%s"...', len(paths), output_path)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        return row_format.write(output_path, map(itemgetter(1), merge_runs(paths, run_dir, fan_in)))
+
+def main() -> int:
+    """
+    Main function for parsing arguments and sorting the output file.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Sort an output file larger than memory by a key of its rows (external merge sort).',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument('input', type=str,
+                            help='output file to sort (.jsonl, .csv, .binpb or .parquet, optionally compressed with .gz or .zst)')
+    arg_parser.add_argument('-o', '--output', type=str, default='{root}.sorted{extension}',
+                            help='sorted file path')
+    arg_parser.add_argument('-k', '--key', type=str, default='number',
+                            help='dot-separated path of the sort key in the rows (e.g. "number", "block_num" or "header.number")')
+    arg_parser.add_argument('-f', '--format', choices=list(FORMATS), default=None,
+                            help='format of the file, guessed from its extension by default')
+    arg_parser.add_argument('-m', '--memory', type=int, default=512,
+                            help='approximate memory (in MB) used for sorting the runs')
+    arg_parser.add_argument('-T', '--temp-dir', type=str, default=None,
+                            help='directory of the temporary run files (system default if not set)')
+    arg_parser.add_argument('-j', '--parallel', type=int, default=1,
+                            help='number of processes sorting the runs')
+    arg_parser.add_argument('--fan-in', type=int, default=64,
+                            help='maximum number of runs merged at once')
+    arg_parser.add_argument('-q', '--quiet', action='store_true',
+                            help='disable console logging (except errors)')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.ERROR if args.quiet else logging.INFO,
+        format='%(asctime)s:T+%(relativeCreated)d %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+    logging.addLevelName(logging.INFO, '[*]')
+    logging.addLevelName(logging.ERROR, '[ERROR]')
+    logging.addLevelName(logging.CRITICAL, '[CRITICAL]')
+
+    if args.memory < 1 or args.parallel < 1 or args.fan_in < 2:
+        logging.critical('Memory and parallel processes must be strictly positive, fan-in at least 2')
+        return 1
+
+    output = args.output
+    if output == '{root}.sorted{extension}':
+        root, extension, compression_extension = split_extension(args.input)
+        output = f'{root}.sorted{extension}{compression_extension}'
+
+    if os.path.abspath(output) == os.path.abspath(args.input):
+        logging.critical('Output file must be different from the input file')
+        return 1
+
+    try:
+        rows = sort_file(args.input, output, args.key, args.format, args.memory << 20, args.temp_dir, args.parallel,
+                         args.fan_in)
+    except KeyError as error:
+        logging.critical('Could not sort "%s": unknown format or key %s', args.input, error)
+        return 1
+    except ImportError as error:
+        logging.critical('Could not load the output format: %s', error)
+        return 1
+
+    logging.info('Wrote %i sorted rows to %s [SUCCESS]', rows, output)
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+SPDX-License-Identifier: MIT
+
+Fixtures running the block extractors against a local mock server (see `mock_server`).
+"""
+
+#pylint: disable=redefined-outer-name
+
+from collections.abc import Generator
+
+import grpc
+import pytest
+
+from substreams_firehose.config.parser import Config, RetryPolicy, load_stub_config
+from substreams_firehose.mock_server import CHAIN_BLOCKS, mock_server_process, synthetic_block
+from substreams_firehose.utils import generate_proto_messages_classes
+
+# Number of sample blocks served by the mock servers
+SAMPLE_BLOCKS = 10
+
+@pytest.fixture(scope='session')
+def sample_blocks() -> list:
+    """
+    Synthetic Ethereum blocks served by the mock servers.
+    """
+    Config.PROTO_MESSAGES_CLASSES = generate_proto_messages_classes()
+    return [synthetic_block(CHAIN_BLOCKS['ethereum'], number, repeat=1, depth=2) for number in range(SAMPLE_BLOCKS)]
+
+@pytest.fixture(scope='session')
+def mock_server(sample_blocks) -> Generator[int, None, None]:
+    """
+    Port of a mock server without any limit.
+    """
+    with mock_server_process(sample_blocks) as port:
+        yield port
+
+@pytest.fixture
+def mock_config(mock_server) -> None:
+    """
+    Main config and Firehose stub config of an extraction from the mock server, with short retry delays.
+    """
+    Config.CHAIN = 'LOCAL'
+    Config.GRPC_ENDPOINT = f'localhost:{mock_server}'
+    Config.INSECURE = True
+    Config.COMPRESSION = grpc.Compression.NoCompression
+    Config.MAX_BLOCK_SIZE = 1 << 30
+    Config.MAX_FAILED_BLOCK_RETRIES = 3
+    Config.RETRY_POLICY = RetryPolicy(max_retries=20, backoff=0.01, max_backoff=0.1)
+    load_stub_config('substreams_firehose/config/firehose/default.hjson')
@@ -0,0 +1,106 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring
+
+import json
+
+from substreams_firehose.checkpoint import Checkpoint
+
+def make_checkpoint(tmp_path, **kwargs) -> Checkpoint:
+    return Checkpoint(str(tmp_path / 'checkpoint.json'), 0, 99, save_interval=3600., **kwargs)
+
+def test_load_block_pool_registers_new_ranges(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+
+    assert checkpoint.load_block_pool([(0, 49), (50, 99)]) == [(0, 49), (50, 99)]
+    assert checkpoint.pending_ranges() == [(0, 49), (50, 99)]
+
+def test_acknowledge_saves_only_acknowledged_blocks(tmp_path):
+    acknowledged = []
+    checkpoint = make_checkpoint(tmp_path, on_acknowledge=acknowledged.append)
+    checkpoint.load_block_pool([(0, 49), (50, 99)])
+
+    checkpoint.track(49, 10, 'c10')
+    checkpoint.track(99, 60, 'c60')
+    checkpoint.track(49, 11, 'c11')
+    checkpoint.acknowledge(2)
+
+    assert acknowledged == [10, 60]
+    assert checkpoint.pending_ranges() == [(11, 49), (61, 99)]
+    assert checkpoint.get_cursor(11, 49) == 'c10'
+    assert checkpoint.get_cursor(12, 49) == ''
+
+def test_complete_waits_for_outstanding_blocks(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.load_block_pool([(0, 49), (50, 99)])
+
+    checkpoint.track(49, 40, 'c40')
+    checkpoint.complete(49)
+    assert checkpoint.pending_ranges() == [(0, 49), (50, 99)]
+
+    checkpoint.acknowledge()
+    assert checkpoint.pending_ranges() == [(50, 99)]
+
+    # Ranges without any tracked block are complete right away
+    checkpoint.complete(99)
+    assert not checkpoint.pending_ranges()
+
+def test_acknowledge_more_than_tracked(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.load_block_pool([(0, 99)])
+
+    checkpoint.track(99, 5, 'c5')
+    checkpoint.acknowledge(10)
+    checkpoint.acknowledge()
+
+    assert checkpoint.pending_ranges() == [(6, 99)]
+
+def test_split_range_moves_tracked_blocks(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.load_block_pool([(0, 99)])
+
+    checkpoint.track(99, 10, 'c10')
+    checkpoint.track(99, 70, 'c70')
+    checkpoint.split_range(99, 49)
+    checkpoint.complete(49)
+    checkpoint.acknowledge(2)
+
+    assert checkpoint.pending_ranges() == [(71, 99)]
+    assert checkpoint.ranges[49]['block'] == 49
+
+def test_save_and_load_resumes_pending_ranges(tmp_path):
+    flushed = []
+    checkpoint = make_checkpoint(tmp_path, flush=lambda: flushed.append(True))
+    checkpoint.load_block_pool([(0, 49), (50, 99)])
+    checkpoint.track(49, 20, 'c20')
+    checkpoint.acknowledge()
+    checkpoint.complete(99)
+    checkpoint.save()
+
+    assert flushed
+    assert not (tmp_path / 'checkpoint.json.tmp').exists()
+    with open(tmp_path / 'checkpoint.json', 'r', encoding='utf8') as checkpoint_file:
+        assert json.load(checkpoint_file)['period_end'] == 99
+
+    loaded = Checkpoint.load(str(tmp_path / 'checkpoint.json'))
+    # The saved block pool takes precedence over the given ranges
+    assert loaded.load_block_pool([(0, 99)]) == [(21, 49)]
+    assert loaded.get_cursor(21, 49) == 'c20'
+
+def test_acknowledge_saves_after_interval(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 0, 99, save_interval=0.)
+    checkpoint.load_block_pool([(0, 99)])
+    checkpoint.track(99, 0, 'c0')
+    checkpoint.acknowledge()
+
+    assert Checkpoint.load(str(tmp_path / 'checkpoint.json')).pending_ranges() == [(1, 99)]
+
+def test_remove(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.save()
+    checkpoint.remove()
+    checkpoint.remove()
+
+    assert not (tmp_path / 'checkpoint.json').exists()
@@ -0,0 +1,167 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring, redefined-outer-name
+
+import io
+import json
+import os
+
+import pytest
+
+from substreams_firehose.sinks.compression import (
+    EXTENSIONS, CompressedFile, open_compressed, read_frame, scan_frames, split_extension
+)
+
+# Rows of different sizes, each written at once
+ROWS = [f'{{"number": {number}, "data": "{"x" * (number % 97)}"}}\n'.encode() for number in range(2000)]
+
+@pytest.fixture(params=['gzip', 'zstd'])
+def compression(request) -> str:
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    return request.param
+
+@pytest.fixture
+def path(tmp_path, compression) -> str:
+    return str(tmp_path / f'output.jsonl{EXTENSIONS[compression]}')
+
+def write_rows(path: str, compression: str, rows, append: bool = False, **kwargs) -> None:
+    with CompressedFile(path, compression, append=append, **kwargs) as file:
+        for row in rows:
+            file.write(row)
+
+def read_data(path: str, compression: str) -> bytes:
+    with open_compressed(path, compression, binary=True) as file:
+        return file.read()
+
+def read_index(path: str) -> list[dict]:
+    with open(f'{path}.index', 'r', encoding='utf8') as index:
+        return [json.loads(line) for line in index]
+
+def check_index(path: str, compression: str) -> list[dict]:
+    """
+    Check that the index entries cover the whole file and that each frame holds whole rows.
+    """
+    frames = read_index(path)
+    data = read_data(path, compression)
+    offset = uncompressed_offset = 0
+    for frame in frames:
+        assert frame['offset'] == offset
+        assert frame['uncompressed_offset'] == uncompressed_offset
+
+        frame_data = read_frame(path, frame)
+        assert frame_data == data[uncompressed_offset:uncompressed_offset + frame['uncompressed_size']]
+        assert frame_data.endswith(b'\n')
+
+        offset += frame['size']
+        uncompressed_offset += frame['uncompressed_size']
+
+    assert offset == os.path.getsize(path)
+    assert uncompressed_offset == len(data)
+    return frames
+
+def test_frames_are_indexed(path, compression):
+    write_rows(path, compression, ROWS, frame_size=10000, workers=2)
+
+    assert read_data(path, compression) == b''.join(ROWS)
+    frames = check_index(path, compression)
+    assert len(frames) > 5
+    assert all(frame['uncompressed_size'] >= 10000 for frame in frames[:-1])
+
+    with open(path, 'rb') as file:
+        assert [size for size, _ in scan_frames(file, compression, chunk_size=1000)] == [frame['size'] for frame in frames]
+
+def test_text_wrapper(path, compression):
+    with io.TextIOWrapper(CompressedFile(path, compression), encoding='utf8', newline='', write_through=True) as file:
+        file.write('a\n')
+        file.write('b\n')
+
+    with open_compressed(path, compression) as file:
+        assert file.read() == 'a\nb\n'
+
+def test_flush_keeps_small_frames_in_tail(path, compression):
+    file = CompressedFile(path, compression, frame_size=1 << 20, min_frame_size=5000)
+    try:
+        file.write(ROWS[0])
+        file.flush()
+
+        assert not read_index(path)
+        with open(f'{path}.tail', 'rb') as tail:
+            assert tail.read() == bytes(8) + ROWS[0]
+
+        # Flushing at least `min_frame_size` bytes ends the frame
+        for row in ROWS[1:200]:
+            file.write(row)
+        file.flush()
+
+        assert len(read_index(path)) == 1
+        assert not os.path.exists(f'{path}.tail')
+        assert read_data(path, compression) == b''.join(ROWS[:200])
+
+        file.write(ROWS[200])
+    finally:
+        file.close()
+
+    assert not os.path.exists(f'{path}.tail')
+    assert read_data(path, compression) == b''.join(ROWS[:201])
+    assert len(check_index(path, compression)) == 2
+
+def test_append(path, compression):
+    write_rows(path, compression, ROWS[:1000], frame_size=10000)
+    write_rows(path, compression, ROWS[1000:], append=True, frame_size=10000)
+
+    assert read_data(path, compression) == b''.join(ROWS)
+    check_index(path, compression)
+
+def test_append_indexes_unindexed_frames(path, compression):
+    write_rows(path, compression, ROWS, frame_size=10000)
+    frames = read_index(path)
+    # Interrupted after writing the frames, while writing the index
+    with open(f'{path}.index', 'w', encoding='utf8') as index:
+        index.writelines(json.dumps(frame) + '\n' for frame in frames[:2])
+        index.write('{"offset": ')
+
+    write_rows(path, compression, [], append=True)
+
+    assert read_index(path) == frames
+    assert read_data(path, compression) == b''.join(ROWS)
+
+def test_append_drops_incomplete_frame(path, compression):
+    write_rows(path, compression, ROWS, frame_size=10000)
+    frames = read_index(path)
+    os.truncate(path, frames[-1]['offset'] + frames[-1]['size'] // 2)
+
+    write_rows(path, compression, [b'end\n'], append=True)
+
+    data = b''.join(ROWS)[:frames[-1]['uncompressed_offset']] + b'end\n'
+    assert read_data(path, compression) == data
+    check_index(path, compression)
+
+def test_append_writes_back_tail(path, compression):
+    write_rows(path, compression, ROWS[:100])
+    size = len(b''.join(ROWS[:100]))
+    # Interrupted after flushing the tail file, some of its data having been written to a frame since
+    with open(f'{path}.tail', 'wb') as tail:
+        tail.write((size - len(ROWS[99])).to_bytes(8, 'big') + ROWS[99] + ROWS[100])
+
+    write_rows(path, compression, ROWS[101:], append=True)
+
+    assert read_data(path, compression) == b''.join(ROWS)
+    assert not os.path.exists(f'{path}.tail')
+    check_index(path, compression)
+
+def test_overwrite_removes_tail(path, compression):
+    with open(f'{path}.tail', 'wb') as tail:
+        tail.write(bytes(8) + b'stale\n')
+
+    write_rows(path, compression, ROWS[:10])
+
+    assert read_data(path, compression) == b''.join(ROWS[:10])
+    assert not os.path.exists(f'{path}.tail')
+
+def test_split_extension():
+    assert split_extension('out/eth.jsonl.gz') == ('out/eth', '.jsonl', '.gz')
+    assert split_extension('out/eth.binpb.zst') == ('out/eth', '.binpb', '.zst')
+    assert split_extension('out/eth.csv') == ('out/eth', '.csv', '')
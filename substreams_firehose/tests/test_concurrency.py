@@ -0,0 +1,65 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring, redefined-outer-name
+
+import pytest
+
+from substreams_firehose.block_extractors import concurrency
+from substreams_firehose.block_extractors.concurrency import ConcurrencyController
+
+# Current time of the fake `time.perf_counter` used by the controller
+CLOCK = [0.]
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    CLOCK[0] = 0.
+    monkeypatch.setattr(concurrency.time, 'perf_counter', lambda: CLOCK[0])
+
+def complete(controller: ConcurrencyController, throughput: float, running: int | None = None) -> None:
+    """
+    Register a worker extracting 100 blocks at `throughput` blocks/s, all the workers allowed running by default.
+    """
+    started = CLOCK[0]
+    CLOCK[0] += 100 / throughput
+    controller.on_success(started, 100, controller.max_tasks if running is None else running)
+
+def test_increases_once_per_round():
+    controller = ConcurrencyController(initial_limit=10)
+    for _ in range(11):
+        complete(controller, 100)
+
+    # The first completion gives no throughput trend
+    assert 10.9 < controller.limit < 11
+    complete(controller, 100)
+    assert controller.max_tasks == 11
+
+def test_holds_limit_when_not_in_use():
+    controller = ConcurrencyController(initial_limit=10)
+    for _ in range(100):
+        complete(controller, 100, running=5)
+
+    assert controller.limit == 10
+
+def test_holds_limit_when_throughput_degrades():
+    controller = ConcurrencyController(initial_limit=10)
+    # Slowing down within the latency tolerance
+    for throughput in range(100, 80, -1):
+        complete(controller, throughput)
+
+    assert controller.limit == 10
+
+def test_decreases_on_rising_latency():
+    controller = ConcurrencyController(initial_limit=10)
+    for throughput in (100, 10, 10, 10):
+        complete(controller, throughput)
+
+    assert controller.max_tasks == 5
+
+def test_bounded_by_max_limit():
+    controller = ConcurrencyController(initial_limit=10, max_limit=12)
+    for _ in range(100):
+        complete(controller, 100)
+
+    assert controller.max_tasks == 12
@@ -0,0 +1,85 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring, redefined-outer-name, unused-argument
+
+import asyncio
+import logging
+
+import pytest
+
+from substreams_firehose.block_extractors import async_multi_channel, async_optimized, async_single_channel
+from substreams_firehose.block_extractors.common import get_block_number
+from substreams_firehose.checkpoint import Checkpoint
+from substreams_firehose.config.parser import Config
+from substreams_firehose.mock_server import mock_server_process
+
+EXTRACTORS = {
+    'single': async_single_channel.asyncio_generator,
+    'multi': async_multi_channel.asyncio_generator,
+    'optimized': async_optimized.asyncio_generator,
+}
+
+# Small ranges for streaming the period on several workers
+EXTRACTOR_OPTIONS = {
+    'single': {'initial_tasks': 4, 'workload': 20},
+    'multi': {'initial_tasks': 2, 'workload': 20, 'channels': 2},
+    'optimized': {'initial_tasks': 4},
+}
+
+async def extract(extractor: str, start: int, end: int, limit: int | None = None, checkpoint: Checkpoint | None = None,
+                  **kwargs) -> list[int]:
+    """
+    Extract a block range, acknowledging each block to the checkpoint and stopping after `limit` blocks.
+    """
+    numbers = []
+    blocks = EXTRACTORS[extractor](period_start=start, period_end=end, checkpoint=checkpoint,
+                                   **EXTRACTOR_OPTIONS[extractor], **kwargs)
+    try:
+        async for block in blocks:
+            numbers.append(get_block_number(block))
+            if checkpoint:
+                checkpoint.acknowledge()
+            if len(numbers) == limit:
+                break
+    finally:
+        await blocks.aclose()
+
+    return numbers
+
+@pytest.mark.parametrize('extractor', list(EXTRACTORS))
+def test_extracts_each_block_once(mock_config, extractor):
+    numbers = asyncio.run(extract(extractor, 0, 199))
+
+    assert sorted(numbers) == list(range(200))
+
+@pytest.mark.parametrize('extractor', list(EXTRACTORS))
+def test_ordered_extraction(mock_config, extractor):
+    assert asyncio.run(extract(extractor, 100, 299, ordered=True, reorder_size=50)) == list(range(100, 300))
+
+@pytest.mark.parametrize('extractor', list(EXTRACTORS))
+def test_retries_rejected_streams(mock_config, sample_blocks, caplog, extractor):
+    # Streams over the limit fail with a `RESOURCE_EXHAUSTED` status, retried with less workers
+    with mock_server_process(sample_blocks, max_streams=2) as port:
+        Config.GRPC_ENDPOINT = f'localhost:{port}'
+        with caplog.at_level(logging.WARNING):
+            numbers = asyncio.run(extract(extractor, 0, 199))
+
+    assert sorted(numbers) == list(range(200))
+    assert any('RESOURCE_EXHAUSTED' in record.getMessage() for record in caplog.records)
+
+@pytest.mark.parametrize('extractor', list(EXTRACTORS))
+def test_resumes_from_checkpoint(mock_config, tmp_path, extractor):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 0, 299)
+    first = asyncio.run(extract(extractor, 0, 299, limit=100, checkpoint=checkpoint))
+    checkpoint.save()
+
+    checkpoint = Checkpoint.load(str(tmp_path / 'checkpoint.json'))
+    assert checkpoint.pending_ranges()
+    second = asyncio.run(extract(extractor, 0, 299, checkpoint=checkpoint))
+
+    # Acknowledged blocks are not extracted again
+    assert not set(first) & set(second)
+    assert sorted(first + second) == list(range(300))
+    assert not checkpoint.pending_ranges()
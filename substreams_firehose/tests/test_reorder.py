@@ -0,0 +1,125 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring
+
+import asyncio
+
+from substreams_firehose.block_extractors.reorder import ReorderBuffer
+from substreams_firehose.checkpoint import Checkpoint
+
+def drain_queue(block_queue: asyncio.Queue) -> list:
+    blocks = []
+    while not block_queue.empty():
+        blocks.append(block_queue.get_nowait())
+    return blocks
+
+def test_releases_blocks_in_order():
+    async def run():
+        block_queue = asyncio.Queue()
+        buffer = ReorderBuffer(block_queue, [(0, 9), (10, 19)])
+
+        # The second range is streamed first and held until the first one covers its blocks
+        for block_number in (10, 12):
+            await buffer.put(10, 19, block_number, '', block_number)
+            await buffer.cover(10, block_number)
+        assert not drain_queue(block_queue)
+        assert len(buffer) == 2
+
+        for block_number in (0, 5, 9):
+            await buffer.put(0, 9, block_number, '', block_number)
+            await buffer.cover(0, block_number)
+
+        assert drain_queue(block_queue) == [0, 5, 9, 10, 12]
+        assert not buffer
+        assert buffer.watermark == 12
+
+    asyncio.run(run())
+
+def test_skips_gaps_between_ranges():
+    async def run():
+        block_queue = asyncio.Queue()
+        # Blocks 10 to 19 are not extracted (e.g. resumed extraction)
+        buffer = ReorderBuffer(block_queue, [(20, 29), (0, 9)])
+
+        await buffer.put(20, 29, 20, '', 20)
+        await buffer.cover(20, 20)
+        assert not drain_queue(block_queue)
+
+        await buffer.cover(0, 9)
+        assert drain_queue(block_queue) == [20]
+        assert buffer.is_head(21)
+
+    asyncio.run(run())
+
+def test_put_waits_for_room():
+    async def run():
+        block_queue = asyncio.Queue()
+        buffer = ReorderBuffer(block_queue, [(0, 9), (10, 19)], max_size=1)
+
+        await buffer.put(10, 19, 10, '', 10)
+        blocked = asyncio.create_task(buffer.put(10, 19, 11, '', 11))
+        await asyncio.sleep(0)
+        assert not blocked.done()
+
+        # The head range is never paused
+        await asyncio.wait_for(buffer.put(0, 9, 0, '', 0), 1)
+        await buffer.cover(0, 9)
+        await asyncio.wait_for(blocked, 1)
+        await buffer.cover(10, 11)
+
+        assert drain_queue(block_queue) == [0, 10, 11]
+
+    asyncio.run(run())
+
+def test_tracks_released_blocks_and_completes_ranges(tmp_path):
+    async def run():
+        checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 0, 19, save_interval=3600.)
+        checkpoint.load_block_pool([(0, 9), (10, 19)])
+        block_queue = asyncio.Queue()
+        buffer = ReorderBuffer(block_queue, [(0, 9), (10, 19)], checkpoint=checkpoint)
+
+        await buffer.put(10, 19, 15, 'c15', 15)
+        await buffer.cover(10, 19)
+        await buffer.complete(19)
+        await buffer.put(0, 9, 3, 'c3', 3)
+        await buffer.cover(0, 9)
+        await buffer.complete(9)
+
+        assert drain_queue(block_queue) == [3, 15]
+        checkpoint.acknowledge(2)
+        assert not checkpoint.pending_ranges()
+
+    asyncio.run(run())
+
+def test_split_range_reassigns_held_blocks(tmp_path):
+    async def run():
+        checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 0, 29, save_interval=3600.)
+        checkpoint.load_block_pool([(0, 9), (10, 29)])
+        buffer = ReorderBuffer(asyncio.Queue(), [(0, 9), (10, 29)], checkpoint=checkpoint)
+
+        await buffer.put(10, 29, 12, 'c12', 12)
+        await buffer.put(10, 29, 25, 'c25', 25)
+        checkpoint.split_range(29, 19)
+        buffer.split_range(29, 19)
+        await buffer.cover(0, 29)
+        checkpoint.acknowledge(2)
+
+        assert checkpoint.get_cursor(13, 19) == 'c12'
+        assert checkpoint.get_cursor(26, 29) == 'c25'
+
+    asyncio.run(run())
+
+def test_drain_releases_out_of_order_blocks():
+    async def run():
+        block_queue = asyncio.Queue()
+        buffer = ReorderBuffer(block_queue, [(0, 9), (10, 19)])
+
+        await buffer.put(10, 19, 14, '', 14)
+        await buffer.put(10, 19, 11, '', 11)
+        await buffer.drain()
+
+        assert drain_queue(block_queue) == [11, 14]
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring, redefined-outer-name, unused-argument
+
+import asyncio
+
+import pytest
+
+from substreams_firehose.block_extractors import async_optimized, async_single_channel, replay
+from substreams_firehose.block_extractors.common import RawBlock, decode_block, get_block_number, unpack_block
+from substreams_firehose.capture import Recorder, read_capture_metadata, read_records
+from substreams_firehose.checkpoint import Checkpoint
+from substreams_firehose.config.parser import Config
+from substreams_firehose.mock_server import CaptureSource, MockServer
+
+async def collect(blocks) -> dict[int, bytes]:
+    """
+    Get the serialized blocks of an extraction by block number, checking that each block is extracted once.
+    """
+    extracted = {}
+    async for block in blocks:
+        number = get_block_number(block)
+        assert number not in extracted
+        extracted[number] = block.SerializeToString()
+
+    return extracted
+
+def record(directory: str, start: int, end: int, append: bool = False) -> dict[int, bytes]:
+    recorder = Recorder(directory, append=append, batch_size=1000)
+    recorder.open(start, end)
+    try:
+        return asyncio.run(collect(async_optimized.asyncio_generator(start, end, initial_tasks=4, recorder=recorder)))
+    finally:
+        recorder.close()
+
+@pytest.fixture
+def capture(mock_config, tmp_path) -> tuple[str, dict[int, bytes]]:
+    """
+    Capture directory recording blocks 0 to 199 and the extracted blocks.
+    """
+    directory = str(tmp_path / 'capture')
+    return directory, record(directory, 0, 199)
+
+def test_recorded_metadata(capture):
+    directory, extracted = capture
+    metadata = read_capture_metadata(directory)
+
+    assert (metadata['chain'], metadata['period_start'], metadata['period_end']) == ('LOCAL', 0, 199)
+    assert metadata['response_type'] == 'sf.firehose.v2.Response'
+    assert metadata['responses'] == len(extracted)
+    assert sorted(number for number, _ in read_records(directory)) == list(range(200))
+
+def test_replays_recorded_blocks(capture):
+    directory, extracted = capture
+
+    assert asyncio.run(collect(replay.asyncio_generator(0, 199, directory))) == extracted
+    assert asyncio.run(collect(replay.asyncio_generator(50, 99, directory))) == {
+        number: extracted[number] for number in range(50, 100)
+    }
+
+def test_replayed_blocks_are_unpacked(capture):
+    directory, _ = capture
+
+    async def replay_blocks():
+        return [unpack_block(block) async for block in replay.asyncio_generator(0, 9, directory, ordered=True)]
+
+    blocks = asyncio.run(replay_blocks())
+    assert [block.DESCRIPTOR.full_name for block in blocks] == ['sf.ethereum.type.v2.Block'] * 10
+    assert [block.number for block in blocks] == list(range(10))
+
+def test_ordered_lazy_replay(capture):
+    directory, extracted = capture
+
+    async def replay_blocks():
+        return [block async for block in replay.asyncio_generator(0, 199, directory, lazy_decoding=True, ordered=True)]
+
+    blocks = asyncio.run(replay_blocks())
+    assert all(isinstance(block, RawBlock) for block in blocks)
+    assert [get_block_number(decode_block(block)) for block in blocks] == list(range(200))
+    assert [decode_block(block).SerializeToString() for block in blocks] == [extracted[number] for number in range(200)]
+
+def test_replay_checkpoint(capture, tmp_path):
+    directory, _ = capture
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 0, 199)
+
+    async def replay_blocks():
+        async for _ in replay.asyncio_generator(0, 199, directory, checkpoint=checkpoint):
+            checkpoint.acknowledge()
+
+    asyncio.run(replay_blocks())
+    assert not checkpoint.pending_ranges()
+
+def test_appended_recording_keeps_first_records(capture):
+    directory, extracted = capture
+    appended = record(directory, 100, 299, append=True)
+
+    assert read_capture_metadata(directory)['responses'] == len(extracted) + len(appended)
+    assert asyncio.run(collect(replay.asyncio_generator(0, 299, directory))) == {**appended, **extracted}
+
+def test_mock_server_serves_capture(capture):
+    directory, extracted = capture
+
+    async def serve_capture():
+        server = MockServer(None, capture=CaptureSource(directory))
+        Config.GRPC_ENDPOINT = f'localhost:{await server.start()}'
+        try:
+            return await collect(async_single_channel.asyncio_generator(0, 199, initial_tasks=4, workload=20))
+        finally:
+            await server.stop()
+
+    assert asyncio.run(serve_capture()) == extracted
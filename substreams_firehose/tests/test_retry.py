@@ -0,0 +1,100 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring
+
+import asyncio
+
+import grpc
+import pytest
+
+from substreams_firehose.block_extractors import retry
+from substreams_firehose.block_extractors.retry import RetryDecision, RetryHandler
+from substreams_firehose.config.parser import RetryPolicy
+from substreams_firehose.exceptions import BlockStreamException
+
+def stream_error(failed: int, code: grpc.StatusCode | None = None) -> BlockStreamException:
+    error = BlockStreamException(0, 99, failed)
+    error.__cause__ = grpc.aio.AioRpcError(code, grpc.aio.Metadata(), grpc.aio.Metadata()) if code else TimeoutError()
+    return error
+
+def test_exponential_backoff():
+    handler = RetryHandler(RetryPolicy(max_retries=5, backoff=1., max_backoff=5., jitter=0.))
+
+    assert [asyncio.run(handler.handle(stream_error(10))).delay for _ in range(5)] == [1., 2., 4., 5., 5.]
+    assert handler.retries == 5
+
+def test_jitter_reduces_delay():
+    handler = RetryHandler(RetryPolicy(max_retries=100, backoff=1., max_backoff=1., jitter=0.5))
+
+    assert all(0.5 <= asyncio.run(handler.handle(stream_error(10))).delay <= 1. for _ in range(100))
+
+def test_max_retries_per_block():
+    handler = RetryHandler(RetryPolicy(max_retries=2, backoff=0.))
+
+    assert asyncio.run(handler.handle(stream_error(10))) is not None
+    assert asyncio.run(handler.handle(stream_error(10))) is not None
+    assert asyncio.run(handler.handle(stream_error(10))) is None
+    # Retries are counted for each failed block
+    assert asyncio.run(handler.handle(stream_error(11))) is not None
+    assert handler.retries == 3
+
+def test_budget_exhausted():
+    handler = RetryHandler(RetryPolicy(budget=2, backoff=0.))
+    asyncio.run(handler.handle(stream_error(10)))
+    asyncio.run(handler.handle(stream_error(20)))
+
+    error = stream_error(30)
+    with pytest.raises(BlockStreamException) as raised:
+        asyncio.run(handler.handle(error))
+    assert raised.value is error
+
+@pytest.mark.parametrize('code, congestion', [
+    (grpc.StatusCode.INTERNAL, False),
+    (grpc.StatusCode.UNAVAILABLE, True),
+    (grpc.StatusCode.RESOURCE_EXHAUSTED, True),
+    (None, False),
+])
+def test_status_actions(code, congestion):
+    handler = RetryHandler(RetryPolicy(backoff=0.))
+
+    assert asyncio.run(handler.handle(stream_error(10, code))) == RetryDecision(0., congestion)
+
+@pytest.mark.parametrize('code', [grpc.StatusCode.INVALID_ARGUMENT, grpc.StatusCode.PERMISSION_DENIED])
+def test_fail_action(code):
+    handler = RetryHandler(RetryPolicy())
+
+    with pytest.raises(BlockStreamException):
+        asyncio.run(handler.handle(stream_error(10, code)))
+    assert handler.retries == 0
+
+def test_custom_status_actions():
+    handler = RetryHandler(RetryPolicy(backoff=0., status_actions={'INTERNAL': 'fail'}))
+
+    assert asyncio.run(handler.handle(stream_error(10, grpc.StatusCode.UNAVAILABLE))) == RetryDecision(0., False)
+    with pytest.raises(BlockStreamException):
+        asyncio.run(handler.handle(stream_error(10, grpc.StatusCode.INTERNAL)))
+
+def test_refresh_token_once_per_interval(monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(retry, 'refresh_auth_token', lambda: refreshes.append(True))
+
+    async def run():
+        handler = RetryHandler(RetryPolicy(max_retries=10, backoff=0.), refresh_interval=3600.)
+        decisions = await asyncio.gather(*(
+            handler.handle(stream_error(failed, grpc.StatusCode.UNAUTHENTICATED)) for failed in range(5)
+        ))
+        assert decisions == [RetryDecision(0., False)] * 5
+
+    asyncio.run(run())
+    assert len(refreshes) == 1
+
+def test_refresh_token_error_still_retries(monkeypatch):
+    def refresh_auth_token():
+        raise RuntimeError('Authentication failed')
+    monkeypatch.setattr(retry, 'refresh_auth_token', refresh_auth_token)
+
+    handler = RetryHandler(RetryPolicy(backoff=0.))
+
+    assert asyncio.run(handler.handle(stream_error(10, grpc.StatusCode.UNAUTHENTICATED))) == RetryDecision(0., False)
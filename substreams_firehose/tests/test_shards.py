@@ -0,0 +1,171 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring
+
+import gzip
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from substreams_firehose.sinks.common import BlockEnd
+from substreams_firehose.sinks.jsonl import JsonlSink
+from substreams_firehose.sinks.shards import ShardedSink
+
+def block_rows(block_numbers, rows_per_block: int = 2) -> list:
+    rows = []
+    for block_number in block_numbers:
+        rows.extend({'number': block_number, 'row': row} for row in range(rows_per_block))
+        rows.append(BlockEnd(block_number))
+    return rows
+
+def read_manifest(path) -> list[dict]:
+    with open(path, 'r', encoding='utf8') as manifest:
+        return [json.loads(line) for line in manifest]
+
+def read_shard(path) -> list[dict]:
+    with (gzip.open(path, 'rt', encoding='utf8') if path.endswith('.gz') else open(path, 'r', encoding='utf8')) as shard:
+        return [json.loads(line) for line in shard]
+
+def test_rolls_shards_on_max_blocks(tmp_path):
+    with ShardedSink(str(tmp_path / 'eth.jsonl'), JsonlSink, max_blocks=10) as sink:
+        sink.write_batch(block_rows(range(0, 15)))
+        sink.write_batch(block_rows(range(15, 25)))
+
+    manifest = read_manifest(tmp_path / 'eth.manifest.jsonl')
+    assert [(entry['shard'], entry['path'], entry['first_block'], entry['last_block'], entry['blocks'], entry['rows'])
+            for entry in manifest] == [
+        (0, 'eth.00000.jsonl', 0, 9, 10, 20),
+        (1, 'eth.00001.jsonl', 10, 19, 10, 20),
+        (2, 'eth.00002.jsonl', 20, 24, 5, 10),
+    ]
+    assert sink.shards == 3
+    assert not (tmp_path / 'eth.manifest.jsonl.partial').exists()
+
+    for entry in manifest:
+        with open(tmp_path / entry['path'], 'rb') as shard:
+            data = shard.read()
+        assert entry['bytes'] == len(data)
+        assert entry['sha256'] == hashlib.sha256(data).hexdigest()
+        assert {row['number'] for row in read_shard(str(tmp_path / entry['path']))} == set(
+            range(entry['first_block'], entry['last_block'] + 1)
+        )
+
+def test_blocks_never_span_two_shards(tmp_path):
+    # The rows of a block are kept together (even across batches), the shards going over `max_rows`
+    rows = block_rows(range(0, 4), rows_per_block=2)
+    with ShardedSink(str(tmp_path / 'eth.jsonl'), JsonlSink, max_rows=3) as sink:
+        sink.write_batch(rows[:-2])
+        sink.write_batch(rows[-2:])
+
+    assert [(entry['first_block'], entry['last_block'], entry['rows'])
+            for entry in read_manifest(tmp_path / 'eth.manifest.jsonl')] == [(0, 1, 4), (2, 3, 4)]
+
+def test_rolls_shards_on_max_size(tmp_path):
+    # The size of a shard is measured after each batch
+    with ShardedSink(str(tmp_path / 'eth.jsonl'), JsonlSink, buffer_size=1, max_size=100) as sink:
+        for block_number in range(10):
+            sink.write_batch(block_rows([block_number]))
+
+    manifest = read_manifest(tmp_path / 'eth.manifest.jsonl')
+    assert len(manifest) > 1
+    assert sum(entry['blocks'] for entry in manifest) == 10
+    assert all(entry['bytes'] >= 100 for entry in manifest[:-1])
+
+def test_records_interleaved_block_ranges(tmp_path):
+    # Blocks of two workers streaming [0, 9] and [10, 19] concurrently
+    block_numbers = [number for pair in zip(range(0, 10), range(10, 20)) for number in pair]
+    with ShardedSink(str(tmp_path / 'eth.jsonl'), JsonlSink, max_blocks=6) as sink:
+        sink.write_batch(block_rows(block_numbers))
+
+    manifest = read_manifest(tmp_path / 'eth.manifest.jsonl')
+    assert [(entry['first_block'], entry['last_block'], entry['ranges']) for entry in manifest] == [
+        (0, 12, [[0, 2], [10, 12]]),
+        (3, 15, [[3, 5], [13, 15]]),
+        (6, 18, [[6, 8], [16, 18]]),
+        (9, 19, [[9, 9], [19, 19]]),
+    ]
+
+def test_writes_whole_batches_to_shard_sink(tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    from substreams_firehose.sinks.parquet import ParquetSink #pylint: disable=import-outside-toplevel
+
+    with ShardedSink(str(tmp_path / 'eth.parquet'), ParquetSink, max_blocks=10) as sink:
+        sink.write_batch(block_rows(range(0, 15)))
+        sink.write_batch(block_rows(range(15, 20)))
+
+    # One row group for each batch of each shard
+    assert [parquet.ParquetFile(tmp_path / f'eth.0000{shard}.parquet').num_row_groups for shard in range(2)] == [1, 2]
+    assert parquet.read_table(tmp_path / 'eth.00001.parquet').num_rows == 20
+
+def test_removes_empty_last_shard(tmp_path):
+    with ShardedSink(str(tmp_path / 'eth.jsonl'), JsonlSink, max_blocks=5) as sink:
+        sink.write_batch(block_rows(range(0, 5)))
+        sink.write_batch([])
+
+    assert len(read_manifest(tmp_path / 'eth.manifest.jsonl')) == 1
+    assert not (tmp_path / 'eth.00001.jsonl').exists()
+
+def test_flush_saves_current_shard_progress(tmp_path):
+    sink = ShardedSink(str(tmp_path / 'eth.jsonl'), JsonlSink, max_blocks=10)
+    sink.open()
+    sink.write_batch(block_rows(range(0, 12)))
+    sink.flush()
+
+    assert len(read_manifest(tmp_path / 'eth.manifest.jsonl')) == 1
+    with open(tmp_path / 'eth.manifest.jsonl.partial', 'r', encoding='utf8') as partial:
+        assert json.load(partial) == {
+            'shard': 1,
+            'path': str(tmp_path / 'eth.00001.jsonl'),
+            'first_block': 10,
+            'last_block': 11,
+            'ranges': [[10, 11]],
+            'blocks': 2,
+            'rows': 4,
+        }
+
+    sink.close()
+    assert not (tmp_path / 'eth.manifest.jsonl.partial').exists()
+
+# Writes blocks 0 to 14 to shards of 10 blocks and exits without closing the sink
+INTERRUPTED_EXTRACTION = '''
+import os, sys
+from substreams_firehose.sinks.common import BlockEnd
+from substreams_firehose.sinks.jsonl import JsonlSink
+from substreams_firehose.sinks.shards import ShardedSink
+
+sink = ShardedSink(sys.argv[1], JsonlSink, max_blocks=10, compression=sys.argv[2] or None)
+sink.open()
+for block_number in range(15):
+    sink.write_batch([{'number': block_number}, BlockEnd(block_number)])
+sink.flush()
+os._exit(0)
+'''
+
+@pytest.mark.parametrize('compression, extension', [(None, '.jsonl'), ('gzip', '.jsonl.gz')])
+def test_append_adds_unfinished_shard(tmp_path, compression, extension):
+    path = str(tmp_path / f'eth{extension}')
+    subprocess.run([sys.executable, '-c', INTERRUPTED_EXTRACTION, path, compression or ''], check=True,
+                   env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+    assert len(read_manifest(tmp_path / 'eth.manifest.jsonl')) == 1
+
+    with ShardedSink(path, JsonlSink, append=True, max_blocks=10, compression=compression) as sink:
+        sink.write_batch([{'number': 15}, BlockEnd(15)])
+
+    manifest = read_manifest(tmp_path / 'eth.manifest.jsonl')
+    assert [(entry['shard'], entry['path'], entry['first_block'], entry['last_block']) for entry in manifest] == [
+        (0, f'eth.00000{extension}', 0, 9),
+        (1, f'eth.00001{extension}', 10, 14),
+        (2, f'eth.00002{extension}', 15, 15),
+    ]
+    for entry in manifest:
+        assert [row['number'] for row in read_shard(str(tmp_path / entry['path']))] == list(
+            range(entry['first_block'], entry['last_block'] + 1)
+        )
+        with open(tmp_path / entry['path'], 'rb') as shard:
+            assert entry['sha256'] == hashlib.sha256(shard.read()).hexdigest()
@@ -0,0 +1,122 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring, no-member
+
+import csv
+import gzip
+import json
+
+import pytest
+from google.protobuf.struct_pb2 import Struct #pylint: disable=no-name-in-module
+
+from substreams_firehose.sinks.compression import open_compressed
+from substreams_firehose.sinks.protobuf import encode_varint, read_delimited
+from substreams_firehose.sort import sort_file, sort_key
+
+# Rows with duplicate keys, `index` being their position in the input file
+ROWS = [{'number': str(number % 7), 'block': {'number': number % 5}, 'index': index} for index, number in enumerate(range(200, 0, -1))]
+
+def write_jsonl(path, rows) -> None:
+    with open(path, 'w', encoding='utf8') as file:
+        file.writelines(json.dumps(row) + '\n' for row in rows)
+
+def read_jsonl(path) -> list[dict]:
+    with open(path, 'r', encoding='utf8') as file:
+        return [json.loads(line) for line in file]
+
+def stable_sort(rows, key) -> list[dict]:
+    return sorted(rows, key=lambda row: int(key(row)))
+
+def test_sort_key_order():
+    values = [None, 'b', 10, '9', 2.5, 'a', {'a': 1}, '-1']
+
+    assert sorted(values, key=sort_key) == ['-1', None, 2.5, '9', 10, 'a', 'b', {'a': 1}]
+
+@pytest.mark.parametrize('memory, fan_in, parallel', [
+    (512 << 20, 64, 1),
+    # One run per row and several merge passes
+    (1, 2, 1),
+    (1000, 3, 2),
+])
+def test_sort_jsonl_is_stable(tmp_path, memory, fan_in, parallel):
+    write_jsonl(tmp_path / 'input.jsonl', ROWS)
+
+    count = sort_file(str(tmp_path / 'input.jsonl'), str(tmp_path / 'output.jsonl'), 'number',
+                      memory=memory, temp_dir=str(tmp_path), parallel=parallel, fan_in=fan_in)
+
+    assert count == len(ROWS)
+    assert read_jsonl(tmp_path / 'output.jsonl') == stable_sort(ROWS, lambda row: row['number'])
+
+def test_sort_jsonl_nested_key_and_missing_values(tmp_path):
+    rows = ROWS[:20] + [{'index': -1}]
+    write_jsonl(tmp_path / 'input.jsonl', rows[::-1])
+
+    sort_file(str(tmp_path / 'input.jsonl'), str(tmp_path / 'output.jsonl'), 'block.number', memory=100)
+
+    # Missing keys are sorted as 0 (e.g. block 0 without its number in the JSON encoding of the protobuf message)
+    output = read_jsonl(tmp_path / 'output.jsonl')
+    assert output == stable_sort(rows[::-1], lambda row: row.get('block', {}).get('number', 0))
+    assert output[0] == {'index': -1}
+
+def test_sort_creates_output_directory(tmp_path):
+    write_jsonl(tmp_path / 'input.jsonl', ROWS)
+
+    sort_file(str(tmp_path / 'input.jsonl'), str(tmp_path / 'sorted' / 'output.jsonl'), 'number')
+
+    assert read_jsonl(tmp_path / 'sorted' / 'output.jsonl') == stable_sort(ROWS, lambda row: row['number'])
+
+def test_sort_compressed_jsonl(tmp_path):
+    with gzip.open(tmp_path / 'input.jsonl.gz', 'wt', encoding='utf8') as file:
+        file.writelines(json.dumps(row) + '\n' for row in ROWS)
+
+    sort_file(str(tmp_path / 'input.jsonl.gz'), str(tmp_path / 'output.jsonl.zst'), 'number', memory=1000)
+
+    with open_compressed(str(tmp_path / 'output.jsonl.zst'), 'zstd') as file:
+        assert [json.loads(line) for line in file] == stable_sort(ROWS, lambda row: row['number'])
+
+def test_sort_csv(tmp_path):
+    with open(tmp_path / 'input.csv', 'w', encoding='utf8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['index', 'number', 'block'])
+        writer.writerows([row['index'], row['number'], json.dumps(row['block'])] for row in ROWS)
+
+    sort_file(str(tmp_path / 'input.csv'), str(tmp_path / 'output.csv'), 'block.number', memory=1000)
+
+    with open(tmp_path / 'output.csv', 'r', encoding='utf8', newline='') as file:
+        reader = csv.reader(file)
+        assert next(reader) == ['index', 'number', 'block']
+        assert [int(row[0]) for row in reader] == [
+            row['index'] for row in stable_sort(ROWS, lambda row: row['block']['number'])
+        ]
+
+def test_sort_csv_missing_column(tmp_path):
+    with open(tmp_path / 'input.csv', 'w', encoding='utf8') as file:
+        file.write('index\n0\n')
+
+    with pytest.raises(KeyError):
+        sort_file(str(tmp_path / 'input.csv'), str(tmp_path / 'output.csv'), 'number')
+
+def test_sort_protobuf(tmp_path):
+    with open(tmp_path / 'input.binpb', 'wb') as file:
+        for row in ROWS:
+            message = Struct()
+            message.update(row)
+            data = message.SerializeToString()
+            file.write(encode_varint(len(data)) + data)
+
+    sort_file(str(tmp_path / 'input.binpb'), str(tmp_path / 'output.binpb'), 'number', memory=1000)
+
+    with open(tmp_path / 'output.binpb', 'rb') as file:
+        indices = [int(Struct.FromString(row)['index']) for row in read_delimited(file)]
+    assert indices == [row['index'] for row in stable_sort(ROWS, lambda row: row['number'])]
+
+def test_sort_parquet(tmp_path):
+    pyarrow = pytest.importorskip('pyarrow')
+    parquet = pytest.importorskip('pyarrow.parquet')
+    parquet.write_table(pyarrow.Table.from_pylist(ROWS), tmp_path / 'input.parquet')
+
+    sort_file(str(tmp_path / 'input.parquet'), str(tmp_path / 'output.parquet'), 'number', memory=1000)
+
+    assert parquet.read_table(tmp_path / 'output.parquet').to_pylist() == stable_sort(ROWS, lambda row: row['number'])
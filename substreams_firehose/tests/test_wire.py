@@ -0,0 +1,58 @@
+"""
+SPDX-License-Identifier: MIT
+"""
+
+#pylint: disable=missing-function-docstring, no-member
+
+from google.protobuf import descriptor_pb2
+
+from substreams_firehose.block_processors.wire import prune_message
+
+def make_message() -> descriptor_pb2.DescriptorProto:
+    message = descriptor_pb2.DescriptorProto(name='Block')
+    message.field.add(name='number', number=1, type=descriptor_pb2.FieldDescriptorProto.TYPE_UINT64)
+    message.field.add(name='hash', number=300, type=descriptor_pb2.FieldDescriptorProto.TYPE_STRING)
+    message.nested_type.add(name='Header').field.add(name='parent_hash', number=1)
+    message.options.deprecated = True
+    return message
+
+def test_keeps_selected_fields():
+    message = make_message()
+    pruned = descriptor_pb2.DescriptorProto.FromString(prune_message(message.SerializeToString(), {1, 2}))
+
+    assert pruned.name == message.name
+    assert pruned.field == message.field
+    assert not pruned.nested_type
+    assert not pruned.HasField('options')
+
+def test_keeps_field_order_and_repeated_fields():
+    field = descriptor_pb2.FieldDescriptorProto(name='hash', number=300, json_name='hash', proto3_optional=True)
+    value = field.SerializeToString()
+    # `name` (1), `number` (3) and `json_name` (10) are kept, `proto3_optional` (17) is pruned
+    pruned = prune_message(value + value, {1, 3, 10})
+
+    assert descriptor_pb2.FieldDescriptorProto.FromString(pruned) == descriptor_pb2.FieldDescriptorProto(
+        name='hash', number=300, json_name='hash'
+    )
+    assert pruned == prune_message(value, {1, 3, 10}) * 2
+
+def test_skips_fixed_size_fields():
+    # Field 1 as fixed64, field 2 as fixed32, field 3 as a varint
+    value = b'\x09' + bytes(8) + b'\x15' + bytes(4) + b'\x18\x96\x01'
+
+    assert prune_message(value, {3}) == b'\x18\x96\x01'
+    assert prune_message(value, {1}) == b'\x09' + bytes(8)
+
+def test_returns_original_value_if_nothing_is_pruned():
+    value = make_message().SerializeToString()
+
+    assert prune_message(value, range(1, 11)) is value
+    assert prune_message(b'', {1}) == b''
+
+def test_returns_original_value_on_invalid_message():
+    value = make_message().SerializeToString()
+
+    # Truncated length-delimited field
+    assert prune_message(value[:-1], {1}) == value[:-1]
+    # Deprecated group
+    assert prune_message(b'\x0b\x0c', {2}) == b'\x0b\x0c'